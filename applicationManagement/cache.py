@@ -0,0 +1,308 @@
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseNotModified
+
+from common import metrics
+from common.db import reads_from_replica
+from common.geo import bounding_box, encode_geohash, geohash_cell_bounds, geohash_cells_in_box, haversine_km
+
+# Nearby results are cached per geohash cell of the user's location (~1.2km x 0.6km)
+NEARBY_CACHE_PRECISION = 6
+# Rings larger than this are not cached, which bounds the cells a shop write has to invalidate
+NEARBY_CACHE_MAX_RING_KM = 5.0
+
+DEFAULT_NEARBY_CACHE_SETTINGS = {
+    'BACKEND': 'locmem',
+    'TIMEOUT': 300,
+    'MAX_ENTRIES': 2048,
+    'CACHE_ALIAS': 'default',
+}
+
+
+class LocMemResultCache:
+    """In-process cache with a per-entry TTL and LRU eviction."""
+
+    def __init__(self, timeout, max_entries):
+        self.timeout = timeout
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.timeout, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def set_many(self, mapping):
+        for key, value in mapping.items():
+            self.set(key, value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class DjangoResultCache:
+    """Adapter over a Django cache framework alias, shared between processes."""
+
+    def __init__(self, timeout, alias):
+        self.timeout = timeout
+        self.cache = caches[alias]
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value):
+        self.cache.set(key, value, self.timeout)
+
+    def set_many(self, mapping):
+        self.cache.set_many(mapping, self.timeout)
+
+    def clear(self):
+        self.cache.clear()
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_nearby_cache():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                options = dict(DEFAULT_NEARBY_CACHE_SETTINGS, **getattr(settings, 'NEARBY_SHOPS_CACHE', {}))
+                if options['BACKEND'] == 'django':
+                    _backend = DjangoResultCache(options['TIMEOUT'], options['CACHE_ALIAS'])
+                else:
+                    _backend = LocMemResultCache(options['TIMEOUT'], options['MAX_ENTRIES'])
+    return _backend
+
+
+def _new_token(written=True):
+    # Random, so an evicted token never revives old entries, plus the time of the write that set it
+    return f'{uuid.uuid4().hex}:{time.time() if written else 0:.3f}'
+
+
+def _replica_may_lag(token):
+    """
+    True if this context reads from a replica and the token was set by a write
+    recent enough that the replica may not have it yet. Such results are served
+    but not cached, or the cache would keep pre-write data until the next write.
+    """
+    if not reads_from_replica():
+        return False
+    written_at = float(token.rsplit(':', 1)[-1]) if ':' in token else 0.0
+    return time.time() - written_at < getattr(settings, 'REPLICA_PIN_SECONDS', 5)
+
+
+def _cell_half_diagonal_km(cell):
+    min_lat, max_lat, min_lon, max_lon = geohash_cell_bounds(cell)
+    return haversine_km(min_lat, min_lon, max_lat, max_lon) / 2
+
+
+def _cell_generation(cache, cell):
+    # Generations are random tokens so an evicted generation can never revive stale entries
+    key = f'nearby:gen:{cell}'
+    generation = cache.get(key)
+    if generation is None:
+        generation = _new_token(written=False)
+        cache.set(key, generation)
+    return generation
+
+
+def cached_nearby_candidates(latitude, longitude, ring_km, fetch):
+    """
+    Return the candidate shop rows for a ring around the user, served from the
+    cache entry of the user's geohash cell when possible.
+
+    A cache entry holds every shop within ring_km plus the cell's half diagonal
+    of the cell centre, which is a superset of the ring for any user inside that
+    cell, so callers still get exact distances from the user's own location.
+    """
+    if ring_km > NEARBY_CACHE_MAX_RING_KM:
+        return fetch(latitude, longitude, ring_km)
+
+    cache = get_nearby_cache()
+    cell = encode_geohash(latitude, longitude, NEARBY_CACHE_PRECISION)
+    generation = _cell_generation(cache, cell)
+    key = f'nearby:{cell}:{ring_km:g}:{generation}'
+
+    rows = cache.get(key)
+    if rows is not None:
+        metrics.incr('nearby_cache.hits')
+        return rows
+
+    metrics.incr('nearby_cache.misses')
+    min_lat, max_lat, min_lon, max_lon = geohash_cell_bounds(cell)
+    rows = fetch((min_lat + max_lat) / 2, (min_lon + max_lon) / 2, ring_km + _cell_half_diagonal_km(cell))
+    if not _replica_may_lag(generation):
+        cache.set(key, rows)
+    return rows
+
+
+def invalidate_nearby_cache(*locations):
+    """
+    Drop the cached entries of every cell whose cached area can contain one of the
+    given (latitude, longitude) shop locations, e.g. a shop's old and new coordinates.
+    """
+    cells = set()
+    for latitude, longitude in locations:
+        if latitude is None or longitude is None:
+            continue
+        half_diagonal_km = _cell_half_diagonal_km(encode_geohash(latitude, longitude, NEARBY_CACHE_PRECISION))
+        min_lat, max_lat, min_lon, max_lon = bounding_box(
+            latitude, longitude, NEARBY_CACHE_MAX_RING_KM + 2 * half_diagonal_km)
+        cells |= geohash_cells_in_box(min_lat, max_lat, min_lon, max_lon, NEARBY_CACHE_PRECISION)
+
+    if cells:
+        get_nearby_cache().set_many({f'nearby:gen:{cell}': _new_token() for cell in cells})
+        metrics.incr('nearby_cache.invalidated_cells', len(cells))
+
+
+DEFAULT_SHOP_SERVICES_CACHE_SETTINGS = {
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': 600,
+}
+
+
+def _shop_services_cache():
+    options = dict(DEFAULT_SHOP_SERVICES_CACHE_SETTINGS, **getattr(settings, 'SHOP_SERVICES_CACHE', {}))
+    return caches[options['CACHE_ALIAS']], options['TIMEOUT']
+
+
+def cached_shop_services(shop_id, build):
+    """
+    Return the serialized service list of a shop, built by build() on a miss. Image
+    URLs in the payload are relative so one entry serves every host the API is called on.
+    """
+    cache, timeout = _shop_services_cache()
+    key = f'shop_services:{shop_id}'
+    services = cache.get(key)
+    if services is not None:
+        metrics.incr('shop_services_cache.hits')
+        return services
+
+    metrics.incr('shop_services_cache.misses')
+    services = build()
+    if services is not None and not _replica_may_lag(shop_version(shop_id)):
+        cache.set(key, services, timeout)
+    return services
+
+
+def invalidate_shop_services(shop_id):
+    cache, _ = _shop_services_cache()
+    cache.delete(f'shop_services:{shop_id}')
+
+
+DEFAULT_SHOP_READ_CACHE_SETTINGS = {
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': 600,
+}
+
+
+def _shop_read_cache():
+    options = dict(DEFAULT_SHOP_READ_CACHE_SETTINGS, **getattr(settings, 'SHOP_READ_CACHE', {}))
+    return caches[options['CACHE_ALIAS']], options['TIMEOUT']
+
+
+def shop_version(shop_id):
+    # Random tokens, like the nearby generations, so an evicted version never revives old responses
+    cache, timeout = _shop_read_cache()
+    key = f'shop_version:{shop_id}'
+    version = cache.get(key)
+    if version is None:
+        version = _new_token(written=False)
+        # add() so concurrent first readers agree on one token
+        if not cache.add(key, version, None):
+            version = cache.get(key) or version
+    return version
+
+
+def bump_shop_version(shop_id):
+    """Invalidate every cached response and ETag of a shop's read endpoints."""
+    cache, _ = _shop_read_cache()
+    cache.set(f'shop_version:{shop_id}', _new_token(), None)
+
+
+def _etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    # Weak comparison, as for GET/HEAD
+    tags = (tag.strip() for tag in if_none_match.split(','))
+    return any((tag[2:] if tag.startswith('W/') else tag) == etag for tag in tags)
+
+
+def etag_cached_shop_view(view):
+    """
+    Serve a shop read endpoint with an ETag derived from the shop's version, the
+    scheme, host, full path and the Accept header; the host and scheme are part
+    of it because responses carry absolute URLs. A matching If-None-Match is answered with 304
+    and a full 200 is replayed from cached bytes, neither touching the ORM, until
+    bump_shop_version() is called for the shop. Goes between @replica_reads and @api_view.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view(request, *args, **kwargs)
+
+        shop_id = kwargs['shop_id']
+        version = shop_version(shop_id)
+        variant = (f"{version}:{request.scheme}://{request.get_host()}{request.get_full_path()}:"
+                   f"{request.META.get('HTTP_ACCEPT', '')}")
+        digest = hashlib.sha1(variant.encode()).hexdigest()
+        etag = f'"{digest}"'
+
+        if _etag_matches(request.META.get('HTTP_IF_NONE_MATCH'), etag):
+            metrics.incr('shop_read_cache.not_modified')
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+
+        cache, timeout = _shop_read_cache()
+        key = f'shop_response:{shop_id}:{digest}'
+        cached = cache.get(key)
+        if cached is not None:
+            metrics.incr('shop_read_cache.hits')
+            content_type, content = cached
+            response = HttpResponse(content, content_type=content_type)
+        else:
+            metrics.incr('shop_read_cache.misses')
+            response = view(request, *args, **kwargs)
+            # Neither cached nor tagged while a replica may still be behind the last write
+            if response.status_code != 200 or _replica_may_lag(version):
+                return response
+            # DRF responses are rendered lazily; render now to cache the bytes
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+            cache.set(key, (response['Content-Type'], response.content), timeout)
+
+        response['ETag'] = etag
+        # Clients may keep the body but must revalidate it with If-None-Match
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+    return wrapper
@@ -0,0 +1,94 @@
+import asyncio
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+async def _fetch(host, port, request_bytes, timeout):
+    # One request per connection (Connection: close), so the body simply runs to EOF
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        writer.write(request_bytes)
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+    status_line = response.split(b'\r\n', 1)[0].split()
+    return int(status_line[1]) if len(status_line) > 1 else 0
+
+
+async def _run(url, concurrency, total_requests, timeout):
+    parts = urlsplit(url)
+    if parts.scheme != 'http' or not parts.hostname:
+        raise CommandError(f"Only plain http:// URLs are supported, got {url!r}.")
+    target = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+    host_header = parts.netloc
+    request_bytes = (f'GET {target} HTTP/1.1\r\nHost: {host_header}\r\nAccept: application/json\r\n'
+                     f'Connection: close\r\n\r\n').encode()
+
+    latencies = []
+    errors = 0
+    remaining = iter(range(total_requests))
+
+    async def client():
+        nonlocal errors
+        # Each client keeps one request in flight, so `concurrency` connections are open at any time
+        for _ in remaining:
+            started = time.perf_counter()
+            try:
+                status_code = await _fetch(parts.hostname, parts.port or 80, request_bytes, timeout)
+            except (OSError, asyncio.TimeoutError):
+                errors += 1
+                continue
+            if status_code >= 400 or status_code == 0:
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - started
+
+
+def _percentile(sorted_values, percent):
+    if not sorted_values:
+        return float('nan')
+    index = min(len(sorted_values) - 1, int(round(percent / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Command(BaseCommand):
+    help = ("Measure throughput and latency of an endpoint under concurrent connections, e.g. an async/ "
+            "endpoint served by uvicorn against its sync twin served by a WSGI server.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', required=True, help="Endpoint to load, e.g. http://localhost:8001/app/async/shops/nearby?latitude=12.97&longitude=77.59")
+        parser.add_argument('--compare-url', help="Second endpoint to load with the same settings, e.g. the WSGI variant.")
+        parser.add_argument('--concurrency', type=int, default=50, help="Connections kept in flight.")
+        parser.add_argument('--requests', type=int, default=1000, help="Requests per endpoint.")
+        parser.add_argument('--timeout', type=float, default=30.0, help="Seconds before a request counts as an error.")
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['requests'] < 1:
+            raise CommandError("--concurrency and --requests must be positive.")
+
+        urls = [options['url']] + ([options['compare_url']] if options['compare_url'] else [])
+        self.stdout.write(f"{options['requests']} requests per endpoint, {options['concurrency']} concurrent connections")
+
+        results = []
+        for url in urls:
+            latencies, errors, elapsed = asyncio.run(
+                _run(url, options['concurrency'], options['requests'], options['timeout']))
+            latencies.sort()
+            throughput = len(latencies) / elapsed
+            results.append(throughput)
+            self.stdout.write(
+                f"{url}\n"
+                f"  {throughput:10.1f} req/s  p50 {_percentile(latencies, 50) * 1000:8.1f} ms  "
+                f"p95 {_percentile(latencies, 95) * 1000:8.1f} ms  p99 {_percentile(latencies, 99) * 1000:8.1f} ms  "
+                f"errors {errors}"
+            )
+
+        if len(results) == 2 and results[1]:
+            self.stdout.write(f"throughput ratio (url / compare-url): {results[0] / results[1]:.2f}x")
@@ -0,0 +1,60 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from geopy.distance import geodesic
+
+from common.geo import haversine_km, haversine_km_batch
+
+
+class Command(BaseCommand):
+    help = "Benchmark the vectorized haversine engine against the per-shop geodesic loop."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shops', type=int, default=10000, help="Number of synthetic shop coordinates.")
+        parser.add_argument('--repeat', type=int, default=5, help="Number of timed runs per method (best is reported).")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        num_shops = options['shops']
+        origin = (12.9716, 77.5946)
+
+        # Scatter shops in a ~50 km square around the origin
+        latitudes = [origin[0] + rng.uniform(-0.25, 0.25) for _ in range(num_shops)]
+        longitudes = [origin[1] + rng.uniform(-0.25, 0.25) for _ in range(num_shops)]
+
+        def geodesic_loop():
+            return [geodesic(origin, (lat, lon)).kilometers for lat, lon in zip(latitudes, longitudes)]
+
+        def haversine_loop():
+            return [haversine_km(origin[0], origin[1], lat, lon) for lat, lon in zip(latitudes, longitudes)]
+
+        def haversine_batch():
+            return haversine_km_batch(origin[0], origin[1], latitudes, longitudes)
+
+        results = []
+        for name, func in (('geodesic loop', geodesic_loop),
+                           ('haversine scalar loop', haversine_loop),
+                           ('haversine numpy batch', haversine_batch)):
+            best = None
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                func()
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            results.append((name, best))
+
+        baseline = results[0][1]
+        self.stdout.write(f"{num_shops} shops, best of {options['repeat']} runs")
+        for name, elapsed in results:
+            self.stdout.write(
+                f"{name:<24} {elapsed * 1000:10.2f} ms  {num_shops / elapsed:14,.0f} distances/s  "
+                f"{baseline / elapsed:8.1f}x"
+            )
+
+        # Haversine uses a spherical earth; report the worst deviation from the ellipsoidal result
+        exact = geodesic_loop()
+        batch = haversine_batch()
+        max_error = max(abs(a - b) / a for a, b in zip(exact, batch) if a)
+        self.stdout.write(f"max relative deviation from geodesic: {max_error:.4%}")
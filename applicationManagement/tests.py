@@ -1,3 +1,429 @@
-from django.test import TestCase
+import datetime
+import json
+import math
+from decimal import Decimal
+from urllib.parse import urlencode
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+
+from common import metrics
+from common.geo import (EARTH_RADIUS_KM, GEOHASH_PRECISION, KM_PER_DEGREE_LAT, MAX_COVER_CELLS, bounding_box,
+                        encode_geohash, geohash_cell_bounds, geohash_cell_size, geohash_cells_covering,
+                        geohash_cells_in_box, haversine_km, haversine_km_batch)
+from shopManagement.models import ShopProfile, ShopReview, ShopService, ShopServicesImage
+from shopManagement.utils import calculate_distance as shop_calculate_distance
+from usermanagement.utils import calculate_distance as user_calculate_distance
+from .cache import bump_shop_version, get_nearby_cache, shop_version
+from .utils import fetch_nearby_candidates, find_nearest_shops, nearby_shop_filter
+
+
+# Query counts cover the views' own queries, not those of the configured cache backend
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(MEDIA_ROOT='/tmp/test-media', CACHES=LOCMEM_CACHES)
+class ListShopServicesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.shop = ShopProfile.objects.create(shop_name="Shop", about_us="", email="shop@example.com",
+                                              phone_number="0", address="")
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.url = f'/app/shop/{self.shop.shop_id}/services'
+
+    def add_services(self, count):
+        for index in range(count):
+            service = ShopService.objects.create(shop_profile=self.shop, name=f"Service {index:02}", price=10,
+                                                 duration=datetime.timedelta(minutes=30))
+            for _ in range(2):
+                ShopServicesImage.objects.create(service=service, image=SimpleUploadedFile('a.jpg', b'x'))
+
+    def test_query_count_does_not_grow_with_page_size(self):
+        self.add_services(3)
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url, {'per_page': 3})
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertTrue(response.data['results'][0]['images'][0]['image_url'].startswith('http://testserver/'))
+
+        cache.clear()
+        self.add_services(10)
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url, {'per_page': 13})
+        self.assertEqual(response.data['count'], 13)
+
+    def test_cached_until_a_service_is_written(self):
+        self.add_services(1)
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+
+        self.client.post(f'/shop/{self.shop.shop_id}/add-service', {'name': "Beard", 'price': 5, 'duration': 15})
+        response = self.client.get(self.url)
+        self.assertEqual([service['service_name'] for service in response.data['results']], ["Beard", "Service 00"])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ListReviewsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.shop = ShopProfile.objects.create(shop_name="Shop", about_us="", email="shop@example.com",
+                                              phone_number="0", address="", rating_count=7)
+        for index in range(7):
+            ShopReview.objects.create(shop_profile=cls.shop, review_body=f"Review {index}", rating=4)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.url = f'/app/shop/{self.shop.shop_id}/reviews'
+
+    def test_cursor_pages_cover_every_review_once(self):
+        seen = []
+        params = {'per_page': 3}
+        while True:
+            with self.assertNumQueries(2):
+                data = self.client.get(self.url, params).json()
+            self.assertEqual(data['count'], 7)
+            seen.extend(review['review_id'] for review in data['results'])
+            if data['next_cursor'] is None:
+                break
+            params['cursor'] = data['next_cursor']
+
+        expected = ShopReview.objects.order_by('-created_at', '-review_id').values_list('review_id', flat=True)
+        self.assertEqual(seen, [str(review_id) for review_id in expected])
+
+    def test_legacy_page_mode(self):
+        data = self.client.get(self.url, {'page': 3, 'per_page': 3}).json()
+        self.assertEqual((data['total_pages'], data['current_page'], len(data['results'])), (3, 3, 1))
+        self.assertNotIn('next_cursor', data)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ShopReadCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.shop = ShopProfile.objects.create(shop_name="Shop", about_us="About", email="shop@example.com",
+                                              phone_number="0", address="")
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.url = f'/app/shop/{self.shop.shop_id}/get_shop_details'
+
+    def test_conditional_get_and_cached_bytes(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            cached = self.client.get(self.url)
+        self.assertEqual(cached.content, response.content)
+
+    def test_write_changes_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        self.client.post(f'/shop/{self.shop.shop_id}/add-review', {'review_body': "Nice", 'rating': 5})
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['rating']['count'], 1)
+
+    @override_settings(MEDIA_ROOT='/tmp/test-media')
+    def test_responses_are_cached_per_host(self):
+        service = ShopService.objects.create(shop_profile=self.shop, name="Cut", price=10,
+                                             duration=datetime.timedelta(minutes=30))
+        ShopServicesImage.objects.create(service=service, image=SimpleUploadedFile('a.jpg', b'x'))
+        url = f'/app/shop/{self.shop.shop_id}/services'
+
+        internal = self.client.get(url)
+        public = self.client.get(url, HTTP_HOST='api.example.com')
+        self.assertNotEqual(public['ETag'], internal['ETag'])
+        image_url = public.json()['results'][0]['images'][0]['image_url']
+        self.assertTrue(image_url.startswith('http://api.example.com/media/'), image_url)
+        self.assertEqual(self.client.get(url, HTTP_HOST='api.example.com', HTTP_IF_NONE_MATCH=internal['ETag']).status_code, 200)
+
+
+class SharedShopCacheTests(TestCase):
+
+    def test_version_bumps_reach_other_processes(self):
+        # A second connection to the configured cache stands in for another worker process
+        other_process = caches.create_connection('default')
+        shop_id = '00000000-0000-0000-0000-000000000001'
+        version = shop_version(shop_id)
+        self.assertEqual(other_process.get(f'shop_version:{shop_id}'), version)
+
+        bump_shop_version(shop_id)
+        self.assertNotEqual(other_process.get(f'shop_version:{shop_id}'), version)
+
+
+class GeohashTests(SimpleTestCase):
+
+    def test_known_vectors(self):
+        self.assertEqual(encode_geohash(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertEqual(encode_geohash(42.6, -5.6, 5), 'ezs42')
+        self.assertEqual(encode_geohash(-25.382708, -49.265506, 8), '6gkzwgjz')
+        self.assertEqual(encode_geohash(12.97, 77.59), encode_geohash(12.97, 77.59, GEOHASH_PRECISION))
+
+    def test_cell_bounds_contain_the_point(self):
+        for latitude, longitude in ((57.64911, 10.40744), (-33.8688, 151.2093), (0.0, -179.999)):
+            min_lat, max_lat, min_lon, max_lon = geohash_cell_bounds(encode_geohash(latitude, longitude, 6))
+            self.assertTrue(min_lat <= latitude <= max_lat and min_lon <= longitude <= max_lon)
+            self.assertEqual((max_lat - min_lat, max_lon - min_lon), geohash_cell_size(6))
+
+    def test_cover_contains_every_point_of_the_circle(self):
+        latitude, longitude, radius_km = 12.97, 77.59, 5.0
+        cells = geohash_cells_covering(latitude, longitude, radius_km)
+        self.assertLessEqual(len(cells), MAX_COVER_CELLS)
+        for bearing in range(0, 360, 15):
+            for fraction in (0.5, 1.0):
+                point_lat = latitude + math.cos(math.radians(bearing)) * radius_km * fraction / KM_PER_DEGREE_LAT
+                point_lon = longitude + math.sin(math.radians(bearing)) * radius_km * fraction / (
+                    KM_PER_DEGREE_LAT * math.cos(math.radians(latitude)))
+                self.assertTrue(any(encode_geohash(point_lat, point_lon).startswith(cell) for cell in cells))
+
+
+class BoundingBoxTests(SimpleTestCase):
+
+    def test_box_encloses_the_radius(self):
+        min_lat, max_lat, min_lon, max_lon = bounding_box(12.97, 77.59, 5.0)
+        self.assertAlmostEqual(max_lat - 12.97, 5.0 / KM_PER_DEGREE_LAT)
+        self.assertGreater(max_lon - 77.59, 5.0 / KM_PER_DEGREE_LAT)
+        for latitude, longitude in ((min_lat, 77.59), (12.97, min_lon), (12.97, max_lon)):
+            self.assertGreaterEqual(haversine_km(12.97, 77.59, latitude, longitude), 4.9)
+
+    def test_box_is_clamped_at_the_poles(self):
+        min_lat, max_lat, min_lon, max_lon = bounding_box(89.99, 0, 50.0)
+        self.assertEqual(max_lat, 90.0)
+        self.assertLessEqual(max_lon - min_lon, 360.0)
+
+    def test_antimeridian_is_split(self):
+        min_lat, max_lat, min_lon, max_lon = bounding_box(0.0, 179.99, 5.0)
+        self.assertGreater(max_lon, 180.0)
+        cells = geohash_cells_in_box(min_lat, max_lat, min_lon, max_lon, 4)
+        self.assertIn(encode_geohash(0.0, 179.99, 4), cells)
+        self.assertIn(encode_geohash(0.0, -179.99, 4), cells)
+
+        sql = str(ShopProfile.objects.filter(nearby_shop_filter(0.0, 179.99, 5.0)).query)
+        self.assertIn(' OR ', sql)
+
+
+class HaversineTests(SimpleTestCase):
+
+    def test_known_distances(self):
+        self.assertAlmostEqual(haversine_km(0, 0, 1, 0), math.pi * EARTH_RADIUS_KM / 180, places=6)
+        self.assertAlmostEqual(haversine_km(51.5074, -0.1278, 48.8566, 2.3522), 343.5, delta=0.5)
+        # Antipodes, where rounding can push the haversine term past 1
+        self.assertAlmostEqual(haversine_km(10, 20, -10, -160), math.pi * EARTH_RADIUS_KM, delta=0.01)
+        self.assertEqual(haversine_km(Decimal('12.970000'), Decimal('77.590000'), 12.97, 77.59), 0)
+
+    def test_batch_matches_scalar(self):
+        random = np.random.RandomState(0)
+        latitudes = random.uniform(-90, 90, 500)
+        longitudes = random.uniform(-180, 180, 500)
+        for origin in ((12.97, 77.59), (-89.9, 179.9), (0, 0)):
+            batch = haversine_km_batch(*origin, latitudes, longitudes)
+            scalar = [haversine_km(*origin, latitude, longitude) for latitude, longitude in zip(latitudes, longitudes)]
+            self.assertTrue(np.allclose(batch, scalar, rtol=0, atol=1e-6))
+
+    def test_batch_accepts_decimals_and_empty_input(self):
+        distances = haversine_km_batch(12.97, 77.59, [Decimal('12.98'), Decimal('12.97')],
+                                       [Decimal('77.59'), Decimal('77.59')])
+        self.assertEqual(distances.shape, (2,))
+        self.assertAlmostEqual(distances[0], haversine_km(12.97, 77.59, 12.98, 77.59))
+        self.assertEqual(haversine_km_batch(12.97, 77.59, [], []).shape, (0,))
+        # The app-level helpers are the same engine
+        self.assertEqual(shop_calculate_distance(12.97, 77.59, 12.98, 77.6), haversine_km(12.97, 77.59, 12.98, 77.6))
+        self.assertEqual(user_calculate_distance(12.97, 77.59, 12.98, 77.6), haversine_km(12.97, 77.59, 12.98, 77.6))
+
+
+class NearbyShopsTests(TestCase):
+    origin = (12.97, 77.59)
+
+    @classmethod
+    def setUpTestData(cls):
+        # Shops due north of the origin, at these distances in km
+        cls.distances = (0.3, 0.8, 1.5, 2.5, 3.5, 4.5)
+        cls.shops = [cls.create_shop(f"Shop {distance}", distance) for distance in cls.distances]
+        cls.create_shop("Far away", 8.0)
+        ShopProfile.objects.create(shop_name="Nowhere", about_us="", email="nowhere@example.com", phone_number="0",
+                                   address="", latitude=None, longitude=None)
+
+    @classmethod
+    def create_shop(cls, name, km_north, longitude=None):
+        latitude = round(cls.origin[0] + km_north * 180 / (math.pi * EARTH_RADIUS_KM), 6)
+        longitude = cls.origin[1] if longitude is None else longitude
+        return ShopProfile.objects.create(shop_name=name, about_us="", email="shop@example.com", phone_number="0",
+                                          address="", latitude=latitude, longitude=longitude,
+                                          geohash=encode_geohash(latitude, longitude))
+
+    def setUp(self):
+        get_nearby_cache().clear()
+        metrics.reset()
+        self.client = APIClient()
+
+    def legacy_nearby(self, latitude, longitude):
+        # The original mode reads the location from the request body
+        return self.client.generic('GET', '/app/get_shops_nearby/', json.dumps({'latitude': latitude, 'longitude': longitude}),
+                                   content_type='application/json')
+
+    def test_legacy_mode_returns_shops_within_5km_nearest_first(self):
+        response = self.legacy_nearby('12.97', '77.59')
+        self.assertEqual(response.status_code, 200)
+        shops = response.data['nearby_shops']
+        self.assertEqual([shop['shop_name'] for shop in shops], [shop.shop_name for shop in self.shops])
+        self.assertEqual([shop['distance_km'] for shop in shops], list(self.distances))
+        self.assertEqual(shops[0]['rating']['count'], 0)
+
+    def test_prefilter_reads_only_the_box(self):
+        # The 2.5km shop lies outside the 2km box, so it is never read or scored
+        candidates = fetch_nearby_candidates(*self.origin, 2.0)
+        self.assertEqual(sorted(shop['shop_name'] for shop in candidates), ["Shop 0.3", "Shop 0.8", "Shop 1.5"])
+
+    def test_search_crosses_the_antimeridian(self):
+        east = ShopProfile.objects.create(shop_name="East", about_us="", email="east@example.com", phone_number="0",
+                                          address="", latitude=1, longitude=179.995, geohash=encode_geohash(1, 179.995))
+        west = ShopProfile.objects.create(shop_name="West", about_us="", email="west@example.com", phone_number="0",
+                                          address="", latitude=1, longitude=-179.995, geohash=encode_geohash(1, -179.995))
+        shops, _, _ = find_nearest_shops(1.0, 179.99, 5.0)
+        self.assertEqual([shop['shop_id'] for shop in shops], [east.shop_id, west.shop_id])
+        self.assertAlmostEqual(shops[1]['distance_km'], 1.67, delta=0.01)
+
+    def nearest(self, **params):
+        return self.client.get('/app/get_shops_nearby/', dict({'latitude': self.origin[0], 'longitude': self.origin[1]}, **params))
+
+    def test_ring_grows_until_more_than_limit_shops_are_inside(self):
+        for limit, searched_radius_km in ((1, 1.0), (2, 2.0), (3, 4.0), (6, 5.0), (20, 5.0)):
+            with self.subTest(limit=limit):
+                shops, _, ring_km = find_nearest_shops(*self.origin, 5.0, limit=limit)
+                self.assertEqual(ring_km, searched_radius_km)
+                self.assertEqual([shop['distance_km'] for shop in shops], list(self.distances[:limit]))
+
+    def test_cursor_pages_walk_every_shop_once_in_order(self):
+        seen = []
+        params = {'limit': 2}
+        while True:
+            response = self.nearest(**params)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(shop['shop_name'] for shop in response.data['nearby_shops'])
+            if response.data['next_cursor'] is None:
+                break
+            params['cursor'] = response.data['next_cursor']
+        self.assertEqual(seen, [shop.shop_name for shop in self.shops])
+
+    def test_cursor_pages_reuse_the_doubling_rings(self):
+        # Resuming after 1.2km searches the 2km and 4km rings, not rings sized by the cursor
+        _, _, ring_km = find_nearest_shops(*self.origin, 5.0, limit=1, after=(1.2, ''))
+        self.assertEqual(ring_km, 4.0)
+
+        get_nearby_cache().clear()
+        metrics.reset()
+        searched = []
+        params = {'limit': 2}
+        while True:
+            data = self.nearest(**params).data
+            searched.append(data['searched_radius_km'])
+            if data['next_cursor'] is None:
+                break
+            params['cursor'] = data['next_cursor']
+        self.assertEqual(searched, [2.0, 4.0, 5.0])
+        # One cache entry per ring of 1, 2, 4 and 5km, shared by every page
+        self.assertEqual(self.cache_metrics()[1], 4)
+
+    def test_nearest_mode_parameters(self):
+        response = self.nearest(radius_km=2, limit=10)
+        self.assertEqual((response.data['radius_km'], response.data['searched_radius_km']), (2.0, 2.0))
+        self.assertEqual(len(response.data['nearby_shops']), 3)
+        self.assertIsNone(response.data['next_cursor'])
+
+        for params in ({'radius_km': 0}, {'radius_km': 51}, {'limit': 0}, {'limit': 101}, {'limit': 'ten'},
+                       {'cursor': 'bogus'}, {'latitude': 91}, {'longitude': 'east'}):
+            with self.subTest(**params):
+                self.assertEqual(self.nearest(**params).status_code, 400)
+
+    def cache_metrics(self):
+        counters = metrics.snapshot('nearby_cache.')
+        return counters.get('nearby_cache.hits', 0), counters.get('nearby_cache.misses', 0)
+
+    def test_searches_from_one_cell_share_a_cache_entry(self):
+        first = self.legacy_nearby('12.97', '77.59').data
+        self.assertEqual(self.cache_metrics(), (0, 1))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.legacy_nearby('12.97', '77.59').data, first)
+
+        # A user 500m further north, still in the same cell, is served from that entry with their own distances
+        moved = self.legacy_nearby('12.9745', '77.59').data['nearby_shops']
+        self.assertEqual(self.cache_metrics(), (2, 1))
+        self.assertEqual([shop['shop_name'] for shop in moved], [shop.shop_name for shop in self.shops])
+        self.assertEqual([shop['distance_km'] for shop in moved], [0.2, 0.3, 1.0, 2.0, 3.0, 4.0])
+
+    def test_shop_writes_invalidate_cached_results(self):
+        self.legacy_nearby('12.97', '77.59')
+        response = self.client.post('/shop/create-profile', {
+            'shop_name': "New", 'about_us': "New shop", 'email': "new@example.com", 'phone_number': "1",
+            'address': "Road", 'latitude': '12.971', 'longitude': '77.59'})
+        self.assertEqual(response.status_code, 201)
+        names = [shop['shop_name'] for shop in self.legacy_nearby('12.97', '77.59').data['nearby_shops']]
+        self.assertEqual(names[:2], ["New", "Shop 0.3"])
+        self.assertEqual(self.cache_metrics(), (0, 2))
+
+        # Moving a shop out of range drops it from the results cached around its old location
+        self.client.put(f'/shop/{self.shops[0].shop_id}/update-profile', {'latitude': '13.5'})
+        names = [shop['shop_name'] for shop in self.legacy_nearby('12.97', '77.59').data['nearby_shops']]
+        self.assertNotIn("Shop 0.3", names)
+        self.assertEqual(self.cache_metrics(), (0, 3))
+
+    def test_legacy_mode_requires_a_location(self):
+        self.assertEqual(self.legacy_nearby('12.97', None).status_code, 400)
+        self.assertEqual(self.legacy_nearby('north', '77.59').status_code, 400)
+
+
+# Not a TestCase: the async views read on pool threads, which cannot see an open test transaction
+@override_settings(MEDIA_ROOT='/tmp/test-media')
+class AsyncReadEndpointTests(TransactionTestCase):
+    databases = {'default', 'local'}
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.shop = ShopProfile.objects.create(shop_name="Shop", about_us="", email="shop@example.com",
+                                               phone_number="0", address="", latitude=12.97, longitude=77.59,
+                                               rating_count=3, rating_sum=12, rating_4=3)
+        for index in range(3):
+            ShopReview.objects.create(shop_profile=self.shop, review_body=f"Review {index}", rating=4)
+            ShopService.objects.create(shop_profile=self.shop, name=f"Service {index}", price=10,
+                                       duration=datetime.timedelta(minutes=30))
+
+    def aget(self, path, params=None):
+        # AsyncClient in Django 3.2 ignores `data` on GET, so the query string goes in the path
+        return self.async_client.get(f'{path}?{urlencode(params or {})}')
+
+    async def test_responses_match_the_sync_views(self):
+        for sync_url, async_url, params in (
+            (f'/app/shop/{self.shop.shop_id}/services', f'/app/async/shop/{self.shop.shop_id}/services', {'per_page': 2}),
+            (f'/app/shop/{self.shop.shop_id}/reviews', f'/app/async/shop/{self.shop.shop_id}/reviews', {'per_page': 2}),
+            (f'/app/shop/{self.shop.shop_id}/reviews', f'/app/async/shop/{self.shop.shop_id}/reviews', {'page': 2, 'per_page': 2}),
+            ('/app/get_shops_nearby/', '/app/async/shops/nearby', {'latitude': 12.97, 'longitude': 77.59}),
+        ):
+            async_response = await self.aget(async_url, params)
+            self.assertEqual(async_response.status_code, 200)
+            sync_response = await sync_to_async(self.client.get)(sync_url, params)
+            self.assertEqual(async_response.json(), sync_response.json())
+
+    async def test_review_cursor_and_errors(self):
+        url = f'/app/async/shop/{self.shop.shop_id}/reviews'
+        first = (await self.aget(url, {'per_page': 2})).json()
+        second = (await self.aget(url, {'per_page': 2, 'cursor': first['next_cursor']})).json()
+        self.assertEqual(len(second['results']), 1)
+        self.assertIsNone(second['next_cursor'])
+
+        self.assertEqual((await self.aget(url, {'cursor': 'bogus'})).status_code, 400)
+        self.assertEqual((await self.aget('/app/async/shop/00000000-0000-0000-0000-000000000000/reviews')).status_code, 404)
+        self.assertEqual((await self.aget('/app/async/shops/nearby')).status_code, 400)
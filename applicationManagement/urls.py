@@ -5,5 +5,10 @@ urlpatterns = [
     path("shop/<uuid:shop_id>/services",views.list_shop_services,name="barber_shops"),
     path('shop/<uuid:shop_id>/reviews', views.list_reviews, name='list_reviews'),
     path('get_shops_nearby/', views.get_shops_nearby, name='get_shops_nearby'),
-    path('shop/<uuid:shop_id>/get_shop_details',views.get_shop_details, name='get_shop_details')
+    path('shop/<uuid:shop_id>/get_shop_details',views.get_shop_details, name='get_shop_details'),
+    path('metrics', views.get_metrics, name='get_metrics'),
+    # ASGI variants of the read endpoints above, for deployments served by uvicorn
+    path('async/shops/nearby', views.get_shops_nearby_async, name='get_shops_nearby_async'),
+    path('async/shop/<uuid:shop_id>/services', views.list_shop_services_async, name='list_shop_services_async'),
+    path('async/shop/<uuid:shop_id>/reviews', views.list_reviews_async, name='list_reviews_async'),
 ]
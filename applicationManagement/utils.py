@@ -0,0 +1,142 @@
+import base64
+import datetime
+import json
+import operator
+import uuid
+from functools import reduce
+
+from django.db.models import Q
+
+from common.geo import bounding_box, geohash_cells_covering, haversine_km_batch
+from shopManagement.models import ShopProfile
+from shopManagement.utils import RATING_SUMMARY_FIELDS, rating_summary
+from .cache import cached_nearby_candidates
+
+# Columns returned by the nearby search, read without building model instances
+NEARBY_SHOP_FIELDS = (
+    'shop_id', 'shop_name', 'about_us', 'email', 'phone_number', 'address', 'latitude', 'longitude',
+) + RATING_SUMMARY_FIELDS
+
+# First ring searched by the k-nearest mode; it doubles until enough shops are found
+NEARBY_INITIAL_RING_KM = 1.0
+NEARBY_MAX_RADIUS_KM = 50.0
+NEARBY_DEFAULT_LIMIT = 20
+NEARBY_MAX_LIMIT = 100
+
+
+def nearby_shop_filter(latitude, longitude, radius_km):
+    """
+    Build the SQL prefilter for shops around a point: the latitude/longitude
+    bounding box of the radius (served by shop_lat_lon_idx) combined with the
+    geohash prefixes covering it. Distances still have to be checked exactly.
+    """
+    min_lat, max_lat, min_lon, max_lon = bounding_box(latitude, longitude, radius_km)
+
+    # Split the longitude range when the box crosses the antimeridian
+    if min_lon < -180.0:
+        lon_filter = Q(longitude__gte=min_lon + 360.0) | Q(longitude__lte=max_lon)
+    elif max_lon > 180.0:
+        lon_filter = Q(longitude__gte=min_lon) | Q(longitude__lte=max_lon - 360.0)
+    else:
+        lon_filter = Q(longitude__range=(min_lon, max_lon))
+
+    cells = geohash_cells_covering(latitude, longitude, radius_km)
+    cell_filter = reduce(operator.or_, (Q(geohash__startswith=cell) for cell in cells))
+
+    return Q(latitude__range=(min_lat, max_lat)) & lon_filter & cell_filter
+
+
+def fetch_nearby_candidates(latitude, longitude, radius_km):
+    # Ensure shop has latitude and longitude
+    return [
+        shop for shop in ShopProfile.objects.filter(
+            nearby_shop_filter(latitude, longitude, radius_km)).values(*NEARBY_SHOP_FIELDS)
+        if shop['latitude'] and shop['longitude']
+    ]
+
+
+def encode_nearby_cursor(distance_km, shop_id):
+    payload = json.dumps([distance_km, str(shop_id)]).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def decode_nearby_cursor(cursor):
+    """Decode an opaque cursor into a (distance_km, shop_id) key. Raises ValueError if malformed."""
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        distance_km, shop_id = json.loads(payload)
+        return float(distance_km), str(shop_id)
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor.")
+
+
+def encode_review_cursor(created_at, review_id):
+    payload = json.dumps([created_at.isoformat(), str(review_id)]).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def decode_review_cursor(cursor):
+    """Decode an opaque cursor into a (created_at, review_id) key. Raises ValueError if malformed."""
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, review_id = json.loads(payload)
+        return datetime.datetime.fromisoformat(created_at), uuid.UUID(review_id)
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor.")
+
+
+def find_nearest_shops(latitude, longitude, radius_km, limit=None, after=None):
+    """
+    Return (shops, next_cursor, searched_radius_km) for the shops within radius_km
+    ordered by (distance, shop_id).
+
+    With a limit, the search starts from a small ring and doubles it until more
+    than `limit` shops are inside the ring or radius_km is reached, so only the
+    shops near the user are ever read and scored. `after` is a decoded cursor;
+    only shops strictly after that key are returned.
+    """
+    if limit is None:
+        ring_km = radius_km
+    else:
+        ring_km = min(NEARBY_INITIAL_RING_KM, radius_km)
+        # Everything before the cursor is already known to be inside its distance. The ring is
+        # rounded up to the same doubling steps, so later pages reuse the cached rings
+        if after is not None:
+            while ring_km < after[0] and ring_km < radius_km:
+                ring_km = min(ring_km * 2, radius_km)
+
+    while True:
+        candidates = cached_nearby_candidates(latitude, longitude, ring_km, fetch_nearby_candidates)
+        distances = haversine_km_batch(latitude, longitude,
+                                       [shop['latitude'] for shop in candidates],
+                                       [shop['longitude'] for shop in candidates])
+
+        # Only shops inside the ring are guaranteed to be ranked correctly
+        ranked = []
+        for index in (distances <= ring_km).nonzero()[0]:
+            key = (float(distances[index]), str(candidates[index]['shop_id']))
+            if after is None or key > after:
+                ranked.append((key, index))
+
+        if limit is None or len(ranked) > limit or ring_km >= radius_km:
+            break
+        ring_km = min(ring_km * 2, radius_km)
+
+    ranked.sort()
+    next_cursor = None
+    if limit is not None and len(ranked) > limit:
+        ranked = ranked[:limit]
+        next_cursor = encode_nearby_cursor(*ranked[-1][0])
+
+    # Candidate rows may be shared through the cache, so build fresh dicts
+    shops = []
+    for (distance, _), index in ranked:
+        shop = candidates[index]
+        shop_data = {field: value for field, value in shop.items() if field not in RATING_SUMMARY_FIELDS}
+        shop_data.update(latitude=str(shop['latitude']),
+                         longitude=str(shop['longitude']),
+                         distance_km=round(distance, 2),
+                         rating=rating_summary(shop))
+        shops.append(shop_data)
+
+    return shops, next_cursor, ring_km
@@ -1,140 +1,207 @@
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.http import JsonResponse, HttpResponseBadRequest, HttpResponseServerError
 from django.core.exceptions import ValidationError
+from django.db.models import Prefetch, Q
 
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_GET
 from shopManagement.models import ShopProfile, ShopReview, ShopService, ShopServicesImage
+from shopManagement.utils import RATING_SUMMARY_FIELDS, rating_summary
 from rest_framework.decorators import api_view
+from rest_framework.utils.encoders import JSONEncoder
 from rest_framework.response import Response
 from rest_framework import status
-from geopy.distance import geodesic
 from decimal import Decimal, InvalidOperation
+from common import metrics
+from common.images import derivative_urls
+from common.db import replica_reads, run_query
+from .cache import cached_shop_services, etag_cached_shop_view
+from .utils import (NEARBY_DEFAULT_LIMIT, NEARBY_MAX_LIMIT, NEARBY_MAX_RADIUS_KM, decode_nearby_cursor,
+                    decode_review_cursor, encode_review_cursor, find_nearest_shops)
 
+import asyncio
 import math
 import logging
+from urllib.parse import urljoin
 
 # Configure logging for error tracking
 logger = logging.getLogger(__name__)
+
+NEARBY_RADIUS_KM = 5
+REVIEWS_MAX_PER_PAGE = 100
 from drf_spectacular.utils import extend_schema, OpenApiParameter
 
+@replica_reads
+@etag_cached_shop_view
 @api_view(['GET'])
 def list_reviews(request, shop_id):
     try:
         shop_profile = ShopProfile.objects.get(shop_id=shop_id)
-        reviews = ShopReview.objects.filter(shop_profile = shop_profile)
-        # Pagination parameters
-        page = int(request.GET.get('page', 1))  # Default to page 1 if no page parameter is provided
         per_page = int(request.GET.get('per_page', 10)) # Default to 10 reviews per page if not provided
-        
-        total_reviews = reviews.count()
-        start = (page - 1) * per_page
-        end = start + per_page
-
-        # Slice the queryset for the current page
-        paginated_reviews = reviews[start:end]
-    
-        # Manually construct the response data
-        reviews_data = []
-        for review in paginated_reviews:
-           
-            reviews_data.append({
-                'review_id': review.review_id,
-                'review_body': review.review_body,
-                'review_rating': review.rating,
-            })
-
-        # Calculate pagination metadata
-        total_pages = (total_reviews + per_page - 1) // per_page  # Ceiling division
+        if not 1 <= per_page <= REVIEWS_MAX_PER_PAGE:
+            return JsonResponse({"error": f"per_page must be between 1 and {REVIEWS_MAX_PER_PAGE}."}, status=400)
 
+        # Totals come from the shop's rating counters instead of a COUNT(*)
+        total_reviews = shop_profile.rating_count
         response_data = {
             'count': total_reviews,
-            'total_pages': total_pages,
-            'current_page': page,
             'per_page': per_page,
-            'results': reviews_data
+            'rating': rating_summary(shop_profile),
         }
 
+        if 'page' in request.GET:
+            # Legacy offset mode
+            page = int(request.GET.get('page', 1))
+            if page < 1:
+                return JsonResponse({"error": "page must be positive."}, status=400)
+            paginated_reviews, _ = _review_page(shop_id, per_page, page=page)
+            response_data.update({
+                'total_pages': (total_reviews + per_page - 1) // per_page,  # Ceiling division
+                'current_page': page,
+            })
+        else:
+            after = None
+            if request.GET.get('cursor'):
+                try:
+                    after = decode_review_cursor(request.GET['cursor'])
+                except ValueError as e:
+                    return JsonResponse({"error": str(e)}, status=400)
+            paginated_reviews, response_data['next_cursor'] = _review_page(shop_id, per_page, after=after)
+
+        response_data['results'] = paginated_reviews
+
         return JsonResponse(response_data)
 
     except ShopProfile.DoesNotExist:
         return JsonResponse({"error": "Shop profile not found."}, status=404)
+    except ValueError:
+        return JsonResponse({"error": "page and per_page must be integers."}, status=400)
     except Exception as e:
         # Log the exception if needed
         # log.exception("Error occurred in list_reviews view: %s", e)
         return JsonResponse({"error": "An unexpected error occurred. Please try again later."}, status=500)
 
+
+def _review_page(shop_id, per_page, page=None, after=None):
+    """
+    Return (reviews, next_cursor) for one page of a shop's reviews, newest first.
+    `page` selects the legacy offset mode; otherwise the page is the keyset page
+    after the decoded cursor `after`, and next_cursor is None on the last page.
+    """
+    # review_id breaks ties so the order is stable across pages
+    reviews = ShopReview.objects.filter(shop_profile_id=shop_id).order_by('-created_at', '-review_id').values(
+        'review_id', 'review_body', 'rating', 'created_at')
+    next_cursor = None
+    if page is not None:
+        start = (page - 1) * per_page
+        rows = list(reviews[start:start + per_page])
+    else:
+        # Keyset mode on (created_at, review_id), served by review_shop_created_idx
+        if after is not None:
+            created_at, review_id = after
+            reviews = reviews.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, review_id__lt=review_id))
+        rows = list(reviews[:per_page + 1])
+        if len(rows) > per_page:
+            rows = rows[:per_page]
+            next_cursor = encode_review_cursor(rows[-1]['created_at'], rows[-1]['review_id'])
+
+    return [
+        {
+            'review_id': row['review_id'],
+            'review_body': row['review_body'],
+            'review_rating': row['rating'],
+            'created_at': row['created_at'],
+        }
+        for row in rows
+    ], next_cursor
+
+
+@replica_reads
+@etag_cached_shop_view
 @api_view(['GET'])
 def list_shop_services(request, shop_id):
     try:
-        # Retrieve the ShopProfile by shop_id
-        shop_profile = ShopProfile.objects.get(shop_id=shop_id)
-        
         # Get page and per_page parameters from request query params
         page = int(request.GET.get('page', 1))  # Default to page 1 if not provided
         per_page = int(request.GET.get('per_page', 10))  # Default to 10 items per page
 
-        # Filter the services related to the shop profile
-        services = ShopService.objects.filter(shop_profile=shop_profile)
+        if page < 1 or per_page < 1:
+            return Response({"error": "page and per_page must be positive."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Implement custom pagination
-        total_services = services.count()
-        start = (page - 1) * per_page
-        end = start + per_page
-
-        # Slice the queryset for the current page
-        paginated_services = services[start:end]
-
-        # Manually construct the response data
-        services_data = []
-        for service in paginated_services:
-            images = ShopServicesImage.objects.filter(service=service)
-            images_data = [{'image_url': request.build_absolute_uri(img.image.url), 'description': img.description} for img in images]
-
-            services_data.append({
-                'service_id': service.service_id,
-                'service_name': service.name,
-                'description': service.description,
-                'price': str(service.price),
-                'duration_in_secs': service.duration,
-                'images': images_data
-            })
+        # Whole service list of the shop, from the cache or three queries (shop, services, images)
+        services = cached_shop_services(shop_id, lambda: _serialize_shop_services(shop_id))
+        if services is None:
+            return Response({"error": "ShopProfile not found."}, status=status.HTTP_404_NOT_FOUND)
 
-        # Calculate pagination metadata
-        total_pages = (total_services + per_page - 1) // per_page  # Ceiling division
+        return Response(_services_page(services, page, per_page, request.build_absolute_uri('/')),
+                        status=status.HTTP_200_OK)
 
-        response_data = {
-            'count': total_services,
-            'total_pages': total_pages,
-            'current_page': page,
-            'per_page': per_page,
-            'results': services_data
-        }
+    except ValueError:
+        return Response({"error": "page and per_page must be integers."}, status=status.HTTP_400_BAD_REQUEST)
 
-        return Response(response_data, status=status.HTTP_200_OK)
 
-    except ShopProfile.DoesNotExist:
-        return Response({"error": "ShopProfile not found."}, status=status.HTTP_404_NOT_FOUND)
-    
-
-def haversine_distance(lat1, lon1, lat2, lon2):
-    """Calculate the great circle distance in kilometers between two points on the earth (specified in decimal degrees)"""
-    # Convert decimal degrees to radians
-    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
-    
-    # Haversine formula
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
-    a = math.sin(dlat / 2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2)**2
-    c = 2 * math.asin(math.sqrt(a))
-    
-    # Radius of earth in kilometers is 6371
-    km = 6371 * c
-    return km
+def _services_page(services, page, per_page, base_uri):
+    # Implement custom pagination
+    total_services = len(services)
+    start = (page - 1) * per_page
+    end = start + per_page
+
+    # Image URLs are cached relative to the media root, make them absolute for this host
+    services_data = [
+        dict(service, images=[
+            {
+                'image_url': urljoin(base_uri, image['image_url']),
+                'description': image['description'],
+                'derivatives': {name: urljoin(base_uri, url) for name, url in image['derivatives'].items()},
+            }
+            for image in service['images']
+        ])
+        for service in services[start:end]
+    ]
 
+    # Calculate pagination metadata
+    total_pages = (total_services + per_page - 1) // per_page  # Ceiling division
+
+    return {
+        'count': total_services,
+        'total_pages': total_pages,
+        'current_page': page,
+        'per_page': per_page,
+        'results': services_data
+    }
+
+
+def _serialize_shop_services(shop_id):
+    if not ShopProfile.objects.filter(shop_id=shop_id).exists():
+        return None
+
+    services = ShopService.objects.filter(shop_profile_id=shop_id).order_by('name', 'service_id').prefetch_related(
+        Prefetch('shop_service_images', queryset=ShopServicesImage.objects.order_by('image_id'))
+    )
+    return [
+        {
+            'service_id': service.service_id,
+            'service_name': service.name,
+            'description': service.description,
+            'price': str(service.price),
+            'duration_in_secs': service.duration,
+            'images': [
+                {'image_url': img.image.url, 'description': img.description, 'derivatives': derivative_urls(img.derivatives)}
+                for img in service.shop_service_images.all()
+            ]
+        }
+        for service in services
+    ]
+
+
+@replica_reads
 @api_view(['GET'])
 def get_shops_nearby(request):
     try:
+        # k-nearest mode, driven by query parameters
+        if 'latitude' in request.query_params or 'longitude' in request.query_params:
+            return _get_nearest_shops(request)
+
         # Retrieve latitude and longitude from the request
         latitude = request.data.get('latitude')
         longitude = request.data.get('longitude')
@@ -149,26 +216,8 @@ def get_shops_nearby(request):
         else:
             return Response({"error": "Latitude and longitude are required."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Find shops within 5 km radius
-        nearby_shops = []
-        user_location = (latitude, longitude)
-
-        for shop in ShopProfile.objects.all():
-            shop_location = (shop.latitude, shop.longitude)
-            if shop.latitude and shop.longitude:  # Ensure shop has latitude and longitude
-                distance = geodesic(user_location, shop_location).kilometers
-                if distance <= 5:
-                    nearby_shops.append({
-                        "shop_id": shop.shop_id,
-                        "shop_name": shop.shop_name,
-                        "about_us": shop.about_us,
-                        "email": shop.email,
-                        "phone_number": shop.phone_number,
-                        "address": shop.address,
-                        "latitude": str(shop.latitude),
-                        "longitude": str(shop.longitude),
-                        "distance_km": round(distance, 2)
-                    })
+        # Find shops within 5 km radius, nearest first
+        nearby_shops, _, _ = find_nearest_shops(latitude, longitude, NEARBY_RADIUS_KM)
 
         return Response({"nearby_shops": nearby_shops}, status=status.HTTP_200_OK)
 
@@ -176,6 +225,52 @@ def get_shops_nearby(request):
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+def _get_nearest_shops(request):
+    data, status_code = _nearest_shops_payload(request.query_params)
+    return Response(data, status=status_code)
+
+
+def _nearest_shops_payload(params):
+    """Validate the k-nearest query parameters and return (response data, status code)."""
+    try:
+        latitude = float(params.get('latitude'))
+        longitude = float(params.get('longitude'))
+    except (TypeError, ValueError):
+        return {"error": "Valid latitude and longitude query parameters are required."}, status.HTTP_400_BAD_REQUEST
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return {"error": "Latitude or longitude out of range."}, status.HTTP_400_BAD_REQUEST
+
+    try:
+        radius_km = float(params.get('radius_km', NEARBY_RADIUS_KM))
+        limit = int(params.get('limit', NEARBY_DEFAULT_LIMIT))
+    except ValueError:
+        return {"error": "Invalid radius_km or limit format."}, status.HTTP_400_BAD_REQUEST
+    if not 0 < radius_km <= NEARBY_MAX_RADIUS_KM:
+        return {"error": f"radius_km must be greater than 0 and at most {NEARBY_MAX_RADIUS_KM:g}."}, status.HTTP_400_BAD_REQUEST
+    if not 1 <= limit <= NEARBY_MAX_LIMIT:
+        return {"error": f"limit must be between 1 and {NEARBY_MAX_LIMIT}."}, status.HTTP_400_BAD_REQUEST
+
+    after = None
+    if params.get('cursor'):
+        try:
+            after = decode_nearby_cursor(params.get('cursor'))
+        except ValueError as e:
+            return {"error": str(e)}, status.HTTP_400_BAD_REQUEST
+
+    nearby_shops, next_cursor, searched_radius_km = find_nearest_shops(
+        latitude, longitude, radius_km, limit=limit, after=after)
+
+    return {
+        "nearby_shops": nearby_shops,
+        "radius_km": radius_km,
+        "searched_radius_km": searched_radius_km,
+        "limit": limit,
+        "next_cursor": next_cursor
+    }, status.HTTP_200_OK
+
+
+@replica_reads
+@etag_cached_shop_view
 @api_view(['GET'])
 def get_shop_details(request, shop_id):
     try:
@@ -192,9 +287,99 @@ def get_shop_details(request, shop_id):
             "about_us": shop_profile.about_us,
             "phone_number": shop_profile.phone_number,
             "venue_amenities": venue_amenities_list,
+            "rating": rating_summary(shop_profile),
         }
 
         return Response(shop_data, status=status.HTTP_200_OK)
 
     except Exception as e:
-        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@api_view(['GET'])
+def get_metrics(request):
+    # Process-local counters such as nearby_cache.hits / nearby_cache.misses
+    return Response(metrics.snapshot(request.query_params.get('prefix', '')), status=status.HTTP_200_OK)
+
+
+# ASGI variants of the hot read endpoints. Django 3.2 has no async ORM, so the ORM
+# work runs through run_query and independent reads are awaited together. Responses
+# match the sync views; DRF's encoder is used where those views return a DRF Response.
+
+@replica_reads
+async def get_shops_nearby_async(request):
+    if request.method != 'GET':
+        return JsonResponse({"error": "Method not allowed."}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+    try:
+        data, status_code = await run_query(_nearest_shops_payload, request.GET)
+        return JsonResponse(data, status=status_code, encoder=JSONEncoder)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@replica_reads
+async def list_shop_services_async(request, shop_id):
+    if request.method != 'GET':
+        return JsonResponse({"error": "Method not allowed."}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+    try:
+        page = int(request.GET.get('page', 1))
+        per_page = int(request.GET.get('per_page', 10))
+    except ValueError:
+        return JsonResponse({"error": "page and per_page must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+    if page < 1 or per_page < 1:
+        return JsonResponse({"error": "page and per_page must be positive."}, status=status.HTTP_400_BAD_REQUEST)
+
+    services = await run_query(cached_shop_services, shop_id, lambda: _serialize_shop_services(shop_id))
+    if services is None:
+        return JsonResponse({"error": "ShopProfile not found."}, status=status.HTTP_404_NOT_FOUND)
+
+    return JsonResponse(_services_page(services, page, per_page, request.build_absolute_uri('/')),
+                        status=status.HTTP_200_OK, encoder=JSONEncoder)
+
+
+@replica_reads
+async def list_reviews_async(request, shop_id):
+    if request.method != 'GET':
+        return JsonResponse({"error": "Method not allowed."}, status=405)
+    try:
+        per_page = int(request.GET.get('per_page', 10))
+        page = int(request.GET['page']) if 'page' in request.GET else None
+    except ValueError:
+        return JsonResponse({"error": "page and per_page must be integers."}, status=400)
+    if not 1 <= per_page <= REVIEWS_MAX_PER_PAGE:
+        return JsonResponse({"error": f"per_page must be between 1 and {REVIEWS_MAX_PER_PAGE}."}, status=400)
+    if page is not None and page < 1:
+        return JsonResponse({"error": "page must be positive."}, status=400)
+
+    after = None
+    if page is None and request.GET.get('cursor'):
+        try:
+            after = decode_review_cursor(request.GET['cursor'])
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+    try:
+        # The rating counters and the page itself do not depend on each other
+        shop, (reviews, next_cursor) = await asyncio.gather(
+            run_query(ShopProfile.objects.filter(shop_id=shop_id).values(*RATING_SUMMARY_FIELDS).first),
+            run_query(_review_page, shop_id, per_page, page=page, after=after),
+        )
+    except Exception:
+        logger.exception("Error occurred in list_reviews_async")
+        return JsonResponse({"error": "An unexpected error occurred. Please try again later."}, status=500)
+    if shop is None:
+        return JsonResponse({"error": "Shop profile not found."}, status=404)
+
+    response_data = {
+        'count': shop['rating_count'],
+        'per_page': per_page,
+        'rating': rating_summary(shop),
+    }
+    if page is not None:
+        response_data.update({
+            'total_pages': (shop['rating_count'] + per_page - 1) // per_page,  # Ceiling division
+            'current_page': page,
+        })
+    else:
+        response_data['next_cursor'] = next_cursor
+    response_data['results'] = reviews
+    return JsonResponse(response_data)
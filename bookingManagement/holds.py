@@ -0,0 +1,238 @@
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+
+# Short-lived slot holds taken between picking a slot and confirming the booking.
+# Holds of a shop's day live under one key: {hold_id: (minute_offset, quantity, expires_at)}.
+# Expired holds are dropped whenever a day is read or written; nothing scans for them.
+
+DEFAULT_SLOT_HOLD_SETTINGS = {
+    'BACKEND': 'locmem',
+    'CACHE_ALIAS': 'default',
+    'HOLD_MINUTES': 5,
+    'MAX_HOLD_MINUTES': 15,
+}
+
+
+def get_slot_hold_settings():
+    return dict(DEFAULT_SLOT_HOLD_SETTINGS, **getattr(settings, 'SLOT_HOLDS', {}))
+
+
+class LocMemHoldStore:
+    """In-process store with per-key expiry."""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.RLock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self._data[key]
+                return None
+            return value
+
+    def get_many(self, keys):
+        with self._lock:
+            return {key: value for key, value in ((key, self.get(key)) for key in keys) if value is not None}
+
+    def set(self, key, value, timeout):
+        with self._lock:
+            self._data[key] = (time.time() + timeout, value)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    @contextmanager
+    def lock(self, key):
+        with self._lock:
+            yield
+
+
+class DjangoCacheHoldStore:
+    """Store on a Django cache alias, shared between processes when the cache is."""
+
+    LOCK_TIMEOUT = 5
+    LOCK_WAIT = 2.0
+
+    def __init__(self, alias):
+        self.cache = caches[alias]
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def get_many(self, keys):
+        return self.cache.get_many(keys)
+
+    def set(self, key, value, timeout):
+        self.cache.set(key, value, timeout)
+
+    def delete(self, key):
+        self.cache.delete(key)
+
+    @contextmanager
+    def lock(self, key):
+        # cache.add is atomic on every backend, so it doubles as a short mutex
+        lock_key = f'{key}:lock'
+        deadline = time.monotonic() + self.LOCK_WAIT
+        while not self.cache.add(lock_key, 1, self.LOCK_TIMEOUT):
+            if time.monotonic() > deadline:
+                raise TimeoutError("Slot hold store is busy, please retry.")
+            time.sleep(0.01)
+        try:
+            yield
+        finally:
+            self.cache.delete(lock_key)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_hold_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                options = get_slot_hold_settings()
+                if options['BACKEND'] == 'django':
+                    _store = DjangoCacheHoldStore(options['CACHE_ALIAS'])
+                else:
+                    _store = LocMemHoldStore()
+    return _store
+
+
+def _day_key(shop_id, booking_date):
+    return f'slot_holds:{shop_id}:{booking_date}'
+
+
+def _active(holds, now):
+    return {hold_id: hold for hold_id, hold in (holds or {}).items() if hold[2] > now}
+
+
+def _held_by_minute(holds, now):
+    held = {}
+    for minute, quantity, _ in _active(holds, now).values():
+        held[minute] = held.get(minute, 0) + quantity
+    return held
+
+
+def active_holds(shop_id, booking_date):
+    """Return {minute_offset: held_quantity} for the unexpired holds of a shop's day."""
+    return _held_by_minute(get_hold_store().get(_day_key(shop_id, booking_date)), time.time())
+
+
+def active_holds_many(shop_days):
+    """
+    active_holds for many (shop_id, booking_date) pairs in one store round trip.
+    Returns {(shop_id, booking_date): {minute_offset: held_quantity}} for the pairs with holds.
+    """
+    keys = {_day_key(shop_id, booking_date): (shop_id, booking_date) for shop_id, booking_date in shop_days}
+    now = time.time()
+    held_by_day = {}
+    for key, holds in get_hold_store().get_many(list(keys)).items():
+        held = _held_by_minute(holds, now)
+        if held:
+            held_by_day[keys[key]] = held
+    return held_by_day
+
+
+def place_hold(shop_id, booking_date, minute, quantity, hold_minutes, has_capacity):
+    """
+    Reserve `quantity` places in a slot for hold_minutes. has_capacity(held_quantity)
+    is called with the quantity already held in that slot, under the day's lock,
+    and decides whether the new hold fits. Returns (hold_id, expires_at) or None.
+    """
+    store = get_hold_store()
+    key = _day_key(shop_id, booking_date)
+    now = time.time()
+    with store.lock(key):
+        holds = _active(store.get(key), now)
+        held_quantity = sum(hold[1] for hold in holds.values() if hold[0] == minute)
+        if not has_capacity(held_quantity):
+            return None
+
+        hold_id = uuid.uuid4().hex
+        expires_at = now + hold_minutes * 60
+        holds[hold_id] = (minute, quantity, expires_at)
+        store.set(key, holds, max(hold[2] for hold in holds.values()) - now)
+        store.set(f'slot_hold:{hold_id}', (str(shop_id), str(booking_date), minute, quantity, expires_at), hold_minutes * 60)
+    return hold_id, expires_at
+
+
+def reserve_against_holds(shop_id, booking_date, minute, reserve, hold_id=None):
+    """
+    Call reserve(held_quantity) under the day's lock, where held_quantity is what
+    the other active holds keep in that slot, and return its result. Holds are
+    placed under the same lock, so none can appear between the two.
+
+    With a hold_id, that hold must be active on this slot, otherwise None is
+    returned without calling reserve. One of its places is what gets reserved:
+    the rest stay held, and the hold is used up with its last place. Places are
+    consumed only if reserve succeeds, so a hold of quantity n converts into at
+    most n bookings however many requests present it.
+    """
+    store = get_hold_store()
+    key = _day_key(shop_id, booking_date)
+    now = time.time()
+    with store.lock(key):
+        holds = _active(store.get(key), now)
+        if hold_id is not None:
+            hold = holds.pop(hold_id, None)
+            if hold is None or hold[0] != minute:
+                return None
+            if hold[1] > 1:
+                holds[hold_id] = (hold[0], hold[1] - 1, hold[2])
+
+        held_quantity = sum(hold[1] for hold in holds.values() if hold[0] == minute)
+        if not reserve(held_quantity):
+            return False
+
+        if hold_id is not None:
+            if holds:
+                store.set(key, holds, max(hold[2] for hold in holds.values()) - now)
+            else:
+                store.delete(key)
+            if hold_id in holds:
+                _, quantity, expires_at = holds[hold_id]
+                store.set(f'slot_hold:{hold_id}', (str(shop_id), str(booking_date), minute, quantity, expires_at),
+                          expires_at - now)
+            else:
+                store.delete(f'slot_hold:{hold_id}')
+    return True
+
+
+def get_hold(hold_id):
+    """Return (shop_id, booking_date, minute, quantity, expires_at) of an active hold, or None."""
+    hold = get_hold_store().get(f'slot_hold:{hold_id}')
+    if hold is None or hold[4] <= time.time():
+        return None
+    return hold
+
+
+def release_hold(hold_id):
+    store = get_hold_store()
+    hold = store.get(f'slot_hold:{hold_id}')
+    if hold is None:
+        return False
+    shop_id, booking_date, _, _, _ = hold
+    key = _day_key(shop_id, booking_date)
+    now = time.time()
+    with store.lock(key):
+        holds = _active(store.get(key), now)
+        holds.pop(hold_id, None)
+        if holds:
+            store.set(key, holds, max(item[2] for item in holds.values()) - now)
+        else:
+            store.delete(key)
+        store.delete(f'slot_hold:{hold_id}')
+    return True
@@ -0,0 +1,64 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from bookingManagement.models import Booking, ShopDailyEarnings
+
+
+class Command(BaseCommand):
+    help = "Rebuild the ShopDailyEarnings rollup from the Booking table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shop-id', help="Only rebuild this shop.")
+        parser.add_argument('--start-date', help="First booking date to rebuild (YYYY-MM-DD).")
+        parser.add_argument('--end-date', help="Last booking date to rebuild (YYYY-MM-DD).")
+
+    def handle(self, *args, **options):
+        bookings = Booking.objects.exclude(shop_profile=None).exclude(booking_date=None)
+        rollup = ShopDailyEarnings.objects.all()
+
+        if options['shop_id']:
+            bookings = bookings.filter(shop_profile_id=options['shop_id'])
+            rollup = rollup.filter(shop_profile_id=options['shop_id'])
+        try:
+            if options['start_date']:
+                start_date = datetime.datetime.strptime(options['start_date'], '%Y-%m-%d').date()
+                bookings = bookings.filter(booking_date__gte=start_date)
+                rollup = rollup.filter(earnings_date__gte=start_date)
+            if options['end_date']:
+                end_date = datetime.datetime.strptime(options['end_date'], '%Y-%m-%d').date()
+                bookings = bookings.filter(booking_date__lte=end_date)
+                rollup = rollup.filter(earnings_date__lte=end_date)
+        except ValueError:
+            raise CommandError("Dates must use the YYYY-MM-DD format.")
+
+        # One grouped query over the bookings, then replace the rollup rows in the same range
+        totals = bookings.values('shop_profile_id', 'booking_date', 'status').annotate(
+            num_of_bookings=Count('booking_id'),
+            total_earnings=Sum('total_price')
+        ).order_by()
+
+        rows = {}
+        for total in totals.iterator():
+            # Null and empty statuses share the '' rollup row
+            key = (total['shop_profile_id'], total['booking_date'], total['status'] or '')
+            row = rows.get(key)
+            if row is None:
+                rows[key] = ShopDailyEarnings(
+                    shop_profile_id=key[0],
+                    earnings_date=key[1],
+                    status=key[2],
+                    num_of_bookings=total['num_of_bookings'],
+                    total_earnings=total['total_earnings'] or 0
+                )
+            else:
+                row.num_of_bookings += total['num_of_bookings']
+                row.total_earnings += total['total_earnings'] or 0
+
+        with transaction.atomic():
+            deleted, _ = rollup.delete()
+            ShopDailyEarnings.objects.bulk_create(rows.values(), batch_size=1000)
+
+        self.stdout.write(self.style.SUCCESS(f"Replaced {deleted} rollup rows with {len(rows)}."))
@@ -0,0 +1,36 @@
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def merge_duplicate_counters(apps, schema_editor):
+    # Collapse duplicate slot rows into one before the unique constraint is added
+    ShopBookingsCounter = apps.get_model('bookingManagement', 'ShopBookingsCounter')
+    duplicates = (ShopBookingsCounter.objects
+                  .values('shop_profile', 'booking_date', 'booking_time')
+                  .annotate(rows=Count('id'), total=Sum('num_of_bookings'))
+                  .filter(rows__gt=1))
+    for slot in duplicates:
+        counters = ShopBookingsCounter.objects.filter(
+            shop_profile=slot['shop_profile'],
+            booking_date=slot['booking_date'],
+            booking_time=slot['booking_time'],
+        ).order_by('id')
+        keep = counters.first()
+        counters.exclude(id=keep.id).delete()
+        keep.num_of_bookings = slot['total']
+        keep.save(update_fields=['num_of_bookings'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookingManagement', '0005_booking_total_price'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_counters, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='shopbookingscounter',
+            constraint=models.UniqueConstraint(fields=('shop_profile', 'booking_date', 'booking_time'), name='unique_shop_slot_counter'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.8 on 2026-10-18 11:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookingManagement', '0006_shopbookingscounter_unique_slot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookingIdempotencyKey',
+            fields=[
+                ('key_hash', models.CharField(help_text='sha256 of shop id and Idempotency-Key header', max_length=64, primary_key=True, serialize=False)),
+                ('request_hash', models.CharField(help_text='sha256 of the request payload the key was first used with', max_length=64)),
+                ('status_code', models.PositiveSmallIntegerField(blank=True, help_text='null while the first request is in flight', null=True)),
+                ('response_body', models.TextField(blank=True, default='')),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.2.8 on 2026-10-18 11:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopManagement', '0009_shopprofile_lat_lon_index'),
+        ('bookingManagement', '0007_bookingidempotencykey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShopDailyEarnings',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('earnings_date', models.DateField()),
+                ('status', models.CharField(blank=True, default='', max_length=250)),
+                ('num_of_bookings', models.IntegerField(default=0)),
+                ('total_earnings', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('shop_profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_earnings', to='shopManagement.shopprofile')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='shopdailyearnings',
+            constraint=models.UniqueConstraint(fields=('shop_profile', 'earnings_date', 'status'), name='unique_shop_daily_earnings'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.8 on 2026-10-18 11:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookingManagement', '0008_shopdailyearnings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bookingidempotencykey',
+            name='locked_until',
+            field=models.DateTimeField(blank=True, help_text='lease of the in-flight request; a retry may take the key over once it passes', null=True),
+        ),
+    ]
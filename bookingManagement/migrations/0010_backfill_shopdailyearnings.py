@@ -0,0 +1,48 @@
+# Generated by Django 3.2.8 on 2026-10-18 16:20
+
+from django.db import migrations
+from django.db.models import Count, Sum
+
+
+def backfill_daily_earnings(apps, schema_editor):
+    # Same rebuild as `manage.py backfill_daily_earnings`, so get_shop_earnings covers the bookings made before the rollup
+    Booking = apps.get_model('bookingManagement', 'Booking')
+    ShopDailyEarnings = apps.get_model('bookingManagement', 'ShopDailyEarnings')
+    totals = Booking.objects.exclude(shop_profile=None).exclude(booking_date=None).values(
+        'shop_profile_id', 'booking_date', 'status'
+    ).annotate(
+        num_of_bookings=Count('booking_id'),
+        total_earnings=Sum('total_price')
+    ).order_by()
+
+    rows = {}
+    for total in totals.iterator():
+        # Null and empty statuses share the '' rollup row
+        key = (total['shop_profile_id'], total['booking_date'], total['status'] or '')
+        row = rows.get(key)
+        if row is None:
+            rows[key] = ShopDailyEarnings(
+                shop_profile_id=key[0],
+                earnings_date=key[1],
+                status=key[2],
+                num_of_bookings=total['num_of_bookings'],
+                total_earnings=total['total_earnings'] or 0
+            )
+        else:
+            row.num_of_bookings += total['num_of_bookings']
+            row.total_earnings += total['total_earnings'] or 0
+
+    # Rows written since 0008 are replaced too, as they only hold the changes made after it
+    ShopDailyEarnings.objects.all().delete()
+    ShopDailyEarnings.objects.bulk_create(rows.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookingManagement', '0009_bookingidempotencykey_locked_until'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_daily_earnings, migrations.RunPython.noop),
+    ]
@@ -34,3 +34,30 @@ class ShopBookingsCounter(models.Model):
     booking_date = models.DateField(null=True)
     booking_time = models.TimeField(null=True)
 
+    class Meta:
+        constraints = [
+            # One counter per slot, so capacity can be reserved with a single conditional UPDATE
+            models.UniqueConstraint(fields=['shop_profile', 'booking_date', 'booking_time'], name='unique_shop_slot_counter'),
+        ]
+
+# Per shop, day and booking status totals, maintained with the bookings so earnings never scan Booking
+class ShopDailyEarnings(models.Model):
+    shop_profile = models.ForeignKey(ShopProfile, on_delete=models.CASCADE, related_name='daily_earnings')
+    earnings_date = models.DateField()
+    status = models.CharField(blank=True, default='', max_length=250)
+    num_of_bookings = models.IntegerField(default=0)
+    total_earnings = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['shop_profile', 'earnings_date', 'status'], name='unique_shop_daily_earnings'),
+        ]
+
+# Responses of create_booking stored per Idempotency-Key, so client retries are answered without re-running the booking
+class BookingIdempotencyKey(models.Model):
+    key_hash = models.CharField(primary_key=True, max_length=64, help_text="sha256 of shop id and Idempotency-Key header")
+    request_hash = models.CharField(max_length=64, help_text="sha256 of the request payload the key was first used with")
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True, help_text="null while the first request is in flight")
+    locked_until = models.DateTimeField(null=True, blank=True, help_text="lease of the in-flight request; a retry may take the key over once it passes")
+    response_body = models.TextField(blank=True, default='')
+    expires_at = models.DateTimeField(db_index=True)
@@ -1,3 +1,781 @@
-from django.test import TestCase
+import datetime
+import importlib
+from urllib.parse import urlencode
+import json
+import threading
+import time
+import uuid
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.apps import apps as django_apps
+from django.db import connection
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from common.asgi import StreamingASGIHandler
+from shopManagement.models import ShopProfile, ShopService, ShopSettings
+from . import holds
+from .models import Booking, BookingIdempotencyKey, BookingService, ShopBookingsCounter, ShopDailyEarnings
+from .utils import (add_months, claim_idempotency_key, compile_slot_template, release_slot_capacity,
+                    reserve_slot_capacity, store_idempotent_response)
+
+
+class UpcomingBookingsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.shop = ShopProfile.objects.create(shop_name="Shop", about_us="", email="shop@example.com",
+                                              phone_number="0", address="")
+        cls.service = ShopService.objects.create(shop_profile=cls.shop, name="Haircut", price=10,
+                                                 duration=datetime.timedelta(minutes=30))
+        cls.date = datetime.date(2030, 1, 7)
+        for hour in range(9, 14):
+            for _ in range(2):
+                booking = Booking.objects.create(user_id="user", status='0', shop_profile=cls.shop, booking_date=cls.date,
+                                                 booking_time=datetime.time(hour, 0), total_price=10)
+                BookingService.objects.create(booking=booking, shop_service=cls.service)
+        Booking.objects.create(user_id="user", status='2', shop_profile=cls.shop, booking_date=cls.date,
+                               booking_time=datetime.time(9, 30), total_price=10)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.url = f'/booking/shop/{self.shop.shop_id}/get_bookings'
+
+    def get(self, **params):
+        return self.client.get(self.url, dict({'date': self.date.isoformat(), 'status': '0'}, **params))
+
+    def test_page_uses_two_queries(self):
+        with self.assertNumQueries(2):
+            response = self.get(limit=4)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['bookings']), 4)
+        self.assertEqual(response.data['bookings'][0]['shop_service'], "Haircut")
+        self.assertEqual(response.data['bookings'][0]['booking_time'], "09:00")
+        self.assertIsNotNone(response.data['next_cursor'])
+
+        with self.assertNumQueries(2):
+            response = self.get(limit=4, cursor=response.data['next_cursor'])
+        self.assertEqual(len(response.data['bookings']), 4)
+
+    def test_cursor_walks_every_booking_once_in_order(self):
+        seen = []
+        cursor = None
+        while True:
+            params = {'limit': 3}
+            if cursor:
+                params['cursor'] = cursor
+            response = self.get(**params)
+            seen.extend(response.data['bookings'])
+            cursor = response.data['next_cursor']
+            if cursor is None:
+                break
+
+        expected = list(Booking.objects.filter(status='0').order_by('booking_time', 'booking_id')
+                        .values_list('booking_id', flat=True))
+        self.assertEqual([booking['booking_id'] for booking in seen], [str(booking_id) for booking_id in expected])
+
+    def test_status_filter(self):
+        response = self.get(status='2')
+        self.assertEqual([booking['booking_time'] for booking in response.data['bookings']], ["09:30"])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.get(cursor='not-a-cursor').status_code, 400)
+
+    def test_unknown_shop(self):
+        response = self.client.get('/booking/shop/00000000-0000-0000-0000-000000000000/get_bookings', {'status': '0'})
+        self.assertEqual(response.status_code, 404)
+
+
+class ExportBookingsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.shop = ShopProfile.objects.create(shop_name="Shop", about_us="", email="shop@example.com",
+                                              phone_number="0", address="")
+        for day, booking_status in ((1, '0'), (2, '1'), (3, '2')):
+            Booking.objects.create(user_id="user", status=booking_status, shop_profile=cls.shop,
+                                   booking_date=datetime.date(2030, 1, day), booking_time=datetime.time(10, 0), total_price=10)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.url = f'/booking/shop/{self.shop.shop_id}/export'
+
+    def test_csv_export_is_streamed_and_filtered(self):
+        response = self.client.get(self.url, {'start_date': '2030-01-02', 'status': '1,2'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['booking_id', 'booking_date', 'booking_time'])
+        self.assertEqual([line.split(',')[1] for line in lines[1:]], ['2030-01-02', '2030-01-03'])
+
+    def test_ndjson_export(self):
+        response = self.client.get(self.url, {'export_format': 'ndjson', 'end_date': '2030-01-01'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([(row['booking_date'], row['status_name']) for row in rows], [('2030-01-01', "Booked")])
+
+
+def legacy_time_list(booking_settings, time_freq_map):
+    # The grid barber_available_slots built before slot templates, one datetime step at a time
+    next_time = booking_settings.start_time
+    time_list = []
+    while True:
+        remaining_slots = booking_settings.max_booking_per_time - time_freq_map.get(str(next_time), 0)
+        time_list.append({"time": ":".join(str(next_time).split(":")[:-1]), "remaining_slots": max(remaining_slots, 0)})
+        next_time = (datetime.datetime.combine(datetime.date.today(), next_time)
+                     + datetime.timedelta(minutes=int(booking_settings.period_of_each_booking))).time()
+        if next_time > booking_settings.end_time:
+            break
+    return time_list
+
+
+class SlotTemplateTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.shop = ShopProfile.objects.create(shop_name="Shop", about_us="", email="shop@example.com",
+                                              phone_number="0", address="")
+        cls.settings = ShopSettings.objects.create(shop_profile=cls.shop, start_time=datetime.time(9, 0),
+                                                   end_time=datetime.time(11, 0), max_booking_per_time=2)
+        ShopBookingsCounter.objects.create(shop_profile=cls.shop, booking_date=datetime.date(2030, 1, 7),
+                                           booking_time=datetime.time(10, 0), num_of_bookings=1)
+        ShopBookingsCounter.objects.create(shop_profile=cls.shop, booking_date=datetime.date(2030, 1, 7),
+                                           booking_time=datetime.time(10, 30), num_of_bookings=3)
+
+    def setUp(self):
+        holds._store = None
+        self.client = APIClient()
+
+    def slots(self):
+        # barber_available_slots reads the date from the request body
+        response = self.client.generic('GET', f'/booking/shop/{self.shop.shop_id}/slots',
+                                       json.dumps({'date': '2030-01-07'}), content_type='application/json')
+        return response.data['time_list']
+
+    def test_end_time_is_included(self):
+        minutes, labels = compile_slot_template(datetime.time(9, 0), datetime.time(11, 0), "30")
+        self.assertEqual(list(minutes), [540, 570, 600, 630, 660])
+        self.assertEqual(labels, ("09:00", "09:30", "10:00", "10:30", "11:00"))
+
+    def test_period_that_does_not_divide_the_window(self):
+        _, labels = compile_slot_template(datetime.time(9, 0), datetime.time(10, 0), "25")
+        self.assertEqual(labels, ("09:00", "09:25", "09:50"))
+
+    def test_end_time_close_to_midnight(self):
+        # Stepping datetimes wrapped past midnight here and never got beyond end_time
+        _, labels = compile_slot_template(datetime.time(23, 0), datetime.time(23, 59), "30")
+        self.assertEqual(labels, ("23:00", "23:30"))
+        minutes, labels = compile_slot_template(datetime.time(0, 0), datetime.time(23, 59), "1")
+        self.assertEqual((len(minutes), labels[0], labels[-1]), (1440, "00:00", "23:59"))
+
+        ShopSettings.objects.filter(pk=self.settings.pk).update(start_time=datetime.time(22, 0),
+                                                                end_time=datetime.time(23, 45))
+        self.assertEqual([slot['time'] for slot in self.slots()], ["22:00", "22:30", "23:00", "23:30"])
+
+    def test_slots_match_the_legacy_grid(self):
+        time_freq_map = {'10:00:00': 1, '10:30:00': 3}
+        for start_time, end_time, period in ((datetime.time(9, 0), datetime.time(11, 0), "30"),
+                                             (datetime.time(9, 0), datetime.time(10, 50), "20"),
+                                             (datetime.time(8, 15), datetime.time(17, 0), "45"),
+                                             (datetime.time(10, 0), datetime.time(10, 0), "15")):
+            ShopSettings.objects.filter(pk=self.settings.pk).update(start_time=start_time, end_time=end_time,
+                                                                    period_of_each_booking=period)
+            self.settings.refresh_from_db()
+            with self.subTest(start_time=start_time, end_time=end_time, period=period):
+                self.assertEqual(self.slots(), legacy_time_list(self.settings, time_freq_map))
+
+    def test_updated_preferences_change_the_grid(self):
+        self.assertEqual(len(self.slots()), 5)
+        response = self.client.put(f'/shop/{self.shop.shop_id}/update-preferences',
+                                   {'end_time': '12:00:00', 'period_of_each_booking': 60}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.slots(), [{'time': "09:00", 'remaining_slots': 2}, {'time': "10:00", 'remaining_slots': 1},
+                                        {'time': "11:00", 'remaining_slots': 2}, {'time': "12:00", 'remaining_slots': 2}])
+
+
+class AvailabilityCalendarTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.shop = ShopProfile.objects.create(shop_name="Shop", about_us="", email="shop@example.com",
+                                              phone_number="0", address="")
+        # Five slots of two places a day, weekends closed, bookable for a month
+        ShopSettings.objects.create(shop_profile=cls.shop, start_time=datetime.time(9, 0), end_time=datetime.time(11, 0),
+                                    max_booking_per_time=2)
+        today = datetime.date.today()
+        cls.monday = today + datetime.timedelta(days=7 - today.weekday())
+
+    def setUp(self):
+        holds._store = None
+        self.client = APIClient()
+
+    def day(self, offset):
+        return (self.monday + datetime.timedelta(days=offset)).isoformat()
+
+    def add_counter(self, offset, time, num_of_bookings):
+        ShopBookingsCounter.objects.create(shop_profile=self.shop, booking_date=self.day(offset), booking_time=time,
+                                           num_of_bookings=num_of_bookings)
+
+    def calendar(self, **params):
+        response = self.client.get(f'/booking/shop/{self.shop.shop_id}/availability', params)
+        return json.loads(b''.join(response.streaming_content))
+
+    def capacities(self, **params):
+        return [day['remaining_capacity'] for day in self.calendar(**params)['days']]
+
+    def test_weekends_are_closed_when_disabled(self):
+        days = self.calendar(start_date=self.day(0), end_date=self.day(6))['days']
+        self.assertEqual([day['remaining_capacity'] for day in days], [10, 10, 10, 10, 10, 0, 0])
+        self.assertEqual([day['available'] for day in days[4:]], [True, False, False])
+
+        ShopSettings.objects.filter(shop_profile=self.shop).update(disable_weekend=False)
+        self.assertEqual(self.capacities(start_date=self.day(0), end_date=self.day(6)), [10] * 7)
+
+    def test_max_booking_per_day_caps_the_capacity(self):
+        ShopSettings.objects.filter(shop_profile=self.shop).update(max_booking_per_day=4)
+        self.add_counter(1, datetime.time(9, 0), 1)
+        self.add_counter(2, datetime.time(9, 0), 2)
+        self.add_counter(2, datetime.time(10, 0), 2)
+        self.add_counter(3, datetime.time(9, 30), 2)
+        self.add_counter(3, datetime.time(10, 30), 2)
+        self.add_counter(3, datetime.time(11, 0), 1)
+        # Booked places count against the daily cap as well as their slot
+        self.assertEqual(self.capacities(start_date=self.day(0), end_date=self.day(3)), [4, 3, 0, 0])
+
+    def test_range_is_clamped_to_the_booking_window(self):
+        today = datetime.date.today()
+        window_end = add_months(today, 1)
+        body = self.calendar(start_date=(today - datetime.timedelta(days=30)).isoformat(),
+                             end_date=(today + datetime.timedelta(days=365)).isoformat())
+        self.assertEqual((body['start_date'], body['end_date']), (today.isoformat(), window_end.isoformat()))
+        self.assertEqual([day['date'] for day in body['days']],
+                         [(today + datetime.timedelta(days=offset)).isoformat()
+                          for offset in range((window_end - today).days + 1)])
+        # The whole window is the default range
+        self.assertEqual(self.calendar()['days'], body['days'])
+
+        response = self.client.get(f'/booking/shop/{self.shop.shop_id}/availability',
+                                   {'start_date': (window_end + datetime.timedelta(days=1)).isoformat()})
+        self.assertEqual(response.status_code, 400)
+
+    def test_detail_lists_the_slots_of_each_day(self):
+        self.add_counter(0, datetime.time(9, 30), 2)
+        self.add_counter(0, datetime.time(10, 0), 1)
+        self.assertNotIn('time_list', self.calendar(start_date=self.day(0), end_date=self.day(0))['days'][0])
+
+        days = self.calendar(start_date=self.day(0), end_date=self.day(5), detail='true')['days']
+        self.assertEqual(days[0]['time_list'], [
+            {'time': "09:00", 'remaining_slots': 2}, {'time': "09:30", 'remaining_slots': 0},
+            {'time': "10:00", 'remaining_slots': 1}, {'time': "10:30", 'remaining_slots': 2},
+            {'time': "11:00", 'remaining_slots': 2}])
+        self.assertEqual(days[0]['remaining_capacity'], 7)
+        self.assertEqual(len(days[1]['time_list']), 5)
+        # A closed day has no slots
+        self.assertEqual(days[5]['time_list'], [])
+
+    def test_one_counter_query_for_the_whole_range(self):
+        for offset in range(0, 21, 2):
+            self.add_counter(offset, datetime.time(9, 0), 1)
+            self.add_counter(offset, datetime.time(10, 30), 2)
+
+        with CaptureQueriesContext(connection) as queries:
+            days = self.calendar(start_date=self.day(0), end_date=self.day(20), detail='true')['days']
+        # Shop, settings and the counters of all 21 days
+        self.assertEqual(len(queries), 3)
+        self.assertEqual(sum('shopbookingscounter' in query['sql'].lower() for query in queries), 1)
+        self.assertEqual(len(days), 21)
+        self.assertEqual([day['remaining_capacity'] for day in days[:3]], [7, 10, 7])
+
+
+class BulkAvailableSlotsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.shops = []
+        for index in range(6):
+            shop = ShopProfile.objects.create(shop_name=f"Shop {index}", about_us="", email=f"shop{index}@example.com",
+                                              phone_number="0", address="")
+            ShopSettings.objects.create(shop_profile=shop, start_time=datetime.time(9, 0), end_time=datetime.time(11, 0),
+                                        max_booking_per_time=2)
+            cls.shops.append(shop)
+        cls.unconfigured = ShopProfile.objects.create(shop_name="New shop", about_us="", email="new@example.com",
+                                                      phone_number="0", address="")
+        # A Monday, so the weekend closure does not apply
+        cls.date = datetime.date(2030, 1, 7)
+
+    def setUp(self):
+        holds._store = None
+        self.client = APIClient()
+
+    def bulk(self, shops, **params):
+        params.setdefault('date', self.date.isoformat())
+        return self.client.get('/booking/shops/slots', dict(params, shop_ids=','.join(str(shop.shop_id) for shop in shops)))
+
+    def times(self, shops, **params):
+        return {shop['shop_id']: [slot['time'] for slot in shop['time_list']]
+                for shop in self.bulk(shops, **params).data['shops']}
+
+    def test_query_count_does_not_grow_with_the_shops(self):
+        for shop in self.shops:
+            ShopBookingsCounter.objects.create(shop_profile=shop, booking_date=self.date, booking_time=datetime.time(9, 0),
+                                               num_of_bookings=2)
+        # All settings in one query, all counters in another
+        for shops in (self.shops[:1], self.shops[:3], self.shops):
+            with self.assertNumQueries(2):
+                shop_times = self.times(shops)
+            self.assertEqual(list(shop_times.values()), [["09:30", "10:00", "10:30"]] * len(shops))
+
+    def test_slots_that_already_started_today_are_skipped(self):
+        now = timezone.make_aware(datetime.datetime(2030, 1, 7, 10, 10))
+        with mock.patch('django.utils.timezone.now', return_value=now):
+            self.assertEqual(self.times(self.shops[:1]), {str(self.shops[0].shop_id): ["10:30", "11:00"]})
+            # The date defaults to today
+            self.assertEqual(self.bulk(self.shops[:1], date='').data['date'], "2030-01-07")
+            # Other days are offered from their first slot
+            self.assertEqual(self.times(self.shops[:1], date='2030-01-08'),
+                             {str(self.shops[0].shop_id): ["09:00", "09:30", "10:00"]})
+
+    def test_count_truncates_the_free_slots(self):
+        ShopBookingsCounter.objects.create(shop_profile=self.shops[0], booking_date=self.date,
+                                           booking_time=datetime.time(9, 30), num_of_bookings=2)
+        self.assertEqual(self.times(self.shops[:1], count=2), {str(self.shops[0].shop_id): ["09:00", "10:00"]})
+        self.assertEqual(len(self.times(self.shops[:1], count=10)[str(self.shops[0].shop_id)]), 4)
+        self.assertEqual(self.bulk(self.shops[:1], count=0).status_code, 400)
+        self.assertEqual(self.bulk(self.shops[:1], count='many').status_code, 400)
+
+    def test_repeated_shop_ids_are_answered_once(self):
+        first, second = self.shops[:2]
+        response = self.client.get('/booking/shops/slots', {
+            'shop_ids': [f'{first.shop_id},{second.shop_id}', str(first.shop_id), str(second.shop_id).upper()],
+            'date': self.date.isoformat()})
+        self.assertEqual([shop['shop_id'] for shop in response.data['shops']], [str(first.shop_id), str(second.shop_id)])
+
+    def test_shops_without_settings(self):
+        unknown = ShopProfile(shop_id=uuid.uuid4())
+        shops = {shop['shop_id']: shop for shop in self.bulk([self.shops[0], self.unconfigured, unknown]).data['shops']}
+        self.assertEqual(len(shops[str(self.shops[0].shop_id)]['time_list']), 3)
+        for shop in (self.unconfigured, unknown):
+            self.assertEqual(shops[str(shop.shop_id)], {'shop_id': str(shop.shop_id), 'time_list': [],
+                                                        'message': "Barber Booking Settings Not Configured Yet.."})
+
+
+class CreateBookingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.shop = ShopProfile.objects.create(shop_name="Shop", about_us="", email="shop@example.com",
+                                              phone_number="0", address="")
+        ShopSettings.objects.create(shop_profile=cls.shop, start_time=datetime.time(9, 0), end_time=datetime.time(11, 0),
+                                    max_booking_per_time=2)
+        cls.service = ShopService.objects.create(shop_profile=cls.shop, name="Haircut", price=10,
+                                                 duration=datetime.timedelta(minutes=30))
+
+    def setUp(self):
+        holds._store = None
+        self.client = APIClient()
+
+    def book(self, service_ids=None, **extra):
+        return self.client.post(f'/booking/shop/{self.shop.shop_id}/create', dict({
+            'service_ids': service_ids or [str(self.service.service_id)], 'date': '2030-01-07', 'time': '09:30',
+            'user_id': "user", 'total_price': 25}, **extra), format='json')
+
+    def update_status(self, booking, new_status):
+        return self.client.post('/booking/update_booking_status', {'booking_id': str(booking.booking_id), 'status': new_status})
+
+    def counter(self, booking_time='09:30'):
+        return ShopBookingsCounter.objects.filter(shop_profile=self.shop, booking_time=booking_time).values_list(
+            'num_of_bookings', flat=True).first()
+
+    def test_capacity_is_exhausted_at_max_booking_per_time(self):
+        self.assertEqual(self.book().status_code, 201)
+        self.assertEqual(self.counter(), 1)
+        self.assertEqual(self.book().status_code, 201)
+        self.assertEqual(self.counter(), 2)
+
+        self.assertEqual(self.book().data['message'], "No Slots Available for the selected time")
+        self.assertEqual((self.counter(), Booking.objects.count()), (2, 2))
+        # Other slots keep their own counters
+        self.assertEqual(self.book(time='10:00').status_code, 201)
+        self.assertEqual((self.counter(), self.counter('10:00')), (2, 1))
+
+    def test_cancelling_frees_the_place(self):
+        self.book()
+        self.book()
+        first, second = Booking.objects.order_by('booking_id')
+
+        self.assertEqual(self.update_status(first, '2').status_code, 200)
+        self.assertEqual(self.counter(), 1)
+        # Completed bookings keep their place
+        self.assertEqual(self.update_status(second, '1').status_code, 200)
+        self.assertEqual(self.counter(), 1)
+        # Only booked bookings can change status, so a second cancel frees nothing
+        self.assertEqual(self.update_status(first, '2').status_code, 400)
+        self.assertEqual(self.counter(), 1)
+
+        self.assertEqual(self.book().status_code, 201)
+        self.assertEqual(self.counter(), 2)
+
+    def test_concurrent_status_change_is_applied_once(self):
+        self.book()
+        booking = Booking.objects.get()
+        # Both requests read the booking while it is still booked
+        reads = [Booking.objects.get(), Booking.objects.get()]
+        with mock.patch.object(Booking.objects, 'get', side_effect=reads):
+            self.assertEqual(self.update_status(booking, '1').status_code, 200)
+            self.assertEqual(self.update_status(booking, '2').status_code, 400)
+        self.assertEqual(Booking.objects.get().status, '1')
+        self.assertEqual(self.counter(), 1)
+        self.assertEqual(sorted(ShopDailyEarnings.objects.values_list('status', 'num_of_bookings')), [('0', 0), ('1', 1)])
+
+    def test_reservation_never_exceeds_the_maximum(self):
+        self.assertTrue(reserve_slot_capacity(self.shop, datetime.date(2030, 1, 7), '09:30', 2, quantity=2))
+        self.assertFalse(reserve_slot_capacity(self.shop, datetime.date(2030, 1, 7), '09:30', 2))
+        release_slot_capacity(self.shop, datetime.date(2030, 1, 7), '09:30', quantity=3)
+        self.assertEqual(self.counter(), 2)
+
+    def test_multi_service_booking_is_written_in_bulk(self):
+        beard = ShopService.objects.create(shop_profile=self.shop, name="Beard", price=5,
+                                           duration=datetime.timedelta(minutes=15))
+        ShopSettings.objects.filter(shop_profile=self.shop).update(max_booking_per_time=3)
+        # The first booking of a slot creates its counter and rollup rows; compare the steady state
+        self.book()
+        with CaptureQueriesContext(connection) as one_service:
+            self.book()
+        with CaptureQueriesContext(connection) as two_services:
+            response = self.book(service_ids=[str(self.service.service_id), str(beard.service_id)])
+        self.assertEqual(response.status_code, 201)
+        # The row count grows, the query count does not
+        self.assertEqual(len(two_services), len(one_service))
+
+        self.assertEqual(Booking.objects.count(), 4)
+        self.assertEqual(sorted(BookingService.objects.values_list('shop_service__name', flat=True)),
+                         ["Beard", "Haircut", "Haircut", "Haircut"])
+        # One customer takes one place in the slot, however many services they book
+        self.assertEqual(self.counter(), 3)
+
+    def test_unknown_service_leaves_no_trace(self):
+        other_shop = ShopProfile.objects.create(shop_name="Other", about_us="", email="other@example.com",
+                                                phone_number="1", address="")
+        other_service = ShopService.objects.create(shop_profile=other_shop, name="Haircut", price=10,
+                                                   duration=datetime.timedelta(minutes=30))
+        for service_ids in ([str(self.service.service_id), '00000000-0000-0000-0000-000000000000'],
+                            [str(other_service.service_id)], ['not-a-uuid']):
+            self.assertEqual(self.book(service_ids=service_ids).status_code, 400)
+        self.assertIsNone(self.counter())
+        self.assertEqual((Booking.objects.count(), BookingService.objects.count()), (0, 0))
+
+
+class DailyEarningsRollupTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.shop = ShopProfile.objects.create(shop_name="Shop", about_us="", email="shop@example.com",
+                                              phone_number="0", address="")
+        ShopSettings.objects.create(shop_profile=cls.shop, start_time=datetime.time(9, 0), end_time=datetime.time(11, 0),
+                                    max_booking_per_time=5)
+        cls.haircut = ShopService.objects.create(shop_profile=cls.shop, name="Haircut", price=10,
+                                                 duration=datetime.timedelta(minutes=30))
+        cls.beard = ShopService.objects.create(shop_profile=cls.shop, name="Beard", price=5,
+                                               duration=datetime.timedelta(minutes=15))
+
+    def setUp(self):
+        holds._store = None
+        self.client = APIClient()
+
+    def book(self, service_ids, total_price):
+        return self.client.post(f'/booking/shop/{self.shop.shop_id}/create', {
+            'service_ids': service_ids, 'date': '2030-01-07', 'time': '09:30', 'user_id': "user",
+            'total_price': total_price}, format='json')
+
+    def rollup(self):
+        return {row.status: (row.num_of_bookings, row.total_earnings)
+                for row in ShopDailyEarnings.objects.filter(shop_profile=self.shop, earnings_date=datetime.date(2030, 1, 7))}
+
+    def earnings(self):
+        return self.client.get(f'/shop/{self.shop.shop_id}/earnings',
+                               {'start_date': '2030-01-01', 'end_date': '2030-01-31'}).data['total_earnings']
+
+    def test_rollup_follows_create_and_status_changes(self):
+        self.book([str(self.haircut.service_id)], '10.50')
+        self.book([str(self.haircut.service_id), str(self.beard.service_id)], 15)
+        self.assertEqual(self.rollup(), {'0': (3, Decimal('40.50'))})
+        self.assertEqual(self.earnings(), Decimal('40.50'))
+
+        cancelled, completed = Booking.objects.filter(total_price=15)
+        for booking, new_status in ((cancelled, '2'), (completed, '1')):
+            self.client.post('/booking/update_booking_status', {'booking_id': str(booking.booking_id), 'status': new_status})
+        self.assertEqual(self.rollup(), {'0': (1, Decimal('10.50')), '1': (1, Decimal('15')), '2': (1, Decimal('15'))})
+        # Cancelled bookings drop out of the earnings
+        self.assertEqual(self.earnings(), Decimal('25.50'))
+
+    def test_rollup_matches_the_bookings(self):
+        self.book([str(self.haircut.service_id)], 10)
+        self.book([str(self.beard.service_id)], 5)
+        self.client.post('/booking/update_booking_status',
+                         {'booking_id': str(Booking.objects.get(total_price=5).booking_id), 'status': '2'})
+
+        for booking_status, (num_of_bookings, total_earnings) in self.rollup().items():
+            bookings = Booking.objects.filter(shop_profile=self.shop, status=booking_status)
+            self.assertEqual(num_of_bookings, bookings.count())
+            self.assertEqual(total_earnings, bookings.aggregate(total=Sum('total_price'))['total'] or 0)
+
+    def test_migration_backfills_bookings_made_before_the_rollup(self):
+        self.book([str(self.haircut.service_id)], 10)
+        # Bookings written before 0008 have no rollup rows
+        Booking.objects.create(shop_profile=self.shop, booking_date=datetime.date(2030, 1, 7),
+                               booking_time=datetime.time(10, 0), status='1', total_price=20)
+        ShopDailyEarnings.objects.all().delete()
+
+        backfill = importlib.import_module('bookingManagement.migrations.0010_backfill_shopdailyearnings')
+        backfill.backfill_daily_earnings(django_apps, None)
+        self.assertEqual(self.rollup(), {'0': (1, Decimal('10')), '1': (1, Decimal('20'))})
+        self.assertEqual(self.earnings(), Decimal('30'))
+
+
+class SlotHoldTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.shop = ShopProfile.objects.create(shop_name="Shop", about_us="", email="shop@example.com",
+                                              phone_number="0", address="")
+        ShopSettings.objects.create(shop_profile=cls.shop, start_time=datetime.time(9, 0), end_time=datetime.time(11, 0),
+                                    max_booking_per_time=1)
+        cls.service = ShopService.objects.create(shop_profile=cls.shop, name="Haircut", price=10,
+                                                 duration=datetime.timedelta(minutes=30))
+        cls.date = (datetime.date.today() + datetime.timedelta(days=1)).isoformat()
+
+    def setUp(self):
+        # A fresh in-process hold store per test
+        holds._store = None
+        self.client = APIClient()
+
+    def hold(self, quantity=1):
+        return self.client.post(f'/booking/shop/{self.shop.shop_id}/hold', {'date': self.date, 'time': '09:30',
+                                                                           'quantity': quantity})
+
+    def book(self, **extra):
+        return self.client.post(f'/booking/shop/{self.shop.shop_id}/create', dict({
+            'service_ids': [str(self.service.service_id)], 'date': self.date, 'time': '09:30',
+            'user_id': "user", 'total_price': 10}, **extra), format='json')
+
+    def counter(self):
+        return ShopBookingsCounter.objects.filter(shop_profile=self.shop).values_list('num_of_bookings', flat=True).first()
+
+    def test_hold_converts_into_one_booking(self):
+        hold_id = self.hold().data['hold_id']
+        self.assertEqual(self.book(hold_id=hold_id).status_code, 201)
+        self.assertEqual((self.counter(), Booking.objects.count()), (1, 1))
+        self.assertEqual(holds.active_holds(self.shop.shop_id, self.date), {})
+
+        # Presenting the hold again books nothing, the slot is full
+        self.assertEqual(self.book(hold_id=hold_id).data['message'], "No Slots Available for the selected time")
+        self.assertEqual((self.counter(), Booking.objects.count()), (1, 1))
+
+    def test_a_group_hold_converts_one_place_per_booking(self):
+        ShopSettings.objects.filter(shop_profile=self.shop).update(max_booking_per_time=2)
+        hold_id = self.hold(quantity=2).data['hold_id']
+
+        self.assertEqual(self.book(hold_id=hold_id).status_code, 201)
+        self.assertEqual(holds.active_holds(self.shop.shop_id, self.date), {570: 1})
+        self.assertEqual(holds.get_hold(hold_id)[3], 1)
+        # The second held place is still kept from other customers
+        self.assertEqual(self.book().data['message'], "No Slots Available for the selected time")
+
+        self.assertEqual(self.book(hold_id=hold_id).status_code, 201)
+        self.assertIsNone(holds.get_hold(hold_id))
+        self.assertEqual(self.book(hold_id=hold_id).data['message'], "No Slots Available for the selected time")
+        self.assertEqual((self.counter(), Booking.objects.count()), (2, 2))
+
+    def test_a_held_place_is_not_taken_by_others(self):
+        hold_id = self.hold().data['hold_id']
+        self.assertEqual(self.book().data['message'], "No Slots Available for the selected time")
+        self.assertIsNone(self.counter())
+        self.assertEqual(self.hold().data['message'], "No Slots Available for the selected time")
+
+        self.assertEqual(self.book(hold_id=hold_id).status_code, 201)
+        self.assertEqual(self.counter(), 1)
+
+    def test_calendar_and_bulk_slots_count_held_places(self):
+        ShopSettings.objects.filter(shop_profile=self.shop).update(disable_weekend=False)
+        self.hold()
+
+        response = self.client.get(f'/booking/shop/{self.shop.shop_id}/availability',
+                                   {'start_date': self.date, 'end_date': self.date, 'detail': 'true'})
+        day = json.loads(b''.join(response.streaming_content))['days'][0]
+        self.assertEqual(day['time_list'][1], {'time': "09:30", 'remaining_slots': 0})
+        self.assertEqual(day['remaining_capacity'], 4)
+
+        shop = self.client.get('/booking/shops/slots', {'shop_ids': str(self.shop.shop_id), 'date': self.date}).data['shops'][0]
+        self.assertEqual([slot['time'] for slot in shop['time_list']], ["09:00", "10:00", "10:30"])
+
+    def test_hold_for_another_slot_is_not_converted(self):
+        hold_id = self.hold().data['hold_id']
+        self.assertEqual(self.book(hold_id=hold_id, time='10:00').status_code, 201)
+        self.assertEqual(holds.active_holds(self.shop.shop_id, self.date), {570: 1})
+
+    def test_released_or_expired_holds_give_the_place_back(self):
+        hold_id = self.hold().data['hold_id']
+        self.assertEqual(self.client.delete(f'/booking/shop/{self.shop.shop_id}/hold/{hold_id}').status_code, 200)
+        self.assertEqual(self.client.delete(f'/booking/shop/{self.shop.shop_id}/hold/{hold_id}').status_code, 404)
+        self.assertEqual(holds.active_holds(self.shop.shop_id, self.date), {})
+
+        self.hold()
+        with mock.patch.object(holds.time, 'time', return_value=time.time() + 24 * 60 * 60):
+            # An expired hold no longer keeps other customers out
+            self.assertEqual(self.book().status_code, 201)
+        self.assertEqual(self.counter(), 1)
+
+    def test_concurrent_conversions_of_one_hold(self):
+        hold_id, _ = holds.place_hold(self.shop.shop_id, self.date, 570, 1, 5, lambda held_quantity: True)
+        reserved = []
+
+        def reserve(held_quantity):
+            # Widen the window between reading the hold and consuming it
+            time.sleep(0.05)
+            reserved.append(held_quantity)
+            return True
+
+        threads = [threading.Thread(target=holds.reserve_against_holds,
+                                    args=(self.shop.shop_id, self.date, 570, reserve), kwargs={'hold_id': hold_id})
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(reserved, [0])
+        self.assertIsNone(holds.get_hold(hold_id))
+
+
+@override_settings(SLOT_HOLDS={'BACKEND': 'django'},
+                   CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class SharedSlotHoldTests(TestCase):
+
+    def setUp(self):
+        holds._store = None
+        self.addCleanup(setattr, holds, '_store', None)
+
+    def test_holds_are_seen_by_other_processes(self):
+        hold_id, _ = holds.place_hold('shop', '2030-01-07', 570, 2, 5, lambda held_quantity: True)
+        # Another process builds its own store on the same cache
+        holds._store = None
+        self.assertEqual(holds.active_holds('shop', '2030-01-07'), {570: 2})
+        self.assertEqual(holds.active_holds_many([('shop', '2030-01-07'), ('shop', '2030-01-08')]),
+                         {('shop', '2030-01-07'): {570: 2}})
+        self.assertTrue(holds.release_hold(hold_id))
+        holds._store = None
+        self.assertEqual(holds.active_holds('shop', '2030-01-07'), {})
+
+
+class IdempotencyKeyTests(TestCase):
+
+    def setUp(self):
+        self.shop_id = '00000000-0000-0000-0000-000000000001'
+        self.payload = {'date': '2030-01-07', 'time': '09:30'}
+
+    def claim(self, payload=None):
+        return claim_idempotency_key(self.shop_id, 'key-1', payload or self.payload)[1]
+
+    def test_claim_replay_and_mismatch(self):
+        record, state = claim_idempotency_key(self.shop_id, 'key-1', self.payload)
+        self.assertEqual(state, 'new')
+        self.assertEqual(self.claim(), 'in_progress')
+
+        store_idempotent_response(record, 201, {'message': "Booking Confirmed"})
+        self.assertEqual(self.claim(), 'replay')
+        self.assertEqual(self.claim({'date': '2030-01-08'}), 'mismatch')
+
+    def test_abandoned_claim_is_taken_over_after_its_lease(self):
+        self.assertEqual(self.claim(), 'new')
+        # The first request died without storing a response
+        BookingIdempotencyKey.objects.update(locked_until=timezone.now() - datetime.timedelta(seconds=1))
+
+        self.assertEqual(self.claim(), 'new')
+        # The new lease holds off further retries
+        self.assertEqual(self.claim(), 'in_progress')
+
+    def test_server_errors_free_the_key(self):
+        record, _ = claim_idempotency_key(self.shop_id, 'key-1', self.payload)
+        store_idempotent_response(record, 500, {'error': "boom"})
+        self.assertEqual(self.claim(), 'new')
+
+
+# Not a TestCase: the async view reads on pool threads, which cannot see an open test transaction
+class AsyncAvailableSlotsTests(TransactionTestCase):
+    databases = {'default', 'local'}
+
+    def setUp(self):
+        self.shop = ShopProfile.objects.create(shop_name="Shop", about_us="", email="shop@example.com",
+                                               phone_number="0", address="")
+        self.url = f'/booking/async/shop/{self.shop.shop_id}/slots'
+
+    def aget(self, path, params=None):
+        # AsyncClient in Django 3.2 ignores `data` on GET, so the query string goes in the path
+        return self.async_client.get(f'{path}?{urlencode(params or {})}')
+
+    async def test_slots(self):
+        self.assertEqual((await self.aget(self.url, {'date': '2030-01-07'})).status_code, 400)
+
+        await sync_to_async(ShopSettings.objects.create)(shop_profile=self.shop, start_time=datetime.time(9, 0),
+                                                         end_time=datetime.time(11, 0), max_booking_per_time=2)
+        await sync_to_async(ShopBookingsCounter.objects.create)(shop_profile=self.shop, booking_date=datetime.date(2030, 1, 7),
+                                                                booking_time=datetime.time(9, 30), num_of_bookings=2)
+        data = (await self.aget(self.url, {'date': '2030-01-07'})).json()
+        self.assertEqual([slot['remaining_slots'] for slot in data['time_list']], [2, 0, 2, 2, 2])
+
+        self.assertEqual((await self.aget(self.url, {'date': 'soon'})).status_code, 400)
+        self.assertEqual((await self.aget(self.url.replace(str(self.shop.shop_id), '00000000-0000-0000-0000-000000000000'),
+                                                      {'date': '2030-01-07'})).status_code, 404)
+
+
+# Not a TestCase: the streams read on the handler's sync thread, which cannot see an open test transaction
+class AsgiStreamingTests(TransactionTestCase):
+
+    def setUp(self):
+        self.shop = ShopProfile.objects.create(shop_name="Shop", about_us="", email="shop@example.com",
+                                               phone_number="0", address="")
+        ShopSettings.objects.create(shop_profile=self.shop, start_time=datetime.time(9, 0), end_time=datetime.time(11, 0),
+                                    max_booking_per_time=2, disable_weekend=False)
+        self.today = datetime.date.today()
+        for day in range(5):
+            Booking.objects.create(user_id="user", status='0', shop_profile=self.shop, booking_time=datetime.time(10, 0),
+                                   booking_date=self.today + datetime.timedelta(days=day), total_price=10)
+            ShopBookingsCounter.objects.create(shop_profile=self.shop, booking_date=self.today + datetime.timedelta(days=day),
+                                               booking_time=datetime.time(10, 0), num_of_bookings=1)
+
+    async def asgi_get(self, path, params):
+        # Drive the project's ASGI application directly, as uvicorn would
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': path, 'raw_path': path.encode(), 'query_string': urlencode(params).encode(), 'root_path': '',
+            'headers': [(b'host', b'testserver')], 'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+        }
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        await StreamingASGIHandler()(scope, receive, send)
+        self.assertEqual(messages[0]['status'], 200)
+        self.assertEqual(messages[-1], {'type': 'http.response.body'})
+        return b''.join(message.get('body', b'') for message in messages[1:]).decode()
+
+    async def test_bookings_export_streams_to_the_end(self):
+        body = await self.asgi_get(f'/booking/shop/{self.shop.shop_id}/export', {})
+        self.assertEqual(len(body.splitlines()), 6)
+        body = await self.asgi_get(f'/booking/shop/{self.shop.shop_id}/export', {'export_format': 'ndjson'})
+        self.assertEqual([json.loads(line)['booking_date'] for line in body.splitlines()],
+                         [(self.today + datetime.timedelta(days=day)).isoformat() for day in range(5)])
+
+    async def test_availability_calendar_streams_to_the_end(self):
+        end_date = self.today + datetime.timedelta(days=6)
+        body = json.loads(await self.asgi_get(f'/booking/shop/{self.shop.shop_id}/availability',
+                                              {'end_date': end_date.isoformat(), 'detail': 'true'}))
+        self.assertEqual(len(body['days']), 7)
+        self.assertEqual([day['remaining_capacity'] for day in body['days']], [9] * 5 + [10] * 2)
@@ -1,10 +1,17 @@
 from django.urls import path
 
-from .views import (barber_available_slots,create_booking, get_upcoming_bookings, update_booking_status)
+from .views import (barber_available_slots,barber_available_slots_async,barber_availability_calendar,bulk_available_slots,create_booking,
+                    create_slot_hold, export_bookings, get_upcoming_bookings, release_slot_hold, update_booking_status)
 
 urlpatterns = [
     path("shop/<uuid:shop_id>/slots",barber_available_slots,name="user_booking"),
+    path("async/shop/<uuid:shop_id>/slots",barber_available_slots_async,name="barber_available_slots_async"),
+    path("shop/<uuid:shop_id>/availability",barber_availability_calendar,name="barber_availability_calendar"),
+    path("shops/slots",bulk_available_slots,name="bulk_available_slots"),
     path("shop/<uuid:shop_id>/create",create_booking,name="create_booking"),
+    path("shop/<uuid:shop_id>/hold",create_slot_hold,name="create_slot_hold"),
+    path("shop/<uuid:shop_id>/hold/<str:hold_id>",release_slot_hold,name="release_slot_hold"),
     path("shop/<uuid:shop_id>/get_bookings", get_upcoming_bookings, name = "get upcoming bookings for Shop"),
+    path("shop/<uuid:shop_id>/export", export_bookings, name="export_bookings"),
     path("update_booking_status", update_booking_status, name = "Update Booking Status")
 ]
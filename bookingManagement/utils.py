@@ -1,8 +1,33 @@
+import base64
+import calendar
+import datetime
+from decimal import Decimal
+import hashlib
+import json
+import random
+import uuid
+from array import array
+from functools import lru_cache
+
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
 from django.shortcuts import redirect
 from django.utils.decorators import method_decorator
 
+from common import metrics
+from .models import BookingIdempotencyKey, ShopBookingsCounter, ShopDailyEarnings
+
+# How long a stored create_booking response is replayed for an Idempotency-Key
+BOOKING_IDEMPOTENCY_TTL_SECONDS = getattr(settings, 'BOOKING_IDEMPOTENCY_TTL_SECONDS', 24 * 60 * 60)
+# How long a claimed key stays in progress without a stored response before a retry may take it over.
+# Longer than any request may run, so a live request is never taken over.
+BOOKING_IDEMPOTENCY_LEASE_SECONDS = getattr(settings, 'BOOKING_IDEMPOTENCY_LEASE_SECONDS', 60)
+# Distinct (start_time, end_time, period) slot grids kept compiled
+SLOT_TEMPLATE_CACHE_SIZE = getattr(settings, 'SLOT_TEMPLATE_CACHE_SIZE', 512)
+
 
 class BookingSettingMixin(object):
     """
@@ -15,3 +40,202 @@ class BookingSettingMixin(object):
         if not request.user.is_staff:
             return redirect(settings.LOGIN_URL)
         return super().dispatch(request, *args, **kwargs)
+
+
+def _time_to_minutes(value):
+    return value.hour * 60 + value.minute
+
+
+# Slot grids are keyed by the settings values they are compiled from, so a changed
+# ShopSettings row simply compiles a new entry and shops with the same hours share one
+@lru_cache(maxsize=SLOT_TEMPLATE_CACHE_SIZE)
+def compile_slot_template(start_time, end_time, period_of_each_booking):
+    """
+    Build the slot grid of a day: the minute offsets (from midnight) of every
+    slot from start_time up to and including end_time, and their "HH:MM" labels.
+    """
+    minutes = array('H', range(_time_to_minutes(start_time), _time_to_minutes(end_time) + 1,
+                               int(period_of_each_booking)))
+    labels = tuple('%02d:%02d' % divmod(minute, 60) for minute in minutes)
+    return minutes, labels
+
+
+def get_slot_template(booking_settings):
+    return compile_slot_template(booking_settings.start_time, booking_settings.end_time,
+                                 booking_settings.period_of_each_booking)
+
+
+def merge_slot_template(template, time_freq_map, max_booking_per_time):
+    """Return [(label, remaining_slots)] for a day given its {minute_offset: num_of_bookings} counters."""
+    slot_minutes, slot_labels = template
+    merged = []
+    for minute, label in zip(slot_minutes, slot_labels):
+        remaining_slots = max_booking_per_time - time_freq_map.get(minute, 0)
+        merged.append((label, remaining_slots if remaining_slots > 0 else 0))
+    return merged
+
+
+def add_months(value, months):
+    # Clamp the day for shorter months, e.g. Jan 31 + 1 month -> Feb 28/29
+    month_index = value.month - 1 + months
+    year = value.year + month_index // 12
+    month = month_index % 12 + 1
+    return value.replace(year=year, month=month, day=min(value.day, calendar.monthrange(year, month)[1]))
+
+
+def _slot_counter(shop_profile, booking_date, booking_time):
+    return ShopBookingsCounter.objects.filter(
+        shop_profile=shop_profile, booking_date=booking_date, booking_time=booking_time)
+
+
+def reserve_slot_capacity(shop_profile, booking_date, booking_time, max_booking_per_time, quantity=1):
+    """
+    Atomically add `quantity` bookings to a slot counter if it stays within
+    max_booking_per_time. Returns True if the capacity was reserved.
+
+    The check and the increment happen in one UPDATE ... WHERE num + quantity <= max,
+    so concurrent requests can neither overbook nor lose increments. A missing
+    counter row is inserted, relying on the (shop_profile, booking_date,
+    booking_time) unique constraint to detect a concurrent insert.
+    """
+    if quantity > max_booking_per_time:
+        return False
+
+    slot = _slot_counter(shop_profile, booking_date, booking_time)
+    if slot.filter(num_of_bookings__lte=max_booking_per_time - quantity).update(
+            num_of_bookings=F('num_of_bookings') + quantity):
+        return True
+
+    try:
+        with transaction.atomic():
+            ShopBookingsCounter.objects.create(
+                shop_profile_id=getattr(shop_profile, 'pk', shop_profile),
+                booking_date=booking_date,
+                booking_time=booking_time,
+                num_of_bookings=quantity
+            )
+        return True
+    except IntegrityError:
+        # The row exists, either full or inserted concurrently; the conditional update decides
+        return slot.filter(num_of_bookings__lte=max_booking_per_time - quantity).update(
+            num_of_bookings=F('num_of_bookings') + quantity) > 0
+
+
+def release_slot_capacity(shop_profile, booking_date, booking_time, quantity=1):
+    # Atomic decrement that never goes below zero
+    _slot_counter(shop_profile, booking_date, booking_time).filter(
+        num_of_bookings__gte=quantity).update(num_of_bookings=F('num_of_bookings') - quantity)
+
+
+def _sha256(value):
+    return hashlib.sha256(value.encode()).hexdigest()
+
+
+def claim_idempotency_key(shop_id, idempotency_key, payload):
+    """
+    Claim an Idempotency-Key for a booking request. Returns (record, state) where
+    state is 'new' (caller runs the request and stores the result), 'replay'
+    (record holds the stored response), 'in_progress' (the first request has not
+    finished yet) or 'mismatch' (the key was used with a different payload).
+
+    A claim is a lease: if its request dies without storing a response, a retry
+    with the same payload takes the key over once locked_until has passed.
+    """
+    key_hash = _sha256(f'{shop_id}:{idempotency_key}')
+    request_hash = _sha256(json.dumps(payload, sort_keys=True, default=str))
+    now = timezone.now()
+
+    # Purge a batch of expired keys now and then, instead of scanning on every request
+    if random.random() < 0.01:
+        expired = list(BookingIdempotencyKey.objects.filter(expires_at__lt=now).values_list('pk', flat=True)[:100])
+        BookingIdempotencyKey.objects.filter(pk__in=expired).delete()
+
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                record = BookingIdempotencyKey.objects.create(
+                    key_hash=key_hash,
+                    request_hash=request_hash,
+                    locked_until=now + datetime.timedelta(seconds=BOOKING_IDEMPOTENCY_LEASE_SECONDS),
+                    expires_at=now + datetime.timedelta(seconds=BOOKING_IDEMPOTENCY_TTL_SECONDS)
+                )
+            return record, 'new'
+        except IntegrityError:
+            record = BookingIdempotencyKey.objects.filter(pk=key_hash).first()
+            if record is None:
+                continue
+            if record.expires_at <= now:
+                # Expired keys are reclaimed lazily
+                BookingIdempotencyKey.objects.filter(pk=key_hash, expires_at__lte=now).delete()
+                continue
+            break
+    else:
+        raise RuntimeError("Could not claim the Idempotency-Key, please retry.")
+
+    if record.request_hash != request_hash:
+        metrics.incr('booking_idempotency.mismatched')
+        return record, 'mismatch'
+    if record.status_code is None:
+        # The lease ran out without a stored response; the conditional update lets one retry take over
+        locked_until = now + datetime.timedelta(seconds=BOOKING_IDEMPOTENCY_LEASE_SECONDS)
+        if BookingIdempotencyKey.objects.filter(
+            Q(locked_until__isnull=True) | Q(locked_until__lte=now), pk=key_hash, status_code__isnull=True
+        ).update(locked_until=locked_until):
+            metrics.incr('booking_idempotency.reclaimed')
+            record.locked_until = locked_until
+            return record, 'new'
+        metrics.incr('booking_idempotency.in_progress')
+        return record, 'in_progress'
+    metrics.incr('booking_idempotency.replayed')
+    return record, 'replay'
+
+
+def store_idempotent_response(record, status_code, data):
+    # Server errors are not stored, so the client can retry them for real
+    if status_code >= 500:
+        record.delete()
+        return
+    record.status_code = status_code
+    record.response_body = json.dumps(data, default=str)
+    record.locked_until = None
+    record.save(update_fields=['status_code', 'response_body', 'locked_until'])
+    metrics.incr('booking_idempotency.stored')
+
+
+def record_daily_earnings(shop_profile, earnings_date, status, amount, num_of_bookings=1):
+    """Add (or with negative values, remove) bookings and their amount to a shop's daily earnings rollup."""
+    amount = Decimal(str(amount)) if amount not in (None, '') else Decimal(0)
+    status = status or ''
+    rollup = ShopDailyEarnings.objects.filter(shop_profile=shop_profile, earnings_date=earnings_date, status=status)
+    changes = {
+        'num_of_bookings': F('num_of_bookings') + num_of_bookings,
+        'total_earnings': F('total_earnings') + amount,
+    }
+    if rollup.update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            ShopDailyEarnings.objects.create(
+                shop_profile_id=getattr(shop_profile, 'pk', shop_profile),
+                earnings_date=earnings_date,
+                status=status,
+                num_of_bookings=num_of_bookings,
+                total_earnings=amount
+            )
+    except IntegrityError:
+        rollup.update(**changes)
+
+
+def encode_booking_cursor(booking_time, booking_id):
+    payload = f'{booking_time.isoformat()}|{booking_id}'.encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def decode_booking_cursor(cursor):
+    """Decode an opaque cursor into a (booking_time, booking_id) key. Raises ValueError if malformed."""
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        booking_time, booking_id = payload.split('|')
+        return datetime.time.fromisoformat(booking_time), uuid.UUID(booking_id)
+    except (TypeError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor.")
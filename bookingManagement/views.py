@@ -1,23 +1,50 @@
+import asyncio
+import csv
 import datetime
+import json
+import logging
+import uuid
+from decimal import Decimal
+from itertools import groupby
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
 from rest_framework.decorators import api_view
 from drf_spectacular.utils import extend_schema, OpenApiParameter, OpenApiResponse
 from common.utils import get_status_string
+from common.db import replica_reads, run_query
 
 from .models import Booking, BookingService, ShopBookingsCounter
 from shopManagement.models import ShopProfile, ShopService, ShopSettings
 from rest_framework.response import Response
 from rest_framework import status 
 from django.db import transaction
+from django.db.models import OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
 from datetime import date
 from usermanagement.models import userModel
+from .holds import (active_holds, active_holds_many, get_hold, get_slot_hold_settings, place_hold, release_hold,
+                    reserve_against_holds)
+from .utils import (add_months, claim_idempotency_key, decode_booking_cursor,
+                    encode_booking_cursor, get_slot_template, merge_slot_template,
+                    record_daily_earnings, release_slot_capacity, reserve_slot_capacity, store_idempotent_response)
 
-def add_delta(time: datetime.time, delta: datetime.datetime) -> datetime.time:
-    # transform to a full datetime first
-    return (datetime.datetime.combine(
-        datetime.date.today(), time
-    ) + delta).time()
+logger = logging.getLogger(__name__)
+
+# Upper bound on shops per bulk availability request
+MAX_BULK_SLOT_SHOPS = 100
+
+UPCOMING_BOOKINGS_DEFAULT_LIMIT = 50
+UPCOMING_BOOKINGS_MAX_LIMIT = 200
+
+# Rows fetched per round trip of the export's server-side cursor; memory stays bounded by this
+BOOKING_EXPORT_CHUNK_SIZE = 2000
+BOOKING_EXPORT_FIELDS = ('booking_id', 'booking_date', 'booking_time', 'status', 'user_id', 'service_name',
+                         'total_price', 'created_at', 'updated_at')
+BOOKING_EXPORT_COLUMNS = ('booking_id', 'booking_date', 'booking_time', 'status', 'status_name', 'user_id',
+                          'shop_service', 'total_price', 'created_at', 'updated_at')
 
 # this is invoked when user tries to click on barber tile for available slots
+@replica_reads
 @api_view(('GET',))
 def barber_available_slots(request, shop_id):
     try:
@@ -37,38 +64,253 @@ def barber_available_slots(request, shop_id):
                                             booking_date = date, 
                                             shop_profile = shop_profile
                                             ).values_list('booking_time','num_of_bookings').order_by('booking_time')
-        if len(existing_bookings_time_freq_list) == 0:
+        # Places held by users in checkout count as taken
+        held_slots = active_holds(shop_profile.shop_id, date)
+        if len(existing_bookings_time_freq_list) == 0 and not held_slots:
             return Response({'message':"No Bookings found for the Date provided.."},status=status.HTTP_200_OK)
-        
-        time_freq_map = {}
-        for time,num_of_bookings in existing_bookings_time_freq_list:
-            time_freq_map[str(time)] = num_of_bookings
-        booking_settings_start_time =  booking_settings.start_time
-        booking_settings_max_bookings_per_time =  booking_settings.max_booking_per_time
-        booking_settings_period_of_each_booking = booking_settings.period_of_each_booking
-        booking_settings_end_time = booking_settings.end_time
-        next_time = booking_settings_start_time
-        time_list = []
-        while True:
-            curr_available_time_existing_freq = 0 if time_freq_map.get(str(next_time)) is None else time_freq_map.get(str(next_time))
-            remaining_slots = booking_settings_max_bookings_per_time - curr_available_time_existing_freq 
-
-            if booking_settings_max_bookings_per_time <= curr_available_time_existing_freq:
-                remaining_slots = 0
-
-            time_list.append(
-                {"time": ":".join(str(next_time).split(":")[:-1]), "remaining_slots": remaining_slots})
-            next_time = add_delta(next_time, datetime.timedelta(
-                minutes=int(booking_settings_period_of_each_booking)))
-            if next_time > booking_settings_end_time:
-                break
+
+        time_list = _available_time_list(booking_settings, existing_bookings_time_freq_list, held_slots)
         return Response({'message':"available booking slots",'time_list':time_list},status=status.HTTP_200_OK)
     except Exception as e:
         print(str(e))
         return Response({'Internal server error ': str(e)},status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+
+def _available_time_list(booking_settings, time_freq_list, held_slots):
+    time_freq_map = {}
+    for time,num_of_bookings in time_freq_list:
+        time_freq_map[time.hour * 60 + time.minute] = num_of_bookings
+    for minute, held_quantity in held_slots.items():
+        time_freq_map[minute] = time_freq_map.get(minute, 0) + held_quantity
+
+    # Merge the precompiled slot grid for these settings with the booking counters
+    return [
+        {"time": label, "remaining_slots": remaining_slots}
+        for label, remaining_slots in merge_slot_template(
+            get_slot_template(booking_settings), time_freq_map, booking_settings.max_booking_per_time)
+    ]
+
+
+# ASGI variant of barber_available_slots. The shop, its settings, the day's counters
+# and the holds are independent reads, so they run concurrently instead of back to back.
+@replica_reads
+async def barber_available_slots_async(request, shop_id):
+    if request.method != 'GET':
+        return JsonResponse({'message': "Method not allowed."}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+    try:
+        booking_date = datetime.datetime.strptime(request.GET.get('date', ''), "%Y-%m-%d").date()
+    except ValueError:
+        return JsonResponse({'message': "A date query parameter in YYYY-MM-DD format is required."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        shop_exists, booking_settings, existing_bookings_time_freq_list, held_slots = await asyncio.gather(
+            run_query(ShopProfile.objects.filter(shop_id=shop_id).exists),
+            run_query(ShopSettings.objects.filter(shop_profile_id=shop_id).first),
+            run_query(lambda: list(ShopBookingsCounter.objects.filter(
+                booking_date=booking_date, shop_profile_id=shop_id
+            ).values_list('booking_time', 'num_of_bookings').order_by('booking_time'))),
+            run_query(active_holds, shop_id, booking_date),
+        )
+        if not shop_exists:
+            return JsonResponse({'message': "Shop profile not found."}, status=status.HTTP_404_NOT_FOUND)
+        if not booking_settings:
+            return JsonResponse({'message': "Barber Booking Settings Not Configured Yet.."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(existing_bookings_time_freq_list) == 0 and not held_slots:
+            return JsonResponse({'message': "No Bookings found for the Date provided.."}, status=status.HTTP_200_OK)
+
+        time_list = _available_time_list(booking_settings, existing_bookings_time_freq_list, held_slots)
+        return JsonResponse({'message': "available booking slots", 'time_list': time_list}, status=status.HTTP_200_OK)
+    except Exception as e:
+        logger.exception("Error in barber_available_slots_async")
+        return JsonResponse({'Internal server error ': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+# Per-day availability for a date range, so a calendar can be painted with one request
+@api_view(('GET',))
+def barber_availability_calendar(request, shop_id):
+    try:
+        # Validate shop profile
+        shop_profile = ShopProfile.objects.filter(shop_id=shop_id).first()
+        if not shop_profile:
+            return Response({'message': "Shop profile not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        # Validate booking settings for the shop
+        booking_settings = ShopSettings.objects.filter(shop_profile=shop_profile).first()
+        if not booking_settings:
+            return Response({'message': "Barber Booking Settings Not Configured Yet.."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Requested range, clamped to the window the shop accepts bookings for
+        today = datetime.date.today()
+        window_end = add_months(today, booking_settings.available_booking_months)
+        try:
+            start_date = datetime.datetime.strptime(request.GET['start_date'], "%Y-%m-%d").date() if request.GET.get('start_date') else today
+            end_date = datetime.datetime.strptime(request.GET['end_date'], "%Y-%m-%d").date() if request.GET.get('end_date') else window_end
+        except ValueError:
+            return Response({'message': "Invalid date format. Use YYYY-MM-DD."}, status=status.HTTP_400_BAD_REQUEST)
+        start_date = max(start_date, today)
+        end_date = min(end_date, window_end)
+        if start_date > end_date:
+            return Response({'message': "Date range is outside the booking window."}, status=status.HTTP_400_BAD_REQUEST)
+
+        include_slots = request.GET.get('detail', '').lower() in ('1', 'true', 'yes')
+
+        # One query for every counter in the range, grouped by date while streaming
+        counters = ShopBookingsCounter.objects.filter(
+            shop_profile=shop_profile,
+            booking_date__range=[start_date, end_date]
+        ).values_list('booking_date', 'booking_time', 'num_of_bookings').order_by('booking_date')
+        # Places held by users in checkout count as taken, read for the whole range at once
+        held_by_day = active_holds_many(
+            (shop_profile.shop_id, start_date + datetime.timedelta(days=offset))
+            for offset in range((end_date - start_date).days + 1))
+
+        response = StreamingHttpResponse(
+            _stream_availability_calendar(shop_id, booking_settings, start_date, end_date, counters, held_by_day,
+                                          include_slots),
+            content_type='application/json'
+        )
+        return response
+    except Exception as e:
+        return Response({'Internal server error ': str(e)},status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+def _stream_availability_calendar(shop_id, booking_settings, start_date, end_date, counters, held_by_day, include_slots):
+    template = get_slot_template(booking_settings)
+    max_booking_per_time = booking_settings.max_booking_per_time
+    max_booking_per_day = booking_settings.max_booking_per_day
+
+    yield '{"message": "available booking days", "shop_id": "%s", "start_date": "%s", "end_date": "%s", "days": [' % (
+        shop_id, start_date.isoformat(), end_date.isoformat())
+
+    counters_by_date = groupby(counters.iterator(), key=lambda row: row[0])
+    next_group = next(counters_by_date, None)
+    day = start_date
+    while day <= end_date:
+        time_freq_map = {}
+        if next_group is not None and next_group[0] == day:
+            for _, time, num_of_bookings in next_group[1]:
+                time_freq_map[time.hour * 60 + time.minute] = num_of_bookings
+            next_group = next(counters_by_date, None)
+        for minute, held_quantity in held_by_day.get((shop_id, day), {}).items():
+            time_freq_map[minute] = time_freq_map.get(minute, 0) + held_quantity
+
+        closed = not booking_settings.booking_enable or (booking_settings.disable_weekend and day.weekday() >= 5)
+        slots = [] if closed else merge_slot_template(template, time_freq_map, max_booking_per_time)
+        remaining_capacity = sum(remaining_slots for _, remaining_slots in slots)
+        if max_booking_per_day is not None:
+            remaining_capacity = max(0, min(remaining_capacity, max_booking_per_day - sum(time_freq_map.values())))
+
+        day_data = {
+            "date": day.isoformat(),
+            "available": remaining_capacity > 0,
+            "remaining_capacity": remaining_capacity,
+        }
+        if include_slots:
+            day_data["time_list"] = [{"time": label, "remaining_slots": remaining_slots} for label, remaining_slots in slots]
+
+        yield ('' if day == start_date else ',') + json.dumps(day_data)
+        day += datetime.timedelta(days=1)
+
+    yield ']}'
+
+# First free slots of many shops for one date, e.g. for the discovery screen
+@api_view(('GET',))
+def bulk_available_slots(request):
+    try:
+        # shop_ids can be repeated and/or comma separated
+        shop_ids = [shop_id for value in request.GET.getlist('shop_ids') for shop_id in value.split(',') if shop_id]
+        if not shop_ids:
+            return Response({'message': "shop_ids is required."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(shop_ids) > MAX_BULK_SLOT_SHOPS:
+            return Response({'message': f"At most {MAX_BULK_SLOT_SHOPS} shop_ids are allowed."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            shop_ids = list(dict.fromkeys(uuid.UUID(shop_id) for shop_id in shop_ids))
+        except ValueError:
+            return Response({'message': "Invalid shop_id provided."}, status=status.HTTP_400_BAD_REQUEST)
+
+        now = timezone.localtime()
+        try:
+            booking_date = datetime.datetime.strptime(request.GET['date'], "%Y-%m-%d").date() if request.GET.get('date') else now.date()
+            count = int(request.GET.get('count', 3))
+        except ValueError:
+            return Response({'message': "Invalid date or count. Use YYYY-MM-DD and an integer count."}, status=status.HTTP_400_BAD_REQUEST)
+        if count < 1:
+            return Response({'message': "count must be at least 1."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Slots that already started today are not offered
+        earliest_minute = now.hour * 60 + now.minute if booking_date == now.date() else 0
+
+        # One query for all settings and one for all counters, whatever the number of shops
+        settings_by_shop = {
+            booking_settings.shop_profile_id: booking_settings
+            for booking_settings in ShopSettings.objects.filter(shop_profile_id__in=shop_ids)
+        }
+        time_freq_maps = {}
+        for shop_profile_id, time, num_of_bookings in ShopBookingsCounter.objects.filter(
+                shop_profile_id__in=shop_ids, booking_date=booking_date
+        ).values_list('shop_profile_id', 'booking_time', 'num_of_bookings'):
+            time_freq_maps.setdefault(shop_profile_id, {})[time.hour * 60 + time.minute] = num_of_bookings
+        # Places held by users in checkout count as taken
+        for (shop_id, _), held_slots in active_holds_many((shop_id, booking_date) for shop_id in shop_ids).items():
+            time_freq_map = time_freq_maps.setdefault(shop_id, {})
+            for minute, held_quantity in held_slots.items():
+                time_freq_map[minute] = time_freq_map.get(minute, 0) + held_quantity
+
+        shops = []
+        for shop_id in shop_ids:
+            booking_settings = settings_by_shop.get(shop_id)
+            if booking_settings is None:
+                shops.append({'shop_id': str(shop_id), 'message': "Barber Booking Settings Not Configured Yet..", 'time_list': []})
+                continue
+
+            time_list = []
+            closed = not booking_settings.booking_enable or (booking_settings.disable_weekend and booking_date.weekday() >= 5)
+            if not closed:
+                slot_minutes, slot_labels = get_slot_template(booking_settings)
+                time_freq_map = time_freq_maps.get(shop_id, {})
+                for minute, label in zip(slot_minutes, slot_labels):
+                    if minute < earliest_minute:
+                        continue
+                    remaining_slots = booking_settings.max_booking_per_time - time_freq_map.get(minute, 0)
+                    if remaining_slots > 0:
+                        time_list.append({"time": label, "remaining_slots": remaining_slots})
+                        if len(time_list) == count:
+                            break
+            shops.append({'shop_id': str(shop_id), 'time_list': time_list})
+
+        return Response({'message': "available booking slots", 'date': booking_date.isoformat(), 'shops': shops}, status=status.HTTP_200_OK)
+    except Exception as e:
+        return Response({'Internal server error ': str(e)},status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 @api_view(('POST',))
 def create_booking(request, shop_id):
+    # Retries carrying the same Idempotency-Key get the stored response without touching counters or bookings
+    idempotency_key = request.headers.get('Idempotency-Key')
+    if not idempotency_key:
+        return _create_booking(request, shop_id)
+    if len(idempotency_key) > 255:
+        return Response({'message': "Idempotency-Key must be at most 255 characters."}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        record, state = claim_idempotency_key(shop_id, idempotency_key, request.data)
+    except Exception as e:
+        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    if state == 'replay':
+        return Response(json.loads(record.response_body), status=record.status_code)
+    if state == 'in_progress':
+        return Response({'message': "A request with this Idempotency-Key is still being processed."}, status=status.HTTP_409_CONFLICT)
+    if state == 'mismatch':
+        return Response({'message': "Idempotency-Key was already used with a different request."}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    response = _create_booking(request, shop_id)
+    try:
+        store_idempotent_response(record, response.status_code, response.data)
+    except Exception:
+        logger.exception("Could not store the idempotent response for shop %s", shop_id)
+    return response
+
+
+def _create_booking(request, shop_id):
     try:
         # Extract data from request
         service_ids = request.data.get('service_ids', [])
@@ -76,6 +318,7 @@ def create_booking(request, shop_id):
         time = request.data.get('time')
         user_id = request.data.get('user_id')
         total_cost = request.data.get('total_price')
+        hold_id = request.data.get('hold_id')
 
         # Validate shop profile
         shop_profile = ShopProfile.objects.filter(shop_id=shop_id).first()
@@ -87,64 +330,142 @@ def create_booking(request, shop_id):
         if not booking_settings:
             return Response({'message': "Barber Booking Settings Not Configured Yet.."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Check existing bookings for the same date and time
-        curr_time_barber_bookings = ShopBookingsCounter.objects.filter(
-            booking_date=date, shop_profile=shop_profile, booking_time=time).first()
-
-        if curr_time_barber_bookings is None:
-            curr_time_freq = 1
-        else:
-            curr_time_freq = curr_time_barber_bookings.num_of_bookings + 1
-
-        booking_settings_max_bookings_per_time = booking_settings.max_booking_per_time
+        # Resolve and validate every requested service with one IN query
+        if not service_ids:
+            return Response({'message': "service_ids is required."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            requested_service_ids = [uuid.UUID(str(service_id)) for service_id in service_ids]
+        except ValueError:
+            return Response({'message': "Invalid service_id provided."}, status=status.HTTP_400_BAD_REQUEST)
+        services = ShopService.objects.filter(shop_profile=shop_profile).in_bulk(requested_service_ids)
+        for service_id, requested_service_id in zip(service_ids, requested_service_ids):
+            if requested_service_id not in services:
+                return Response({'message': f"Service with id {service_id} not found for this shop."},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+        booking_date = datetime.datetime.strptime(date, "%Y-%m-%d").date()
+        slot_time = datetime.time.fromisoformat(time)
+        slot_minute = slot_time.hour * 60 + slot_time.minute
+
+        # Reserve capacity with a single conditional update, leaving room for other users' holds
+        def reserve(held_quantity):
+            return reserve_slot_capacity(shop_profile, booking_date, time,
+                                         booking_settings.max_booking_per_time - held_quantity)
+
+        # One place of a hold on this slot is consumed in the same locked step, so that place is what gets reserved
+        reserved = reserve_against_holds(shop_profile.shop_id, booking_date, slot_minute, reserve,
+                                         hold_id=hold_id) if hold_id else None
+        if reserved is None:
+            # No hold, or it expired or was already converted
+            reserved = reserve_against_holds(shop_profile.shop_id, booking_date, slot_minute, reserve)
+        if not reserved:
+            # No slots available
+            return Response({'message': "No Slots Available for the selected time"}, status=status.HTTP_200_OK)
 
-        # If there's an available slot
-        if booking_settings_max_bookings_per_time >= curr_time_freq:
+        try:
             with transaction.atomic():
                 # Create a booking for each service_id
-                for service_id in service_ids:
-                    service = ShopService.objects.filter(service_id=service_id, shop_profile=shop_profile).first()
-                    if not service:
-                        return Response({'message': f"Service with id {service_id} not found for this shop."},
-                                        status=status.HTTP_400_BAD_REQUEST)
-
-                    # Create the booking
-                    booking = Booking(
+                bookings = [
+                    Booking(
                         user_id=user_id,
                         status='0',
                         shop_profile=shop_profile,
-                        booking_date=datetime.datetime.strptime(date, "%Y-%m-%d").date(),
+                        booking_date=booking_date,
                         booking_time=time,
                         total_price = total_cost
                     )
-                    created_booking = booking.save()
+                    for _ in requested_service_ids
+                ]
+                Booking.objects.bulk_create(bookings)
 
-                    # Payment API here - and update to "failed" after this if needed
+                # Payment API here - and update to "failed" after this if needed
 
-                    # Link the service to the booking in BookingService
-                    booking_service = BookingService(booking=booking, shop_service=service)
-                    booking_service.save()
+                # Link the services to the bookings in BookingService
+                BookingService.objects.bulk_create([
+                    BookingService(booking=booking, shop_service=services[service_id])
+                    for booking, service_id in zip(bookings, requested_service_ids)
+                ])
 
-                # Handle booking counter
-                if curr_time_barber_bookings is None:
-                    # Create a new booking counter if it doesn't exist
-                    barber_booking_counter = ShopBookingsCounter(
-                        booking_date=datetime.datetime.strptime(date, "%Y-%m-%d").date(),
-                        booking_time=time,
-                        shop_profile=shop_profile,
-                        num_of_bookings=curr_time_freq
-                    )
-                    barber_booking_counter.save()
-                else:
-                    # Update the existing booking counter
-                    curr_time_barber_bookings.num_of_bookings = curr_time_freq
-                    curr_time_barber_bookings.save()
+                # Keep the daily earnings rollup in step with the new bookings
+                record_daily_earnings(shop_profile, booking_date, '0',
+                                      Decimal(str(total_cost or 0)) * len(bookings), len(bookings))
+        except Exception:
+            # Give the reserved capacity back if the bookings could not be written
+            release_slot_capacity(shop_profile, booking_date, time)
+            raise
+
+        return Response({'message': "Booking Confirmed"}, status=status.HTTP_201_CREATED)
+
+    except Exception as e:
+        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-            return Response({'message': "Booking Confirmed"}, status=status.HTTP_201_CREATED)
 
-        # No slots available
-        return Response({'message': "No Slots Available for the selected time"}, status=status.HTTP_200_OK)
+# Hold places in a slot for a few minutes while the user goes through checkout
+@api_view(('POST',))
+def create_slot_hold(request, shop_id):
+    try:
+        date = request.data.get('date')
+        time = request.data.get('time')
+        hold_settings = get_slot_hold_settings()
+
+        # Validate shop profile
+        shop_profile = ShopProfile.objects.filter(shop_id=shop_id).first()
+        if not shop_profile:
+            return Response({'message': "Shop profile not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        # Validate booking settings for the shop
+        booking_settings = ShopSettings.objects.filter(shop_profile=shop_profile).first()
+        if not booking_settings:
+            return Response({'message': "Barber Booking Settings Not Configured Yet.."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            booking_date = datetime.datetime.strptime(date, "%Y-%m-%d").date()
+            slot_time = datetime.time.fromisoformat(time)
+            quantity = int(request.data.get('quantity', 1))
+            hold_minutes = int(request.data.get('hold_minutes', hold_settings['HOLD_MINUTES']))
+        except (TypeError, ValueError):
+            return Response({'message': "Invalid date, time, quantity or hold_minutes. Use YYYY-MM-DD and HH:MM."}, status=status.HTTP_400_BAD_REQUEST)
+        if quantity < 1:
+            return Response({'message': "quantity must be at least 1."}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= hold_minutes <= hold_settings['MAX_HOLD_MINUTES']:
+            return Response({'message': f"hold_minutes must be between 1 and {hold_settings['MAX_HOLD_MINUTES']}."}, status=status.HTTP_400_BAD_REQUEST)
+
+        slot_minute = slot_time.hour * 60 + slot_time.minute
+        slot_minutes, _ = get_slot_template(booking_settings)
+        if slot_minute not in slot_minutes:
+            return Response({'message': "The selected time is not a bookable slot."}, status=status.HTTP_400_BAD_REQUEST)
+
+        def has_capacity(held_quantity):
+            num_of_bookings = ShopBookingsCounter.objects.filter(
+                shop_profile=shop_profile, booking_date=booking_date, booking_time=slot_time
+            ).values_list('num_of_bookings', flat=True).first() or 0
+            return num_of_bookings + held_quantity + quantity <= booking_settings.max_booking_per_time
+
+        hold = place_hold(shop_profile.shop_id, booking_date, slot_minute, quantity, hold_minutes, has_capacity)
+        if hold is None:
+            return Response({'message': "No Slots Available for the selected time"}, status=status.HTTP_200_OK)
+
+        hold_id, expires_at = hold
+        return Response({
+            'message': "Slot held",
+            'hold_id': hold_id,
+            'date': booking_date.isoformat(),
+            'time': '%02d:%02d' % divmod(slot_minute, 60),
+            'quantity': quantity,
+            'expires_at': datetime.datetime.fromtimestamp(expires_at, tz=datetime.timezone.utc).isoformat()
+        }, status=status.HTTP_201_CREATED)
+    except Exception as e:
+        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 
+@api_view(('DELETE',))
+def release_slot_hold(request, shop_id, hold_id):
+    try:
+        hold = get_hold(hold_id)
+        if hold is None or hold[0] != str(shop_id):
+            return Response({'message': "Hold not found or already expired."}, status=status.HTTP_404_NOT_FOUND)
+        release_hold(hold_id)
+        return Response({'message': "Hold released"}, status=status.HTTP_200_OK)
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -179,19 +500,19 @@ def update_booking_status(request):
 
         # Update booking status to 'Completed' or 'Cancelled'
         if new_status in ['1', '2']:
-            booking.status = new_status
-            booking.save()
+            with transaction.atomic():
+                # Conditional update, so of two concurrent changes only one moves the booking out of 'Booked'
+                updated = Booking.objects.filter(booking_id=booking.booking_id, status='0').update(
+                    status=new_status, updated_at=timezone.now())
+                if not updated:
+                    return Response({"error": "Booking status can only be updated if the current status is 'Booked'."}, status=status.HTTP_400_BAD_REQUEST)
+                # Move the booking between the status rows of the daily earnings rollup
+                record_daily_earnings(booking.shop_profile_id, booking.booking_date, '0', -(booking.total_price or 0), -1)
+                record_daily_earnings(booking.shop_profile_id, booking.booking_date, new_status, booking.total_price, 1)
             booking_status_string = get_status_string(new_status)
             if new_status == '2':
-                booking_date = booking.booking_date
-                booking_time = booking.booking_time
-                shop_profile = booking.shop_profile
-                curr_time_barber_bookings = ShopBookingsCounter.objects.filter(
-                                                                booking_date=booking_date, 
-                                                                shop_profile=shop_profile, 
-                                                                booking_time=booking_time).first()
-                curr_time_barber_bookings.num_of_bookings = curr_time_barber_bookings.num_of_bookings - 1
-                curr_time_barber_bookings.save()
+                # Free the slot with an atomic decrement
+                release_slot_capacity(booking.shop_profile_id, booking.booking_date, booking.booking_time)
 
             return Response({"message": f"Booking status updated to '{booking_status_string}'."}, status=status.HTTP_200_OK)
         else:
@@ -207,41 +528,143 @@ def get_upcoming_bookings(request, shop_id):
 
     try:
         # Get today's date if not provided in request
-        booking_date = request.data.get('date', datetime.date.today().strftime('%Y-%m-%d'))
+        booking_date = request.GET.get('date') or request.data.get('date') or datetime.date.today().strftime('%Y-%m-%d')
         booking_status = request.GET.get('status', None)
-        # print("Booking Status : ", booking_status)
 
         if booking_status in [None, '']:
             return Response({'message': "No Booking Status provided"}, status=status.HTTP_400_BAD_REQUEST)
-        
+
+        try:
+            booking_date = datetime.datetime.strptime(booking_date, "%Y-%m-%d").date()
+            limit = int(request.GET.get('limit', UPCOMING_BOOKINGS_DEFAULT_LIMIT))
+            after = decode_booking_cursor(request.GET['cursor']) if request.GET.get('cursor') else None
+        except ValueError:
+            return Response({'message': "Invalid date, limit or cursor provided"}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= limit <= UPCOMING_BOOKINGS_MAX_LIMIT:
+            return Response({'message': f"limit must be between 1 and {UPCOMING_BOOKINGS_MAX_LIMIT}"}, status=status.HTTP_400_BAD_REQUEST)
+
         # Get the shop profile
-        shop_profile = ShopProfile.objects.filter(shop_id=shop_id).first()
-        if not shop_profile:
+        if not ShopProfile.objects.filter(shop_id=shop_id).exists():
             return Response({'message': "Shop profile not found."}, status=status.HTTP_404_NOT_FOUND)
-        
-        if not ['1', '2', '3', '4']:
-            return Response({'message': "Invalid Booking Status provided"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Fetch all bookings for the shop on the specified date
-        bookings = Booking.objects.filter(shop_profile=shop_profile, booking_date=booking_date, status = booking_status).order_by('booking_time')
+        # Fetch one page of the day's bookings as plain rows, with the service name joined in the same query
+        bookings = Booking.objects.filter(
+            shop_profile_id=shop_id, booking_date=booking_date, status=booking_status
+        ).annotate(
+            service_name=Coalesce('shop_service__name', Subquery(
+                BookingService.objects.filter(booking=OuterRef('pk')).values('shop_service__name')[:1]))
+        ).order_by('booking_time', 'booking_id')
+
+        # Keyset pagination on (booking_time, booking_id)
+        if after is not None:
+            after_time, after_booking_id = after
+            bookings = bookings.filter(Q(booking_time__gt=after_time) | Q(booking_time=after_time, booking_id__gt=after_booking_id))
 
-        if not bookings.exists():
-            return Response({'message': f"No bookings found for {booking_date}."}, status=status.HTTP_200_OK)
+        rows = list(bookings.values(
+            'booking_id', 'user_id', 'status', 'booking_time', 'created_at', 'updated_at', 'service_name', 'total_price'
+        )[:limit + 1])
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_booking_cursor(rows[-1]['booking_time'], rows[-1]['booking_id'])
+
+        if not rows and after is None:
+            return Response({'message': f"No bookings found for {booking_date}.", 'bookings': [], 'next_cursor': None}, status=status.HTTP_200_OK)
 
         # Prepare the booking details to return
-        booking_list = []
-        for booking in bookings:
-            booking_list.append({
-                "booking_id": str(booking.booking_id),
-                "user_id": booking.user_id,
-                "status": booking.status,
-                "booking_time": booking.booking_time.strftime("%H:%M"),
-                "created_at": booking.created_at.strftime("%Y-%m-%d %H:%M:%S"),
-                "updated_at": booking.updated_at.strftime("%Y-%m-%d %H:%M:%S"),
-                "shop_service": booking.shop_service.name if booking.shop_service else None,
-                "total_price" : booking.total_price
-            })
-
-        return Response({'message': "Upcoming bookings", 'bookings': booking_list}, status=status.HTTP_200_OK)
+        booking_list = [
+            {
+                "booking_id": str(row['booking_id']),
+                "user_id": row['user_id'],
+                "status": row['status'],
+                "booking_time": row['booking_time'].isoformat(timespec='minutes'),
+                "created_at": row['created_at'].isoformat(' ', 'seconds')[:19],
+                "updated_at": row['updated_at'].isoformat(' ', 'seconds')[:19],
+                "shop_service": row['service_name'],
+                "total_price": row['total_price']
+            }
+            for row in rows
+        ]
+
+        return Response({'message': "Upcoming bookings", 'bookings': booking_list, 'next_cursor': next_cursor}, status=status.HTTP_200_OK)
+    except Exception as e:
+        return Response({'message': "Internal server error", "error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class _Echo:
+    """File-like object whose write() hands the line back, so csv.writer can feed a generator."""
+
+    def write(self, value):
+        return value
+
+
+# Full booking history of a shop as CSV or NDJSON, streamed row by row from a server-side cursor
+@api_view(['GET'])
+def export_bookings(request, shop_id):
+    try:
+        export_format = request.GET.get('export_format', 'csv').lower()
+        if export_format not in ('csv', 'ndjson'):
+            return Response({'message': "export_format must be csv or ndjson"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            start_date = datetime.datetime.strptime(request.GET['start_date'], "%Y-%m-%d").date() if request.GET.get('start_date') else None
+            end_date = datetime.datetime.strptime(request.GET['end_date'], "%Y-%m-%d").date() if request.GET.get('end_date') else None
+        except ValueError:
+            return Response({'message': "Invalid date format. Use YYYY-MM-DD."}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not ShopProfile.objects.filter(shop_id=shop_id).exists():
+            return Response({'message': "Shop profile not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        bookings = Booking.objects.filter(shop_profile_id=shop_id)
+        if start_date:
+            bookings = bookings.filter(booking_date__gte=start_date)
+        if end_date:
+            bookings = bookings.filter(booking_date__lte=end_date)
+        # status=0,1 exports several statuses at once
+        if request.GET.get('status'):
+            bookings = bookings.filter(status__in=request.GET['status'].split(','))
+
+        rows = bookings.annotate(
+            service_name=Coalesce('shop_service__name', Subquery(
+                BookingService.objects.filter(booking=OuterRef('pk')).values('shop_service__name')[:1]))
+        ).order_by('booking_date', 'booking_time', 'booking_id').values_list(
+            *BOOKING_EXPORT_FIELDS
+        ).iterator(chunk_size=BOOKING_EXPORT_CHUNK_SIZE)
+
+        if export_format == 'csv':
+            response = StreamingHttpResponse(_stream_bookings_csv(rows), content_type='text/csv')
+        else:
+            response = StreamingHttpResponse(_stream_bookings_ndjson(rows), content_type='application/x-ndjson')
+        response['Content-Disposition'] = f'attachment; filename="bookings-{shop_id}.{export_format}"'
+        return response
     except Exception as e:
-        return Response({'message': "Internal server error", "error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+        return Response({'message': "Internal server error", "error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+def _export_row(row):
+    booking_id, booking_date, booking_time, booking_status, user_id, service_name, total_price, created_at, updated_at = row
+    return [
+        str(booking_id),
+        booking_date.isoformat() if booking_date else None,
+        booking_time.isoformat(timespec='minutes') if booking_time else None,
+        booking_status,
+        get_status_string(booking_status),
+        user_id,
+        service_name,
+        str(total_price) if total_price is not None else None,
+        created_at.isoformat(),
+        updated_at.isoformat(),
+    ]
+
+
+def _stream_bookings_csv(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(BOOKING_EXPORT_COLUMNS)
+    for row in rows:
+        yield writer.writerow(_export_row(row))
+
+
+def _stream_bookings_ndjson(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(BOOKING_EXPORT_COLUMNS, _export_row(row)))) + '\n'
@@ -0,0 +1,55 @@
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler
+
+# Parts of a streaming response pulled per hop to the sync thread
+STREAMING_PARTS_PER_HOP = 100
+
+
+def _next_parts(parts):
+    return list(islice(parts, STREAMING_PARTS_PER_HOP))
+
+
+class StreamingASGIHandler(ASGIHandler):
+    """
+    ASGIHandler that iterates streaming responses on the sync thread.
+
+    Django 3.2 iterates StreamingHttpResponse content on the event loop, where the
+    ORM raises SynchronousOnlyOperation, so a stream reading the database lazily
+    (the availability calendar, the bookings export) was cut off after its first
+    chunk. Here the parts are pulled through sync_to_async, on the thread the view
+    ran on, and only the sends happen on the loop.
+    """
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+
+        # Collect cookies into headers, as ASGIHandler.send_response does
+        response_headers = []
+        for header, value in response.items():
+            if isinstance(header, str):
+                header = header.encode('ascii')
+            if isinstance(value, str):
+                value = value.encode('latin1')
+            response_headers.append((bytes(header), bytes(value)))
+        for c in response.cookies.values():
+            response_headers.append((b'Set-Cookie', c.output(header='').encode('ascii').strip()))
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': response_headers,
+        })
+
+        # Access `__iter__` and not `streaming_content` directly in case it has been overridden in a subclass
+        parts = iter(response)
+        while True:
+            batch = await sync_to_async(_next_parts, thread_sensitive=True)(parts)
+            if not batch:
+                break
+            for part in batch:
+                for chunk, _ in self.chunk_bytes(part):
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body'})
+        await sync_to_async(response.close, thread_sensitive=True)()
@@ -0,0 +1,150 @@
+import asyncio
+import random
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+# Set by @replica_reads for the duration of a read-only view
+_use_replica = ContextVar('use_replica', default=False)
+# Set once the current request or task has written, so its later reads see the write
+_pinned_to_primary = ContextVar('pinned_to_primary', default=False)
+
+PIN_COOKIE_NAME = 'pin_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def get_replica_aliases():
+    return [alias for alias in getattr(settings, 'DATABASE_REPLICAS', []) if alias in settings.DATABASES]
+
+
+def pin_to_primary():
+    _pinned_to_primary.set(True)
+
+
+def reads_from_replica():
+    # Inside a transaction on the primary, reads stay there to see its uncommitted writes
+    return (_use_replica.get() and not _pinned_to_primary.get() and bool(get_replica_aliases())
+            and not connections['default'].in_atomic_block)
+
+
+def _is_cache_table(model):
+    # DatabaseCache entries; a lagging replica would serve invalidated versions and responses
+    return model._meta.app_label == 'django_cache'
+
+
+class ReadReplicaRouter:
+    """
+    Sends reads to a random DATABASE_REPLICAS alias inside @replica_reads views, and
+    everything else to 'default'. A write pins the rest of the context to 'default'.
+    Migrations only run on 'default'; replicas get the schema through replication.
+    The database cache always stays on 'default', and its writes do not pin.
+    """
+
+    def db_for_read(self, model, **hints):
+        if reads_from_replica() and not _is_cache_table(model):
+            return random.choice(get_replica_aliases())
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        if not _is_cache_table(model):
+            pin_to_primary()
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in get_replica_aliases()
+
+
+def replica_reads(view):
+    """
+    Route the ORM reads of a read-only view, sync or async, to the replicas unless
+    the client was pinned to the primary.
+    """
+    if asyncio.iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            if request.COOKIES.get(PIN_COOKIE_NAME):
+                return await view(request, *args, **kwargs)
+            token = _use_replica.set(True)
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                _use_replica.reset(token)
+
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.COOKIES.get(PIN_COOKIE_NAME):
+            return view(request, *args, **kwargs)
+        token = _use_replica.set(True)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _use_replica.reset(token)
+
+    return wrapper
+
+
+def _run_and_release(func, args, kwargs):
+    try:
+        return func(*args, **kwargs)
+    finally:
+        # Pool threads outlive the request, so their connections are not closed by request_finished
+        close_old_connections()
+
+
+async def run_query(func, *args, **kwargs):
+    """
+    Run blocking ORM code from an async view. Django 3.2 has no async ORM, so the
+    call runs on a thread pool; thread_sensitive=False lets several run_query calls
+    awaited with asyncio.gather() hit the database concurrently, each on its own
+    connection. The context, and with it replica routing, is carried over.
+    """
+    return await sync_to_async(_run_and_release, thread_sensitive=False)(func, args, kwargs)
+
+
+class PrimaryPinningMiddleware:
+    """
+    Read-your-writes across requests: after a successful write, the client gets a
+    short-lived cookie that keeps its reads on the primary until the replicas have
+    caught up (REPLICA_PIN_SECONDS). Runs natively under both WSGI and ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Tells Django's handler to call this middleware without a thread hop
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        token = _pinned_to_primary.set(False)
+        try:
+            response = self.get_response(request)
+        finally:
+            _pinned_to_primary.reset(token)
+        return self._pin_after_write(request, response)
+
+    async def __acall__(self, request):
+        token = _pinned_to_primary.set(False)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _pinned_to_primary.reset(token)
+        return self._pin_after_write(request, response)
+
+    def _pin_after_write(self, request, response):
+        if request.method not in SAFE_METHODS and response.status_code < 400 and get_replica_aliases():
+            response.set_cookie(PIN_COOKIE_NAME, '1', max_age=getattr(settings, 'REPLICA_PIN_SECONDS', 5),
+                                httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,160 @@
+import math
+
+import numpy as np
+
+# Base32 alphabet used by the standard geohash encoding
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# Precision stored on ShopProfile.geohash (~4.8m x 4.8m cells)
+GEOHASH_PRECISION = 9
+
+# Upper bound on the number of cells used to cover a search area
+MAX_COVER_CELLS = 16
+
+KM_PER_DEGREE_LAT = 111.32
+
+# Mean radius of the earth in kilometers. Use 3956 for miles
+EARTH_RADIUS_KM = 6371.0
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great circle distance in kilometers between two points given in decimal degrees."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (float(lat1), float(lon1), float(lat2), float(lon2)))
+
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def haversine_km_batch(origin_lat, origin_lon, latitudes, longitudes):
+    """
+    Great circle distances in kilometers from one origin to N points in a single
+    vectorized call. latitudes/longitudes are sequences (or arrays) of decimal
+    degrees; returns a float64 numpy array of length N.
+    """
+    lat1 = math.radians(float(origin_lat))
+    lon1 = math.radians(float(origin_lon))
+    lat2 = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lon2 = np.radians(np.asarray(longitudes, dtype=np.float64))
+
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = np.sin(dlat / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    """Encode a latitude/longitude pair into a geohash string of the given precision."""
+    latitude = float(latitude)
+    longitude = float(longitude)
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even_bit = True
+    while len(geohash) < precision:
+        # Bits alternate between longitude and latitude, starting with longitude
+        if even_bit:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if longitude >= mid:
+                bits = (bits << 1) | 1
+                lon_range[0] = mid
+            else:
+                bits = bits << 1
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= mid:
+                bits = (bits << 1) | 1
+                lat_range[0] = mid
+            else:
+                bits = bits << 1
+                lat_range[1] = mid
+        even_bit = not even_bit
+
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(GEOHASH_BASE32[bits])
+            bits = 0
+            bit_count = 0
+
+    return ''.join(geohash)
+
+
+def geohash_cell_size(precision):
+    """Return the (lat_degrees, lon_degrees) size of a geohash cell at the given precision."""
+    total_bits = 5 * precision
+    lon_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lon_bits)
+
+
+def geohash_cell_bounds(geohash):
+    """Return (min_lat, max_lat, min_lon, max_lon) of a geohash cell."""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even_bit = True
+    for char in geohash:
+        bits = GEOHASH_BASE32.index(char)
+        for shift in range(4, -1, -1):
+            bit = (bits >> shift) & 1
+            target = lon_range if even_bit else lat_range
+            mid = (target[0] + target[1]) / 2
+            target[1 - bit] = mid
+            even_bit = not even_bit
+    return lat_range[0], lat_range[1], lon_range[0], lon_range[1]
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """Return (min_lat, max_lat, min_lon, max_lon) enclosing a circle of radius_km around the point."""
+    latitude = float(latitude)
+    longitude = float(longitude)
+    lat_delta = radius_km / KM_PER_DEGREE_LAT
+    # Longitude degrees shrink with latitude; clamp near the poles so the box stays finite
+    cos_lat = max(math.cos(math.radians(latitude)), 0.01)
+    lon_delta = min(radius_km / (KM_PER_DEGREE_LAT * cos_lat), 180.0)
+
+    min_lat = max(latitude - lat_delta, -90.0)
+    max_lat = min(latitude + lat_delta, 90.0)
+    return min_lat, max_lat, longitude - lon_delta, longitude + lon_delta
+
+
+def geohash_cells_in_box(min_lat, max_lat, min_lon, max_lon, precision, max_cells=None):
+    """
+    Return the set of geohash cells of the given precision touching the box, or
+    None if there are more than max_cells of them.
+    """
+    lat_step, lon_step = geohash_cell_size(precision)
+    cells = set()
+
+    # Walk the box on the cell grid, sampling the centre of every cell it touches
+    lat = math.floor((min_lat + 90.0) / lat_step) * lat_step - 90.0 + lat_step / 2
+    while lat - lat_step / 2 <= max_lat:
+        lon = math.floor((min_lon + 180.0) / lon_step) * lon_step - 180.0 + lon_step / 2
+        while lon - lon_step / 2 <= max_lon:
+            # Wrap across the antimeridian
+            wrapped_lon = ((lon + 180.0) % 360.0) - 180.0
+            cells.add(encode_geohash(min(lat, 90.0), wrapped_lon, precision))
+            if max_cells is not None and len(cells) > max_cells:
+                return None
+            lon += lon_step
+        lat += lat_step
+
+    return cells
+
+
+def geohash_cells_covering(latitude, longitude, radius_km, max_precision=6):
+    """
+    Return the smallest set of geohash prefixes that fully covers the circle of
+    radius_km around the point. The finest precision that needs no more than
+    MAX_COVER_CELLS cells is used, so a lookup only touches a handful of index ranges.
+    """
+    min_lat, max_lat, min_lon, max_lon = bounding_box(latitude, longitude, radius_km)
+    for precision in range(max_precision, 0, -1):
+        cells = geohash_cells_in_box(min_lat, max_lat, min_lon, max_lon, precision, MAX_COVER_CELLS)
+        if cells is not None:
+            return cells
+    return set(GEOHASH_BASE32)
@@ -0,0 +1,118 @@
+import io
+import logging
+import os
+import time
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.dispatch import Signal
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+
+from common import metrics
+
+logger = logging.getLogger(__name__)
+
+# Sent with instance, field_name and derivatives_field once new derivatives are stored,
+# e.g. for apps to drop cached responses that list the derivative URLs
+derivatives_generated = Signal()
+
+# name: (width, height, crop). Cropped derivatives are exactly that size, the others fit inside it.
+DEFAULT_IMAGE_DERIVATIVES = {
+    'SIZES': {
+        'thumb': (160, 160, True),
+        'card': (640, 400, True),
+        'full': (1600, 1600, False),
+    },
+    'FORMAT': 'WEBP',
+    'QUALITY': 80,
+}
+
+
+def get_image_derivative_settings():
+    return dict(DEFAULT_IMAGE_DERIVATIVES, **getattr(settings, 'IMAGE_DERIVATIVES', {}))
+
+
+def _output_format(requested):
+    # Fall back to JPEG where Pillow was built without WebP
+    if requested == 'WEBP' and not features.check('webp'):
+        return 'JPEG'
+    return requested
+
+
+def _render(image, size, output_format, quality):
+    width, height, crop = size
+    if crop:
+        resized = ImageOps.fit(image, (width, height), Image.LANCZOS)
+    else:
+        resized = image.copy()
+        resized.thumbnail((width, height), Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    # A fresh encode carries no EXIF, ICC or XMP from the upload
+    resized.save(buffer, output_format, quality=quality, optimize=True)
+    return resized.size, buffer.getvalue()
+
+
+def generate_derivatives(field_file):
+    """
+    Write the configured derivatives of an uploaded image next to it, under
+    <upload dir>/derivatives/, and return {name: {'name', 'width', 'height', 'bytes'}}
+    where 'name' is the storage name. Returns {} if the file is not a readable image.
+    """
+    options = get_image_derivative_settings()
+    output_format = _output_format(options['FORMAT'].upper())
+    extension = 'jpg' if output_format == 'JPEG' else output_format.lower()
+
+    started = time.perf_counter()
+    try:
+        field_file.open('rb')
+        original_bytes = field_file.size
+        with Image.open(field_file) as image:
+            # Apply the EXIF orientation before it is dropped
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ('RGB', 'RGBA') or (output_format == 'JPEG' and image.mode == 'RGBA'):
+                image = image.convert('RGB')
+            image.load()
+    except (UnidentifiedImageError, OSError) as e:
+        logger.warning("Skipping derivatives of %s: %s", field_file.name, e)
+        return {}
+    finally:
+        field_file.close()
+
+    directory, filename = os.path.split(field_file.name)
+    stem = os.path.splitext(filename)[0]
+
+    derivatives = {}
+    for name, size in options['SIZES'].items():
+        (width, height), content = _render(image, size, output_format, options['QUALITY'])
+        stored_name = default_storage.save(
+            os.path.join(directory, 'derivatives', f'{stem}_{name}.{extension}'), ContentFile(content))
+        derivatives[name] = {'name': stored_name, 'width': width, 'height': height, 'bytes': len(content)}
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    # Bytes a client saves by fetching 'full' instead of the original
+    full_bytes = derivatives.get('full', {}).get('bytes', original_bytes)
+    bytes_saved = max(original_bytes - full_bytes, 0)
+    metrics.incr('images.processed')
+    metrics.incr('images.processing_ms', round(elapsed_ms))
+    metrics.incr('images.original_bytes', original_bytes)
+    metrics.incr('images.bytes_saved', bytes_saved)
+    logger.info("Derivatives of %s: %.1f ms, %d bytes original, %d bytes saved", field_file.name,
+                elapsed_ms, original_bytes, bytes_saved)
+    return derivatives
+
+
+def process_image_derivatives(instance, field_name, derivatives_field='derivatives'):
+    """Generate the derivatives of instance.<field_name> and store them on the instance."""
+    field_file = getattr(instance, field_name)
+    derivatives = generate_derivatives(field_file) if field_file else {}
+    setattr(instance, derivatives_field, derivatives)
+    instance.save(update_fields=[derivatives_field])
+    derivatives_generated.send(sender=type(instance), instance=instance, field_name=field_name,
+                               derivatives_field=derivatives_field)
+    return derivatives
+
+
+def derivative_urls(derivatives):
+    return {name: default_storage.url(derivative['name']) for name, derivative in (derivatives or {}).items()}
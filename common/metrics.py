@@ -0,0 +1,21 @@
+import threading
+from collections import Counter
+
+# Process-local counters, e.g. cache hits/misses. Exposed through the app/metrics endpoint.
+_counters = Counter()
+_lock = threading.Lock()
+
+
+def incr(name, amount=1):
+    with _lock:
+        _counters[name] += amount
+
+
+def snapshot(prefix=''):
+    with _lock:
+        return {name: value for name, value in sorted(_counters.items()) if name.startswith(prefix)}
+
+
+def reset():
+    with _lock:
+        _counters.clear()
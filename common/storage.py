@@ -0,0 +1,201 @@
+import hashlib
+import mimetypes
+import os
+import posixpath
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, Storage
+from django.http import Http404
+from django.utils.deconstruct import deconstructible
+from django.views.static import serve
+
+from common import metrics
+
+# Uploads are hashed and spooled in chunks of this size; blobs bigger than SPOOL_MAX_BYTES spill to disk
+HASH_CHUNK_SIZE = 64 * 1024
+SPOOL_MAX_BYTES = 5 * 1024 * 1024
+
+# upload_to directories of the image fields; the only paths serve_media will serve
+MEDIA_UPLOAD_DIRS = ('shop_images', 'service_images', 'profile_pictures')
+
+# Blob names never change content, so clients and CDNs may keep them forever
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+DEFAULT_MEDIA_STORAGE_SETTINGS = {
+    'BACKEND': 'filesystem',
+    # S3-compatible backend. ENDPOINT_URL points it at MinIO, localstack or another stand-in
+    'BUCKET': '',
+    'ENDPOINT_URL': None,
+    'REGION': None,
+    'ACCESS_KEY_ID': None,
+    'SECRET_ACCESS_KEY': None,
+    # Base URL blobs are served from, e.g. a CDN. Defaults to <endpoint>/<bucket>/
+    'PUBLIC_URL': None,
+}
+
+
+def get_media_storage_settings():
+    return dict(DEFAULT_MEDIA_STORAGE_SETTINGS, **getattr(settings, 'MEDIA_STORAGE', {}))
+
+
+def hash_upload(content):
+    """
+    Read an upload once, in chunks, into a spooled temporary file while hashing it.
+    Returns (sha256 hex digest, size, spooled file positioned at 0).
+    """
+    digest = hashlib.sha256()
+    spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    size = 0
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    chunks = content.chunks(HASH_CHUNK_SIZE) if hasattr(content, 'chunks') else iter(lambda: content.read(HASH_CHUNK_SIZE), b'')
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        digest.update(chunk)
+        spooled.write(chunk)
+        size += len(chunk)
+    spooled.seek(0)
+    return digest.hexdigest(), size, spooled
+
+
+def is_blob_name(name):
+    stem = posixpath.splitext(posixpath.basename(name))[0]
+    return len(stem) == 64 and all(char in '0123456789abcdef' for char in stem)
+
+
+class ContentAddressedMixin:
+    """
+    Stores every file under the sha256 of its bytes, <upload dir>/<2 hex>/<sha256><ext>,
+    so a blob is written once however often it is uploaded. Saving bytes that are
+    already stored only returns the existing name. Blobs may be shared between rows,
+    so they are never deleted through a model.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+
+        digest, size, spooled = hash_upload(content)
+        directory, filename = posixpath.split(name.replace('\\', '/'))
+        extension = posixpath.splitext(filename)[1].lower()
+        blob_name = posixpath.join(directory, digest[:2], f'{digest}{extension}')
+
+        try:
+            if self.exists(blob_name):
+                metrics.incr('storage.dedup_hits')
+                metrics.incr('storage.bytes_deduplicated', size)
+                return blob_name
+            stored_name = self._save(blob_name, File(spooled, blob_name))
+        finally:
+            spooled.close()
+
+        metrics.incr('storage.blobs_written')
+        metrics.incr('storage.bytes_written', size)
+        return stored_name.replace('\\', '/')
+
+    def get_available_name(self, name, max_length=None):
+        # The name is derived from the content, so an existing file already holds these bytes
+        return name
+
+
+@deconstructible
+class ContentAddressedFileSystemStorage(ContentAddressedMixin, FileSystemStorage):
+    """Content-addressed blobs under MEDIA_ROOT."""
+
+    def _save(self, name, content):
+        # Write to a temporary name and rename into place, so concurrent writers of one blob never clash
+        full_path = self.path(name)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        fd, temporary_path = tempfile.mkstemp(dir=os.path.dirname(full_path), suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as temporary_file:
+                for chunk in content.chunks(HASH_CHUNK_SIZE):
+                    temporary_file.write(chunk)
+            # mkstemp creates 0600 files
+            os.chmod(temporary_path, self.file_permissions_mode if self.file_permissions_mode is not None else 0o644)
+            os.replace(temporary_path, full_path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+        return name
+
+
+@deconstructible
+class ContentAddressedS3Storage(ContentAddressedMixin, Storage):
+    """Content-addressed blobs in an S3-compatible bucket, configured by MEDIA_STORAGE."""
+
+    def __init__(self, client=None):
+        options = get_media_storage_settings()
+        self.bucket = options['BUCKET']
+        if client is None:
+            import boto3
+            client = boto3.client(
+                's3',
+                endpoint_url=options['ENDPOINT_URL'],
+                region_name=options['REGION'],
+                aws_access_key_id=options['ACCESS_KEY_ID'],
+                aws_secret_access_key=options['SECRET_ACCESS_KEY'],
+            )
+        self.client = client
+        public_url = options['PUBLIC_URL'] or f"{(options['ENDPOINT_URL'] or 'https://s3.amazonaws.com').rstrip('/')}/{self.bucket}/"
+        self.public_url = public_url if public_url.endswith('/') else public_url + '/'
+
+    def _open(self, name, mode='rb'):
+        response = self.client.get_object(Bucket=self.bucket, Key=name)
+        return ContentFile(response['Body'].read(), name=name)
+
+    def _save(self, name, content):
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        # upload_fileobj streams in parts, so large blobs are never held in memory
+        self.client.upload_fileobj(content, self.bucket, name, ExtraArgs={
+            'ContentType': content_type,
+            'CacheControl': IMMUTABLE_CACHE_CONTROL,
+        })
+        return name
+
+    def exists(self, name):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=name)
+        except self.client.exceptions.ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+        return True
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=name)
+
+    def size(self, name):
+        return self.client.head_object(Bucket=self.bucket, Key=name)['ContentLength']
+
+    def url(self, name):
+        return self.public_url + name
+
+
+def store_upload(model, field_name, upload):
+    """
+    Store an upload through a model field's storage and upload_to, and return the
+    stored name. Identical bytes always map to the same name, which lets callers
+    compare uploads with the files they already reference.
+    """
+    field = model._meta.get_field(field_name)
+    return field.storage.save(field.generate_filename(None, upload.name), upload, max_length=field.max_length)
+
+
+def serve_media(request, path):
+    """Serve uploaded files with far-future caching for blobs; for the filesystem backend without a web server in front."""
+    # The URL is already percent-decoded here, so '%2e%2e' and '..%2f' arrive as plain '..'
+    normalized = posixpath.normpath(path.replace('\\', '/'))
+    if normalized.split('/', 1)[0] not in MEDIA_UPLOAD_DIRS:
+        raise Http404("Not found.")
+    response = serve(request, normalized, document_root=settings.MEDIA_ROOT)
+    if is_blob_name(path):
+        response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
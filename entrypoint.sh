@@ -3,5 +3,6 @@ set -e  # Exit immediately if a command exits with a non-zero status
 echo "Running migrations..."
 python manage.py makemigrations
 python manage.py migrate
+python manage.py createcachetable
 echo "Starting server..."
 exec "$@"
\ No newline at end of file
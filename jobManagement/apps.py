@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+from django.utils.module_loading import autodiscover_modules
+
+
+class JobManagementConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'jobManagement'
+
+    def ready(self):
+        # Register the @task functions of every installed app
+        autodiscover_modules('tasks')
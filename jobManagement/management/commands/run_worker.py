@@ -0,0 +1,79 @@
+import os
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from jobManagement.queue import claim_jobs, get_job_queue_settings, purge_finished_jobs, run_job
+
+# Seconds between purges of finished jobs
+PURGE_INTERVAL = 600
+
+
+class Command(BaseCommand):
+    help = "Run background jobs from the Job table on a thread pool. Start several for more processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4, help="Jobs run concurrently by this worker.")
+        parser.add_argument('--once', action='store_true', help="Run the jobs that are due, then exit.")
+
+    def handle(self, *args, **options):
+        queue_settings = get_job_queue_settings()
+        threads = options['threads']
+        worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        stopping = threading.Event()
+
+        def stop(signum, frame):
+            self.stdout.write("Stopping after the running jobs finish...")
+            stopping.set()
+
+        if not options['once']:
+            signal.signal(signal.SIGTERM, stop)
+            signal.signal(signal.SIGINT, stop)
+
+        running = set()
+        lock = threading.Lock()
+
+        def execute(job):
+            try:
+                run_job(job, worker_id)
+            finally:
+                # Each pool thread holds its own connection
+                close_old_connections()
+                connection.close()
+                with lock:
+                    running.discard(job.job_id)
+
+        last_purge = 0
+        with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='job-worker') as pool:
+            while not stopping.is_set():
+                with lock:
+                    free = threads - len(running)
+
+                jobs = claim_jobs(worker_id, free, queue_settings['VISIBILITY_TIMEOUT']) if free else []
+                with lock:
+                    running.update(job.job_id for job in jobs)
+                for job in jobs:
+                    pool.submit(execute, job)
+
+                if options['once']:
+                    if not jobs:
+                        with lock:
+                            idle = not running
+                        if idle:
+                            break
+                    time.sleep(0.05)
+                    continue
+
+                if time.monotonic() - last_purge > PURGE_INTERVAL:
+                    purge_finished_jobs(queue_settings['KEEP_DONE_SECONDS'])
+                    last_purge = time.monotonic()
+
+                if not jobs:
+                    stopping.wait(queue_settings['POLL_INTERVAL'])
+
+        self.stdout.write(self.style.SUCCESS("Worker stopped."))
@@ -0,0 +1,33 @@
+from django.db import models
+import uuid
+
+JOB_STATUS = (
+    ("queued", "Queued"),
+    ("running", "Running"),
+    ("done", "Done"),
+    ("failed", "Failed"),
+)
+
+# A unit of background work, claimed by a worker with a conditional UPDATE.
+# A running job whose locked_until has passed is considered abandoned and can be claimed again.
+class Job(models.Model):
+    job_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False, unique=True)
+    task = models.CharField(max_length=200, help_text="registered task name, see jobManagement.registry")
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=JOB_STATUS, default="queued")
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_after = models.DateTimeField(help_text="not claimed before this time, pushed back on every retry")
+    locked_by = models.CharField(max_length=100, blank=True, default='')
+    locked_until = models.DateTimeField(null=True, blank=True, help_text="visibility timeout of the current attempt")
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_status_run_after_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.task} ({self.status})"
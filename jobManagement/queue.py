@@ -0,0 +1,122 @@
+import datetime
+import logging
+import traceback
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from common import metrics
+from .models import Job
+from .registry import get_task
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOB_QUEUE_SETTINGS = {
+    'VISIBILITY_TIMEOUT': 300,
+    'MAX_ATTEMPTS': 5,
+    'RETRY_BACKOFF_SECONDS': 30,
+    'POLL_INTERVAL': 1.0,
+    'KEEP_DONE_SECONDS': 86400,
+    # Run jobs inline in enqueue(), e.g. for tests or a single-process setup
+    'EAGER': False,
+}
+
+
+def get_job_queue_settings():
+    return dict(DEFAULT_JOB_QUEUE_SETTINGS, **getattr(settings, 'JOB_QUEUE', {}))
+
+
+def enqueue(task, delay_seconds=0, **payload):
+    """
+    Queue a registered task (the function or its name) with a JSON payload and
+    return the Job. Called inside a transaction, the job only becomes visible to
+    workers once that transaction commits.
+    """
+    func = get_task(task if isinstance(task, str) else task.task_name)
+    options = get_job_queue_settings()
+    job = Job.objects.create(
+        task=func.task_name,
+        payload=payload,
+        max_attempts=func.max_attempts or options['MAX_ATTEMPTS'],
+        run_after=timezone.now() + datetime.timedelta(seconds=delay_seconds)
+    )
+    metrics.incr('jobs.enqueued')
+
+    if options['EAGER']:
+        if claim_job(job.job_id, 'eager', options['VISIBILITY_TIMEOUT']):
+            run_job(Job.objects.get(job_id=job.job_id), 'eager')
+    return job
+
+
+def _claimable(now):
+    # Queued jobs that are due, and running jobs whose worker let the visibility timeout pass
+    return Q(status='queued', run_after__lte=now) | Q(status='running', locked_until__lt=now)
+
+
+def claim_job(job_id, worker_id, visibility_timeout):
+    now = timezone.now()
+    return Job.objects.filter(_claimable(now), job_id=job_id).update(
+        status='running',
+        locked_by=worker_id,
+        locked_until=now + datetime.timedelta(seconds=visibility_timeout),
+        attempts=F('attempts') + 1,
+        updated_at=now
+    ) == 1
+
+
+def claim_jobs(worker_id, limit, visibility_timeout):
+    """
+    Claim up to `limit` due jobs for worker_id. Each claim is a conditional UPDATE,
+    so concurrent workers never get the same job without needing SKIP LOCKED.
+    """
+    candidates = Job.objects.filter(_claimable(timezone.now())).order_by('run_after').values_list(
+        'job_id', flat=True)[:limit * 2]
+
+    claimed = []
+    for job_id in candidates:
+        if claim_job(job_id, worker_id, visibility_timeout):
+            claimed.append(job_id)
+            if len(claimed) == limit:
+                break
+    return list(Job.objects.filter(job_id__in=claimed).order_by('run_after'))
+
+
+def run_job(job, worker_id):
+    """Run a claimed job and record the outcome. Returns True if the task succeeded."""
+    try:
+        get_task(job.task)(**job.payload)
+    except Exception as e:
+        _record_failure(job, worker_id, e)
+        return False
+    else:
+        # Only the worker still holding the job may finish it
+        Job.objects.filter(job_id=job.job_id, locked_by=worker_id, status='running').update(
+            status='done', locked_until=None, last_error='', updated_at=timezone.now())
+        metrics.incr('jobs.succeeded')
+        return True
+
+
+def _record_failure(job, worker_id, error):
+    now = timezone.now()
+    last_error = ''.join(traceback.format_exception(type(error), error, error.__traceback__))[-4000:]
+    if job.attempts >= job.max_attempts:
+        updates = {'status': 'failed'}
+        metrics.incr('jobs.failed')
+        logger.error("Job %s (%s) failed after %d attempts: %s", job.job_id, job.task, job.attempts, error)
+    else:
+        # Exponential backoff: RETRY_BACKOFF_SECONDS, then twice that, ...
+        backoff = get_job_queue_settings()['RETRY_BACKOFF_SECONDS'] * 2 ** (job.attempts - 1)
+        updates = {'status': 'queued', 'run_after': now + datetime.timedelta(seconds=backoff)}
+        metrics.incr('jobs.retried')
+        logger.warning("Job %s (%s) attempt %d failed, retrying in %ds: %s", job.job_id, job.task,
+                       job.attempts, backoff, error)
+
+    Job.objects.filter(job_id=job.job_id, locked_by=worker_id, status='running').update(
+        locked_until=None, last_error=last_error, updated_at=now, **updates)
+
+
+def purge_finished_jobs(older_than_seconds):
+    cutoff = timezone.now() - datetime.timedelta(seconds=older_than_seconds)
+    deleted, _ = Job.objects.filter(status='done', updated_at__lt=cutoff).delete()
+    return deleted
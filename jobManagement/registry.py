@@ -0,0 +1,21 @@
+_tasks = {}
+
+
+def task(name=None, max_attempts=None):
+    """
+    Register a function as a background task. It is called with the job's payload
+    as keyword arguments, so the payload has to be JSON serializable.
+    """
+    def register(func):
+        func.task_name = name or f'{func.__module__}.{func.__name__}'
+        func.max_attempts = max_attempts
+        _tasks[func.task_name] = func
+        return func
+    return register
+
+
+def get_task(name):
+    try:
+        return _tasks[name]
+    except KeyError:
+        raise LookupError(f"No task registered as {name!r}.")
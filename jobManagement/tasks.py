@@ -0,0 +1,30 @@
+from django.apps import apps
+
+from common.images import process_image_derivatives
+from .queue import enqueue
+from .registry import task
+
+
+@task('images.generate_derivatives')
+def generate_image_derivatives(model, pk, field_name, derivatives_field='derivatives'):
+    # model is an "app_label.ModelName" label, so any app's image field can be queued
+    instance = apps.get_model(model).objects.filter(pk=pk).first()
+    # The image may have been replaced or deleted since the job was queued
+    if instance is None:
+        return
+    process_image_derivatives(instance, field_name, derivatives_field)
+
+
+def enqueue_image_derivatives(instance, field_name, derivatives_field='derivatives'):
+    # Identical bytes share one blob, so reuse the derivatives of another row that already has them.
+    # The instance itself is excluded: its derivatives may still be those of the file it replaced.
+    model = type(instance)
+    processed = model.objects.filter(**{field_name: getattr(instance, field_name).name}).exclude(
+        pk=instance.pk).exclude(**{derivatives_field: {}}).values_list(derivatives_field, flat=True).first()
+    if processed:
+        setattr(instance, derivatives_field, processed)
+        instance.save(update_fields=[derivatives_field])
+        return
+
+    enqueue(generate_image_derivatives, model=instance._meta.label, pk=str(instance.pk),
+            field_name=field_name, derivatives_field=derivatives_field)
@@ -0,0 +1,64 @@
+import datetime
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .models import Job
+from .queue import claim_jobs, enqueue, run_job
+from .registry import task
+
+calls = []
+
+
+@task('tests.record')
+def record(value):
+    calls.append(value)
+
+
+@task('tests.explode', max_attempts=2)
+def explode():
+    raise ValueError("boom")
+
+
+@override_settings(JOB_QUEUE={'RETRY_BACKOFF_SECONDS': 10})
+class JobQueueTests(TestCase):
+
+    def setUp(self):
+        calls.clear()
+
+    def test_claimed_once_and_run(self):
+        job = enqueue(record, value=1)
+        self.assertEqual([claimed.job_id for claimed in claim_jobs('a', 10, 60)], [job.job_id])
+        self.assertEqual(claim_jobs('b', 10, 60), [])
+
+        self.assertTrue(run_job(Job.objects.get(), 'a'))
+        self.assertEqual(calls, [1])
+        self.assertEqual(Job.objects.get().status, 'done')
+
+    def test_expired_visibility_timeout_is_reclaimed(self):
+        enqueue(record, value=1)
+        claim_jobs('a', 10, 60)
+        Job.objects.update(locked_until=timezone.now() - datetime.timedelta(seconds=1))
+
+        job = claim_jobs('b', 10, 60)[0]
+        self.assertEqual((job.locked_by, job.attempts), ('b', 2))
+        # The first worker no longer holds the job, so it cannot finish it
+        run_job(Job.objects.get(), 'a')
+        self.assertEqual(Job.objects.get().status, 'running')
+
+    def test_retry_with_backoff_then_fail(self):
+        enqueue(explode)
+        self.assertFalse(run_job(claim_jobs('a', 1, 60)[0], 'a'))
+        job = Job.objects.get()
+        self.assertEqual(job.status, 'queued')
+        self.assertGreater(job.run_after, timezone.now() + datetime.timedelta(seconds=9))
+        self.assertIn("boom", job.last_error)
+
+        Job.objects.update(run_after=timezone.now())
+        run_job(claim_jobs('a', 1, 60)[0], 'a')
+        self.assertEqual(Job.objects.get().status, 'failed')
+
+    @override_settings(JOB_QUEUE={'EAGER': True})
+    def test_eager_mode(self):
+        enqueue('tests.record', value=2)
+        self.assertEqual(calls, [2])
@@ -9,8 +9,13 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+
+from common.asgi import StreamingASGIHandler
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'provisioningService.settings')
 
-application = get_asgi_application()
+# As django.core.asgi.get_asgi_application(), with a handler that keeps streamed
+# responses reading the database off the event loop
+django.setup(set_prefix=False)
+application = StreamingASGIHandler()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,6 +44,7 @@ INSTALLED_APPS = [
     'rest_framework',
     # 'drf_yasg',
     'applicationManagement',
+    'jobManagement',
     'drf_spectacular'
 ]
 
@@ -54,6 +56,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'common.db.PrimaryPinningMiddleware',
 ]
 
 ROOT_URLCONF = 'provisioningService.urls'
@@ -75,6 +78,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'provisioningService.wsgi.application'
+ASGI_APPLICATION = 'provisioningService.asgi.application'
 
 
 # Database
@@ -96,9 +100,24 @@ DATABASES = {
         'PASSWORD': 'admin',
         'HOST': 'localhost',  # This should match the service name in the Docker Compose file
         'PORT': '5432',
+        # The replica routing tests use this alias as a replica of the default test database
+        'TEST': {'MIRROR': 'default'},
     }
 }
 
+# A read replica of 'default', only configured where one exists
+if os.environ.get('DATABASE_REPLICA_HOST'):
+    DATABASES['replica'] = dict(DATABASES['default'], HOST=os.environ['DATABASE_REPLICA_HOST'],
+                                PORT=os.environ.get('DATABASE_REPLICA_PORT', '5432'), TEST={'MIRROR': 'default'})
+
+# Aliases the read-only endpoints read from, comma separated. Opt-in: without a configured
+# replica everything goes to 'default'
+DATABASE_REPLICAS = [alias for alias in os.environ.get(
+    'DATABASE_REPLICAS', 'replica' if 'replica' in DATABASES else '').split(',') if alias]
+DATABASE_ROUTERS = ['common.db.ReadReplicaRouter']
+# How long a client's reads stay on the primary after it wrote something
+REPLICA_PIN_SECONDS = 5
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -138,6 +157,24 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# Uploads are content addressed, see common.storage. MEDIA_ROOT only holds uploads, never
+# code or settings, since the filesystem backend serves files from under it
+MEDIA_URL = '/media/'
+MEDIA_ROOT = os.environ.get('MEDIA_ROOT', str(BASE_DIR / 'media'))
+
+# BACKEND is 'filesystem' (MEDIA_ROOT) or 's3' (any S3-compatible endpoint, e.g. MinIO locally)
+MEDIA_STORAGE = {
+    'BACKEND': os.environ.get('MEDIA_STORAGE_BACKEND', 'filesystem'),
+    'BUCKET': os.environ.get('MEDIA_BUCKET', ''),
+    'ENDPOINT_URL': os.environ.get('MEDIA_ENDPOINT_URL') or None,
+    'REGION': os.environ.get('MEDIA_REGION') or None,
+    'ACCESS_KEY_ID': os.environ.get('MEDIA_ACCESS_KEY_ID') or None,
+    'SECRET_ACCESS_KEY': os.environ.get('MEDIA_SECRET_ACCESS_KEY') or None,
+    'PUBLIC_URL': os.environ.get('MEDIA_PUBLIC_URL') or None,
+}
+DEFAULT_FILE_STORAGE = ('common.storage.ContentAddressedS3Storage' if MEDIA_STORAGE['BACKEND'] == 's3'
+                        else 'common.storage.ContentAddressedFileSystemStorage')
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -147,6 +184,79 @@ REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
 
+# Shared by every web, ASGI and worker process: the shop read caches are invalidated by
+# writes in whichever process handles them, so a per-process cache would serve stale
+# responses under still-valid ETags. Memcached when MEMCACHED_LOCATION is set, otherwise
+# a table in the primary database (createcachetable)
+if os.environ.get('MEMCACHED_LOCATION'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+            'LOCATION': os.environ['MEMCACHED_LOCATION'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'django_cache',
+            'OPTIONS': {'MAX_ENTRIES': 100000},
+        }
+    }
+
+# With memcached every process (web, uvicorn workers, worker) shares the nearby cache and the
+# slot holds below, so invalidations and holds made in one are seen by the others
+SHARED_STATE_BACKEND = 'django' if os.environ.get('MEMCACHED_LOCATION') else 'locmem'
+
+# Nearby-shop result cache. BACKEND is 'locmem' (per process) or 'django' (uses CACHE_ALIAS from CACHES)
+NEARBY_SHOPS_CACHE = {
+    'BACKEND': SHARED_STATE_BACKEND,
+    'TIMEOUT': 300,
+    'MAX_ENTRIES': 2048,
+    'CACHE_ALIAS': 'default',
+}
+
+# Slot holds taken during checkout. BACKEND is 'locmem' (per process) or 'django' (uses CACHE_ALIAS from CACHES)
+SLOT_HOLDS = {
+    'BACKEND': SHARED_STATE_BACKEND,
+    'CACHE_ALIAS': 'default',
+    'HOLD_MINUTES': 5,
+    'MAX_HOLD_MINUTES': 15,
+}
+
+# Serialized service lists of list_shop_services, per shop, on a Django cache alias
+SHOP_SERVICES_CACHE = {
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': 600,
+}
+
+# Serialized responses and ETags of the shop read endpoints, versioned per shop
+SHOP_READ_CACHE = {
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': 600,
+}
+
+# Derivatives generated for uploaded images: name -> (width, height, crop). See common.images
+IMAGE_DERIVATIVES = {
+    'SIZES': {
+        'thumb': (160, 160, True),
+        'card': (640, 400, True),
+        'full': (1600, 1600, False),
+    },
+    'FORMAT': 'WEBP',
+    'QUALITY': 80,
+}
+
+# Background jobs run by `python manage.py run_worker`. EAGER runs them inside enqueue() instead
+JOB_QUEUE = {
+    'VISIBILITY_TIMEOUT': 300,
+    'MAX_ATTEMPTS': 5,
+    'RETRY_BACKOFF_SECONDS': 30,
+    'POLL_INTERVAL': 1.0,
+    'KEEP_DONE_SECONDS': 86400,
+    'EAGER': False,
+}
+
 SPECTACULAR_SETTINGS = {
     'TITLE': 'Barber Shop API',
     'DESCRIPTION': 'API for booking barber appointments.',
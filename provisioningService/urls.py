@@ -18,6 +18,8 @@ from django.urls import path,include
 from django.urls import path, re_path
 # from .swagger import schema_view
 from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, SpectacularSwaggerView
+from django.conf import settings
+from common.storage import serve_media
 
 
 urlpatterns = [
@@ -35,3 +37,7 @@ urlpatterns = [
     path('api/schema/redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
     path('app/',include('applicationManagement.urls'))
 ]
+
+# Local media; serve_media only serves files inside the upload directories
+if settings.MEDIA_STORAGE['BACKEND'] == 'filesystem':
+    urlpatterns.append(re_path(r'^media/(?P<path>.*)$', serve_media, name='media'))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from common.images import process_image_derivatives
+from shopManagement.models import ShopProfileImage, ShopServicesImage
+from usermanagement.models import UserProfile
+
+# (model, image field, derivatives field)
+IMAGE_SOURCES = (
+    (ShopProfileImage, 'image', 'derivatives'),
+    (ShopServicesImage, 'image', 'derivatives'),
+    (UserProfile, 'profile_picture', 'profile_picture_derivatives'),
+)
+
+
+class Command(BaseCommand):
+    help = "Generate the resized derivatives of uploaded shop, service and profile images."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Regenerate images that already have derivatives.")
+
+    def handle(self, *args, **options):
+        for model, field_name, derivatives_field in IMAGE_SOURCES:
+            images = model.objects.exclude(**{field_name: ''}).exclude(**{field_name: None})
+            if not options['force']:
+                images = images.filter(**{derivatives_field: {}})
+
+            processed = 0
+            for instance in images.iterator():
+                if process_image_derivatives(instance, field_name, derivatives_field):
+                    processed += 1
+            self.stdout.write(f"{model.__name__}: {processed} images processed.")
+
+        self.stdout.write(self.style.SUCCESS("Done."))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Q, Sum
+
+from shopManagement.models import ShopProfile, ShopReview
+from shopManagement.utils import RATING_SUMMARY_FIELDS
+
+
+class Command(BaseCommand):
+    help = "Recompute the rating count, sum and histogram of shops from ShopReview."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shop-id', help="Only rebuild this shop.")
+
+    def handle(self, *args, **options):
+        shops = ShopProfile.objects.all()
+        reviews = ShopReview.objects.all()
+        if options['shop_id']:
+            shops = shops.filter(shop_id=options['shop_id'])
+            reviews = reviews.filter(shop_profile_id=options['shop_id'])
+
+        # One grouped query over the reviews; shops without reviews are reset to zero
+        totals = {
+            total.pop('shop_profile_id'): total
+            for total in reviews.values('shop_profile_id').annotate(
+                rating_count=Count('review_id'),
+                rating_sum=Sum('rating'),
+                **{f'rating_{rating}': Count('review_id', filter=Q(rating=rating)) for rating in range(1, 6)}
+            ).order_by().iterator()
+        }
+        empty = dict.fromkeys(RATING_SUMMARY_FIELDS, 0)
+
+        changed = []
+        for shop in shops.only('shop_id', *RATING_SUMMARY_FIELDS).iterator():
+            summary = totals.get(shop.shop_id, empty)
+            if any(getattr(shop, field) != summary[field] for field in RATING_SUMMARY_FIELDS):
+                for field in RATING_SUMMARY_FIELDS:
+                    setattr(shop, field, summary[field])
+                changed.append(shop)
+
+        ShopProfile.objects.bulk_update(changed, RATING_SUMMARY_FIELDS, batch_size=1000)
+        self.stdout.write(self.style.SUCCESS(f"Updated the rating summary of {len(changed)} shops."))
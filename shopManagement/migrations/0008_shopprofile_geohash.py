@@ -0,0 +1,27 @@
+from django.db import migrations, models
+
+from common.geo import encode_geohash
+
+
+def populate_geohash(apps, schema_editor):
+    ShopProfile = apps.get_model('shopManagement', 'ShopProfile')
+    shops = ShopProfile.objects.exclude(latitude=None).exclude(longitude=None)
+    for shop in shops.iterator():
+        shop.geohash = encode_geohash(shop.latitude, shop.longitude)
+        shop.save(update_fields=['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopManagement', '0007_shopprofile_venue_amenities'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shopprofile',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=12),
+        ),
+        migrations.RunPython(populate_geohash, migrations.RunPython.noop),
+    ]
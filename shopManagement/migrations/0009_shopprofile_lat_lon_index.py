@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopManagement', '0008_shopprofile_geohash'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='shopprofile',
+            index=models.Index(fields=['latitude', 'longitude'], name='shop_lat_lon_idx'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def populate_rating_summary(apps, schema_editor):
+    ShopProfile = apps.get_model('shopManagement', 'ShopProfile')
+    ShopReview = apps.get_model('shopManagement', 'ShopReview')
+    totals = ShopReview.objects.values('shop_profile_id').annotate(
+        rating_count=Count('review_id'),
+        rating_sum=Sum('rating'),
+        **{f'rating_{rating}': Count('review_id', filter=Q(rating=rating)) for rating in range(1, 6)}
+    ).order_by()
+    for total in totals.iterator():
+        ShopProfile.objects.filter(shop_id=total.pop('shop_profile_id')).update(**total)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopManagement', '0009_shopprofile_lat_lon_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shopprofile',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='shopprofile',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='shopprofile',
+            name='rating_1',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='shopprofile',
+            name='rating_2',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='shopprofile',
+            name='rating_3',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='shopprofile',
+            name='rating_4',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='shopprofile',
+            name='rating_5',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_rating_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopManagement', '0010_shopprofile_rating_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shopreview',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='shopreview',
+            index=models.Index(fields=['shop_profile', 'created_at', 'review_id'], name='review_shop_created_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.8 on 2026-10-18 11:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopManagement', '0011_shopreview_created_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shopprofileimage',
+            name='derivatives',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='shopservicesimage',
+            name='derivatives',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -31,6 +31,22 @@ class ShopProfile(models.Model):
     latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True, default=0.000000)
     longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True, default=0.000000)
     venue_amenities = models.CharField(max_length=100, blank=True)
+    # Geohash of (latitude, longitude), used as a spatial index for nearby search
+    geohash = models.CharField(max_length=12, blank=True, default='', db_index=True)
+    # Review totals kept up to date by add_review, so no endpoint has to scan ShopReview
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Bounding-box prefilter for nearby search
+            models.Index(fields=['latitude', 'longitude'], name='shop_lat_lon_idx'),
+        ]
 
     def __str__(self):
         return self.shop_name
@@ -38,8 +54,10 @@ class ShopProfile(models.Model):
 class ShopProfileImage(models.Model):
     image_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False, unique=True)
     shop_profile = models.ForeignKey(ShopProfile, related_name='images', on_delete=models.CASCADE)
-    # TODO: change the upload_to to S3 url
+    # Stored by content hash through DEFAULT_FILE_STORAGE, see common.storage
     image = models.ImageField(upload_to='shop_images/')
+    # Resized, EXIF-free copies keyed by size name, see common.images
+    derivatives = models.JSONField(default=dict, blank=True)
 
 class ShopService(models.Model):
     service_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False, unique=True)
@@ -55,9 +73,11 @@ class ShopService(models.Model):
 class ShopServicesImage(models.Model):
     image_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False, unique=True)
     service = models.ForeignKey(ShopService, related_name='shop_service_images', on_delete=models.CASCADE)
-    # TODO: change the upload_to to S3 url
+    # Stored by content hash through DEFAULT_FILE_STORAGE, see common.storage
     image = models.ImageField(upload_to='service_images/')
     description = models.CharField(max_length=255, null=True, blank=True)
+    # Resized, EXIF-free copies keyed by size name, see common.images
+    derivatives = models.JSONField(default=dict, blank=True)
     
 class ShopSettings(models.Model):
     # General
@@ -80,6 +100,13 @@ class ShopReview(models.Model):
     #user = models.ForeignKey(User, on_delete=models.CASCADE)
     review_body = models.TextField()
     rating = models.IntegerField(choices=[(i, str(i)) for i in range(1, 6)])
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of a shop's reviews, newest first
+            models.Index(fields=['shop_profile', 'created_at', 'review_id'], name='review_shop_created_idx'),
+        ]
 
 class BarberDetails(models.Model):
     shop_profile = models.ForeignKey(ShopProfile,default=None ,on_delete=models.CASCADE, related_name='barber_details')
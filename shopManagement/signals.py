@@ -0,0 +1,19 @@
+from django.dispatch import receiver
+
+from applicationManagement.cache import bump_shop_version, invalidate_shop_services
+from common.images import derivatives_generated
+from .models import ShopProfileImage, ShopServicesImage
+
+
+# Cached shop responses list the derivative URLs. The cache is shared, so this also
+# reaches the web processes when the derivatives were generated by a worker.
+@receiver(derivatives_generated, sender=ShopServicesImage)
+def refresh_service_responses(sender, instance, **kwargs):
+    shop_id = ShopServicesImage.objects.filter(pk=instance.pk).values_list('service__shop_profile_id', flat=True).first()
+    invalidate_shop_services(shop_id)
+    bump_shop_version(shop_id)
+
+
+@receiver(derivatives_generated, sender=ShopProfileImage)
+def refresh_profile_responses(sender, instance, **kwargs):
+    bump_shop_version(instance.shop_profile_id)
@@ -1,3 +1,301 @@
-from django.test import TestCase
+import datetime
+import io
+import tempfile
+from io import StringIO
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connections, router
+from django.test.utils import CaptureQueriesContext
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, TransactionTestCase, override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+
+from bookingManagement.models import Booking, BookingService
+from common.db import PIN_COOKIE_NAME, _pinned_to_primary, _use_replica
+from common.geo import encode_geohash
+from common.storage import IMMUTABLE_CACHE_CONTROL, ContentAddressedS3Storage, is_blob_name
+from jobManagement.models import Job
+from jobManagement.queue import claim_job, run_job
+from .models import ShopProfile, ShopProfileImage, ShopReview, ShopService, ShopServicesImage
+
+
+class RatingSummaryTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.shop = ShopProfile.objects.create(shop_name="Shop", about_us="", email="shop@example.com",
+                                               phone_number="0", address="", latitude=12.97, longitude=77.59,
+                                               geohash=encode_geohash(12.97, 77.59))
+
+    def test_add_review_updates_summary(self):
+        for rating in (5, 4, 5):
+            self.client.post(f'/shop/{self.shop.shop_id}/add-review', {'review_body': "Nice", 'rating': rating})
+
+        response = self.client.get(f'/app/shop/{self.shop.shop_id}/reviews')
+        self.assertEqual(response.json()['rating'], {
+            "average": 4.67, "count": 3, "histogram": {"1": 0, "2": 0, "3": 0, "4": 1, "5": 2}})
+
+        response = self.client.get('/app/get_shops_nearby/', {'latitude': 12.97, 'longitude': 77.59})
+        self.assertEqual(response.data['nearby_shops'][0]['rating']['count'], 3)
+
+    def test_rebuild_command_matches_reviews(self):
+        ShopReview.objects.create(shop_profile=self.shop, review_body="Ok", rating=3)
+        ShopProfile.objects.filter(shop_id=self.shop.shop_id).update(rating_count=7, rating_5=7, rating_sum=35)
+
+        call_command('rebuild_rating_summary', stdout=StringIO())
+        self.shop.refresh_from_db()
+        self.assertEqual((self.shop.rating_count, self.shop.rating_sum, self.shop.rating_3, self.shop.rating_5), (1, 3, 1, 0))
+
+
+class EarningsSeriesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.shop = ShopProfile.objects.create(shop_name="Shop", about_us="", email="shop@example.com",
+                                              phone_number="0", address="")
+        haircut = ShopService.objects.create(shop_profile=cls.shop, name="Haircut", price=10,
+                                             duration=datetime.timedelta(minutes=30))
+        beard = ShopService.objects.create(shop_profile=cls.shop, name="Beard", price=5,
+                                           duration=datetime.timedelta(minutes=15))
+        for day, service, total_price, booking_status in (((1, 7), haircut, 10, '0'), ((1, 8), beard, 5, '1'),
+                                                          ((1, 14), haircut, 10, '0'), ((2, 4), haircut, 20, '1'),
+                                                          ((1, 7), haircut, 100, '2')):
+            booking = Booking.objects.create(user_id="user", status=booking_status, shop_profile=cls.shop,
+                                             booking_date=datetime.date(2030, *day), booking_time=datetime.time(10, 0),
+                                             total_price=total_price)
+            BookingService.objects.create(booking=booking, shop_service=service)
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def series(self, granularity):
+        return self.client.get(f'/shop/{self.shop.shop_id}/earnings/series',
+                               {'granularity': granularity, 'start_date': '2030-01-01', 'end_date': '2030-02-28'})
+
+    def test_buckets_per_granularity(self):
+        expected = {
+            'day': (['2030-01-07', '2030-01-08', '2030-01-14', '2030-02-04'], [10, 5, 10, 20], [1, 1, 1, 1]),
+            'week': (['2030-01-07', '2030-01-14', '2030-02-04'], [15, 10, 20], [2, 1, 1]),
+            'month': (['2030-01-01', '2030-02-01'], [25, 20], [3, 1]),
+        }
+        for granularity, (buckets, revenue, num_of_bookings) in expected.items():
+            with self.subTest(granularity=granularity):
+                response = self.series(granularity)
+                self.assertEqual(response.status_code, 200)
+                # Cancelled bookings are left out
+                self.assertEqual(response.data['series'], {'bucket': buckets, 'revenue': revenue,
+                                                           'num_of_bookings': num_of_bookings})
+
+    def test_per_service_breakdown(self):
+        services = self.series('month').data['services']
+        self.assertEqual((services['name'], services['revenue'], services['num_of_bookings']),
+                         (["Haircut", "Beard"], [40, 5], [3, 1]))
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.series('year').status_code, 400)
+        self.assertEqual(self.client.get(f'/shop/{self.shop.shop_id}/earnings/series',
+                                         {'start_date': '2030-02-01', 'end_date': '2030-01-01'}).status_code, 400)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), JOB_QUEUE={'EAGER': True})
+class ImageDerivativeTests(TestCase):
+
+    def test_add_service_generates_derivatives(self):
+        shop = ShopProfile.objects.create(shop_name="Shop", about_us="", email="shop@example.com", phone_number="0", address="")
+        exif = Image.Exif()
+        exif[0x010F] = "Camera"
+        upload = io.BytesIO()
+        Image.new('RGB', (3840, 2400), 'red').save(upload, 'JPEG', exif=exif)
+
+        client = APIClient()
+        client.post(f'/shop/{shop.shop_id}/add-service', {
+            'name': "Cut", 'price': 10, 'duration': 30, 'images': SimpleUploadedFile('big.jpg', upload.getvalue())})
+
+        derivatives = ShopServicesImage.objects.get().derivatives
+        self.assertEqual((derivatives['thumb']['width'], derivatives['thumb']['height']), (160, 160))
+        self.assertEqual((derivatives['full']['width'], derivatives['full']['height']), (1600, 1000))
+        with default_storage.open(derivatives['card']['name']) as stored, Image.open(stored) as image:
+            self.assertEqual(image.size, (640, 400))
+            self.assertFalse(image.getexif())
+
+        service = client.get(f'/app/shop/{shop.shop_id}/services').json()['results'][0]
+        self.assertTrue(service['images'][0]['derivatives']['thumb'].startswith('http://testserver/'))
+
+    @override_settings(JOB_QUEUE={'EAGER': False})
+    def test_worker_refreshes_cached_service_responses(self):
+        shop = ShopProfile.objects.create(shop_name="Shop", about_us="", email="shop@example.com", phone_number="0", address="")
+        upload = io.BytesIO()
+        Image.new('RGB', (64, 64), 'red').save(upload, 'JPEG')
+        client = APIClient()
+        client.post(f'/shop/{shop.shop_id}/add-service', {
+            'name': "Cut", 'price': 10, 'duration': 30, 'images': SimpleUploadedFile('small.jpg', upload.getvalue())})
+
+        url = f'/app/shop/{shop.shop_id}/services'
+        before = client.get(url)
+        self.assertEqual(before.json()['results'][0]['images'][0]['derivatives'], {})
+
+        job = Job.objects.get()
+        self.assertTrue(claim_job(job.job_id, 'worker', 60))
+        self.assertTrue(run_job(Job.objects.get(), 'worker'))
+
+        after = client.get(url, HTTP_IF_NONE_MATCH=before['ETag'])
+        self.assertEqual(after.status_code, 200)
+        self.assertIn('thumb', after.json()['results'][0]['images'][0]['derivatives'])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), JOB_QUEUE={'EAGER': True})
+class ContentAddressedStorageTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.shop = ShopProfile.objects.create(shop_name="Shop", about_us="", email="shop@example.com",
+                                               phone_number="0", address="")
+
+    def jpeg(self, color):
+        upload = io.BytesIO()
+        Image.new('RGB', (64, 64), color).save(upload, 'JPEG')
+        return SimpleUploadedFile('photo.jpg', upload.getvalue())
+
+    def test_identical_bytes_share_one_blob(self):
+        first = default_storage.save('shop_images/a.jpg', self.jpeg('red'))
+        second = default_storage.save('shop_images/b.jpg', self.jpeg('red'))
+        self.assertEqual(first, second)
+        self.assertTrue(is_blob_name(first))
+        self.assertNotEqual(default_storage.save('shop_images/c.jpg', self.jpeg('blue')), first)
+
+    def test_update_shop_profile_only_replaces_changed_images(self):
+        url = f'/shop/{self.shop.shop_id}/update-profile'
+        self.client.put(url, {'images': [self.jpeg('red'), self.jpeg('blue')]}, format='multipart')
+        before = dict(ShopProfileImage.objects.values_list('image', 'image_id'))
+
+        self.client.put(url, {'images': [self.jpeg('red'), self.jpeg('green')]}, format='multipart')
+        after = dict(ShopProfileImage.objects.values_list('image', 'image_id'))
+
+        self.assertEqual(len(after), 2)
+        unchanged = default_storage.save('shop_images/x.jpg', self.jpeg('red'))
+        self.assertEqual(after[unchanged], before[unchanged])
+        self.assertNotIn(default_storage.save('shop_images/x.jpg', self.jpeg('blue')), after)
+
+    def test_blobs_are_served_immutable(self):
+        name = default_storage.save('shop_images/a.jpg', self.jpeg('red'))
+        response = self.client.get(default_storage.url(name))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], IMMUTABLE_CACHE_CONTROL)
+
+    def test_only_upload_directories_are_served(self):
+        with open(f'{settings.MEDIA_ROOT}/secret.txt', 'w') as secret:
+            secret.write("secret")
+        for path in ('shop_images/../secret.txt', 'shop_images/%2e%2e/secret.txt', 'shop_images/..%2fsecret.txt',
+                     'secret.txt', 'shop_images/../../etc/passwd', 'shop_images\\..\\secret.txt'):
+            self.assertEqual(self.client.get(f'/media/{path}').status_code, 404, path)
+
+
+class FakeS3Client:
+    """The slice of the boto3 S3 client ContentAddressedS3Storage uses, kept in memory."""
+
+    class exceptions:
+        class ClientError(Exception):
+            def __init__(self, code):
+                super().__init__(code)
+                self.response = {'Error': {'Code': code}}
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = []
+
+    def upload_fileobj(self, fileobj, bucket, key, ExtraArgs=None):
+        self.uploads.append((bucket, key, ExtraArgs))
+        self.objects[key] = fileobj.read()
+
+    def head_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise self.exceptions.ClientError('404')
+        return {'ContentLength': len(self.objects[Key])}
+
+    def get_object(self, Bucket, Key):
+        return {'Body': io.BytesIO(self.objects[Key])}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop(Key, None)
+
+
+@override_settings(MEDIA_STORAGE={'BUCKET': 'media', 'PUBLIC_URL': 'https://cdn.example.com'})
+class ContentAddressedS3StorageTests(TestCase):
+
+    def setUp(self):
+        self.client = FakeS3Client()
+        self.storage = ContentAddressedS3Storage(client=self.client)
+
+    def test_identical_bytes_are_uploaded_once(self):
+        first = self.storage.save('shop_images/a.JPG', SimpleUploadedFile('a.JPG', b'same bytes'))
+        second = self.storage.save('shop_images/b.jpg', SimpleUploadedFile('b.jpg', b'same bytes'))
+        self.assertEqual(first, second)
+        self.assertTrue(first.startswith('shop_images/') and first.endswith('.jpg') and is_blob_name(first))
+        self.assertEqual(len(self.client.uploads), 1)
+        self.assertEqual(self.storage.open(first).read(), b'same bytes')
+        self.assertEqual(self.storage.url(first), f'https://cdn.example.com/{first}')
+
+        self.storage.save('shop_images/c.jpg', SimpleUploadedFile('c.jpg', b'other bytes'))
+        self.assertEqual(len(self.client.uploads), 2)
+
+    def test_uploads_are_immutable_with_a_content_type(self):
+        name = self.storage.save('shop_images/a.png', SimpleUploadedFile('a.png', b'png'))
+        self.assertEqual(self.client.uploads[0], ('media', name, {
+            'ContentType': 'image/png',
+            'CacheControl': IMMUTABLE_CACHE_CONTROL,
+        }))
+
+    def test_exists_maps_not_found_and_raises_other_errors(self):
+        self.assertFalse(self.storage.exists('shop_images/missing.jpg'))
+
+        def denied(**kwargs):
+            raise FakeS3Client.exceptions.ClientError('403')
+        self.client.head_object = denied
+        with self.assertRaises(FakeS3Client.exceptions.ClientError):
+            self.storage.exists('shop_images/missing.jpg')
+
+
+# Not a TestCase: its transaction would hide the rows from the replica connection and keep reads on the primary
+@override_settings(DATABASE_REPLICAS=['local'])
+class ReadReplicaRoutingTests(TransactionTestCase):
+    databases = {'default', 'local'}
+
+    def setUp(self):
+        self.client = APIClient()
+        self.shop = ShopProfile.objects.create(shop_name="Shop", about_us="", email="shop@example.com",
+                                               phone_number="0", address="")
+
+    def test_read_endpoints_use_the_replica(self):
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['local']) as replica:
+            response = self.client.get(f'/shop/{self.shop.shop_id}/earnings')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(primary), 0)
+        self.assertGreater(len(replica), 0)
+
+    def test_writes_pin_the_client_to_the_primary(self):
+        response = self.client.post(f'/shop/{self.shop.shop_id}/add-review', {'review_body': "Nice", 'rating': 5})
+        self.assertIn(PIN_COOKIE_NAME, response.cookies)
+
+        with CaptureQueriesContext(connections['local']) as replica:
+            self.client.get(f'/shop/{self.shop.shop_id}/earnings')
+        self.assertEqual(len(replica), 0)
+
+    def test_router_outside_read_views(self):
+        self.assertEqual(router.db_for_read(ShopProfile), 'default')
+
+    def test_database_cache_stays_on_the_primary_without_pinning(self):
+        cache_entry = caches['default'].cache_model_class
+        # As inside a @replica_reads view of a request that has not written (setUp did)
+        replica_token, pin_token = _use_replica.set(True), _pinned_to_primary.set(False)
+        try:
+            self.assertEqual(router.db_for_read(cache_entry), 'default')
+            self.assertEqual(router.db_for_write(cache_entry), 'default')
+            self.assertEqual(router.db_for_read(ShopProfile), 'local')
+        finally:
+            _pinned_to_primary.reset(pin_token)
+            _use_replica.reset(replica_token)
@@ -12,6 +12,7 @@ urlpatterns = [
     path('<uuid:shop_id>/update-preferences',update_shop_preferences, name = 'update-shop-preferences'),
     path('<uuid:shop_id>/service/<uuid:service_id>/update-service',update_service, name = "update_barber_service"),
     path('<uuid:shop_id>/earnings', get_shop_earnings, name='shop-earnings'),
+    path('<uuid:shop_id>/earnings/series', get_shop_earnings_series, name='shop-earnings-series'),
     path('<uuid:shop_id>/disable-slot',disable_time_slot,name = 'disable_time_slot'),
     path('<uuid:shop_id>/create-barber-details', create_barber_details, name = 'create_barber_details')
 ]
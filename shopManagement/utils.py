@@ -1,14 +1,19 @@
-from math import radians, cos, sin, sqrt, atan2
+from common.geo import haversine_km
 
-def calculate_distance(lat1, lon1, lat2, lon2):
-    # Convert latitude and longitude from degrees to radians
-    lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
+# ShopProfile columns holding the review histogram, indexed by rating
+RATING_HISTOGRAM_FIELDS = ('rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5')
+RATING_SUMMARY_FIELDS = ('rating_count', 'rating_sum') + RATING_HISTOGRAM_FIELDS
 
-    # Haversine formula
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
-    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1-a))
-    distance = 6371 * c  # Radius of earth in kilometers. Use 3956 for miles
+def calculate_distance(lat1, lon1, lat2, lon2):
+    # Haversine distance in kilometers, see common.geo
+    return haversine_km(lat1, lon1, lat2, lon2)
 
-    return distance
+def rating_summary(shop):
+    # Works on a ShopProfile or on a values() row holding RATING_SUMMARY_FIELDS
+    get = shop.get if isinstance(shop, dict) else lambda field: getattr(shop, field)
+    count = get('rating_count')
+    return {
+        "average": round(get('rating_sum') / count, 2) if count else None,
+        "count": count,
+        "histogram": {str(rating): get(field) for rating, field in enumerate(RATING_HISTOGRAM_FIELDS, start=1)},
+    }
@@ -5,16 +5,33 @@ from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.parsers import MultiPartParser, FormParser
 
-from bookingManagement.models import Booking
+from bookingManagement.models import Booking, BookingService, ShopDailyEarnings
 from .models import BarberDetails, ShopService, ShopProfile, ShopProfileImage, ShopReview, ShopServicesImage, ShopSettings
 
 from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
 from datetime import datetime
 from datetime import timedelta
 from decimal import Decimal, InvalidOperation
 import uuid
 from drf_spectacular.utils import extend_schema, OpenApiParameter
 from bookingManagement.models import ShopBookingsCounter
+from common.geo import encode_geohash
+from common.db import replica_reads
+from common.storage import store_upload
+from jobManagement.tasks import enqueue_image_derivatives
+from applicationManagement.cache import bump_shop_version, invalidate_nearby_cache, invalidate_shop_services
+
+# Booking statuses that count towards earnings: Booked and Completed
+EARNING_BOOKING_STATUSES = ['0', '1']
+
+EARNINGS_TRUNC_FUNCTIONS = {
+    'day': TruncDay,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
 
 @api_view(['POST'])
 @parser_classes([MultiPartParser, FormParser])
@@ -39,6 +56,9 @@ def create_shop_profile(request):
 
         # Join the amenities list into a single string delimited by ':'
         venue_amenities = ':'.join(amenities_list) if amenities_list else ''
+
+        # Spatial index cell for nearby search
+        geohash = encode_geohash(latitude, longitude) if latitude is not None and longitude is not None else ''
         
         # Create a new shop profile
         shop_profile = ShopProfile.objects.create(
@@ -49,14 +69,19 @@ def create_shop_profile(request):
             address=address,
             latitude=latitude,
             longitude=longitude,
-            venue_amenities=venue_amenities
+            venue_amenities=venue_amenities,
+            geohash=geohash
         )
 
         # Save images if provided
         if images:
             for image in images:
                 new_image_id = uuid.uuid4()
-                ShopProfileImage.objects.create(image_id = new_image_id, shop_profile=shop_profile, image=image)
+                shop_image = ShopProfileImage.objects.create(image_id = new_image_id, shop_profile=shop_profile, image=image)
+                enqueue_image_derivatives(shop_image, 'image')
+
+        # Cached nearby results around the new shop are now incomplete
+        invalidate_nearby_cache((latitude, longitude))
 
         return Response({"message": "Shop profile created successfully.", "shop_id": shop_profile.shop_id},
                         status=status.HTTP_201_CREATED)
@@ -85,6 +110,7 @@ def update_shop_profile(request, shop_id):
         shop_profile = ShopProfile.objects.filter(shop_id=shop_id).first()
         if not shop_profile:
             return Response({"error": "Shop profile not found."}, status=status.HTTP_404_NOT_FOUND)
+        previous_location = (shop_profile.latitude, shop_profile.longitude)
 
         # Update fields if provided in the request
         if shop_name:
@@ -111,16 +137,35 @@ def update_shop_profile(request, shop_id):
         # Join the amenities list into a single string delimited by ':'
         if amenities_list:
             shop_profile.venue_amenities = ':'.join(amenities_list)
+
+        # Keep the spatial index cell in sync with the coordinates
+        if shop_profile.latitude is not None and shop_profile.longitude is not None:
+            shop_profile.geohash = encode_geohash(shop_profile.latitude, shop_profile.longitude)
+        else:
+            shop_profile.geohash = ''
         
         # Save the updated shop profile
         shop_profile.save()
 
-        # Update images if provided
+        # Cached nearby results carry the profile fields, so drop them around both the old and new location
+        invalidate_nearby_cache(previous_location, (shop_profile.latitude, shop_profile.longitude))
+        bump_shop_version(shop_profile.shop_id)
+
+        # Replace the images if provided. Blobs are named by content, so images sent again unchanged keep
+        # their rows and derivatives, and only new bytes are written and processed
         if images:
-            ShopProfileImage.objects.filter(shop_profile=shop_profile).delete()  # Remove old images
+            existing_images = {shop_image.image.name: shop_image for shop_image in ShopProfileImage.objects.filter(shop_profile=shop_profile)}
+            kept_image_ids = []
             for image in images:
+                image_name = store_upload(ShopProfileImage, 'image', image)
+                if image_name in existing_images:
+                    kept_image_ids.append(existing_images.pop(image_name).image_id)
+                    continue
                 new_image_id = uuid.uuid4()
-                ShopProfileImage.objects.create(image_id=new_image_id, shop_profile=shop_profile, image=image)
+                shop_image = ShopProfileImage.objects.create(image_id=new_image_id, shop_profile=shop_profile, image=image_name)
+                kept_image_ids.append(new_image_id)
+                enqueue_image_derivatives(shop_image, 'image')
+            ShopProfileImage.objects.filter(shop_profile=shop_profile).exclude(image_id__in=kept_image_ids).delete()  # Remove old images
 
         return Response({"message": "Shop profile updated successfully."}, status=status.HTTP_200_OK)
 
@@ -161,10 +206,12 @@ def add_service(request, shop_id):
             duration=duration_timedelta
         )
         if images:
-            new_image_id = uuid.uuid4()
             shop_service = ShopService.objects.get( service_id = new_service_id)
             for image in images:
-                ShopServicesImage.objects.create(image_id = new_image_id,service = shop_service, image=image)
+                service_image = ShopServicesImage.objects.create(image_id = uuid.uuid4(),service = shop_service, image=image)
+                enqueue_image_derivatives(service_image, 'image')
+        invalidate_shop_services(shop_profile.shop_id)
+        bump_shop_version(shop_profile.shop_id)
         return Response({"message": "Shop service created successfully.", "shop_id": shop_profile.shop_id,"service_id":new_service_id},
                     status=status.HTTP_201_CREATED)
     except ValidationError as e:
@@ -185,15 +232,24 @@ def add_review(request, shop_id):
         if rating < 1 or rating > 5:
             return HttpResponseBadRequest("Rating must be between 1 and 5.")
 
-        # Create the review
-        ShopReview.objects.create(
-            shop_profile=shop_profile,
-            # TODO: for now hard coded userid
-            # user= "123",
-            review_body=review_body,
-            rating=rating
-        )
-        
+        # Create the review and fold it into the shop's rating summary in the same transaction
+        with transaction.atomic():
+            ShopReview.objects.create(
+                shop_profile=shop_profile,
+                # TODO: for now hard coded userid
+                # user= "123",
+                review_body=review_body,
+                rating=rating
+            )
+            ShopProfile.objects.filter(shop_id=shop_profile.shop_id).update(**{
+                'rating_count': F('rating_count') + 1,
+                'rating_sum': F('rating_sum') + rating,
+                f'rating_{rating}': F(f'rating_{rating}') + 1,
+            })
+        # Nearby results carry the rating summary
+        invalidate_nearby_cache((shop_profile.latitude, shop_profile.longitude))
+        bump_shop_version(shop_profile.shop_id)
+
         return Response({"message": "Review Added Successfully!"}, status=status.HTTP_201_CREATED)
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -237,8 +293,14 @@ def update_service(request, shop_id, service_id):
                 return Response({"error": "Invalid duration format."}, status=status.HTTP_400_BAD_REQUEST)
         
         # Ensure the service is associated with the correct ShopProfile
+        previous_shop_id = service.shop_profile_id
         service.shop_profile = shop_profile
         service.save()
+        invalidate_shop_services(previous_shop_id)
+        bump_shop_version(previous_shop_id)
+        if previous_shop_id != shop_profile.shop_id:
+            invalidate_shop_services(shop_profile.shop_id)
+            bump_shop_version(shop_profile.shop_id)
         
         return Response({
             "message": "Shop service updated successfully.",
@@ -435,13 +497,13 @@ def disable_time_slot(request,shop_id):
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@replica_reads
 @api_view(['GET'])
 def get_shop_earnings(request, shop_id):
     try:
         # Get the date range for the query (optional query params)
-        start_date_str = request.data.get('start_date')
-        end_date_str = request.data.get('end_date')
-        print("start date uk: ", start_date_str)
+        start_date_str = request.GET.get('start_date') or request.data.get('start_date')
+        end_date_str = request.GET.get('end_date') or request.data.get('end_date')
         # If no date is provided, calculate today's earnings by default
         if not start_date_str or not end_date_str:
             today = datetime.today().date()
@@ -454,30 +516,94 @@ def get_shop_earnings(request, shop_id):
         # Get the shop profile
         shop_profile = ShopProfile.objects.get(shop_id=shop_id)
 
-        # Retrieve all bookings for the given shop and date range
+        # Sum the daily rollup (at most one row per day and status); cancelled and failed bookings don't earn
+        total_earnings = ShopDailyEarnings.objects.filter(
+            shop_profile=shop_profile,
+            earnings_date__range=[start_date, end_date],
+            status__in=EARNING_BOOKING_STATUSES
+        ).aggregate(total=Sum('total_earnings'))['total'] or Decimal(0)
+
+        return Response({
+            'shop_id': shop_id,
+            'start_date': start_date,
+            'end_date': end_date,
+            'total_earnings': round(total_earnings, 2)
+        }, status=status.HTTP_200_OK)
+
+    except ShopProfile.DoesNotExist:
+        return Response({"error": "Shop not found."}, status=status.HTTP_404_NOT_FOUND)
+    except Exception as e:
+        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    
+@api_view(['GET'])
+def get_shop_earnings_series(request, shop_id):
+    try:
+        granularity = request.GET.get('granularity', 'day')
+        if granularity not in EARNINGS_TRUNC_FUNCTIONS:
+            return Response({"error": "granularity must be one of: day, week, month."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Default to the last 30 days
+        try:
+            end_date = datetime.strptime(request.GET['end_date'], '%Y-%m-%d').date() if request.GET.get('end_date') else datetime.today().date()
+            start_date = datetime.strptime(request.GET['start_date'], '%Y-%m-%d').date() if request.GET.get('start_date') else end_date - timedelta(days=29)
+        except ValueError:
+            return Response({"error": "Invalid date format. Use YYYY-MM-DD."}, status=status.HTTP_400_BAD_REQUEST)
+        if start_date > end_date:
+            return Response({"error": "start_date must not be after end_date."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Get the shop profile
+        shop_profile = ShopProfile.objects.get(shop_id=shop_id)
+
         bookings = Booking.objects.filter(
             shop_profile=shop_profile,
-            booking_date__range=[start_date, end_date]
+            booking_date__range=[start_date, end_date],
+            status__in=EARNING_BOOKING_STATUSES
         )
 
-        # Manually calculate total earnings
-        total_earnings = Decimal(0.0)
-        for booking in bookings:
-            if booking.total_price:  # Ensure the booking has a total_price
-                total_earnings += booking.total_price
+        # Revenue per bucket, grouped in SQL
+        series = bookings.annotate(
+            bucket=EARNINGS_TRUNC_FUNCTIONS[granularity]('booking_date')
+        ).values('bucket').annotate(
+            revenue=Sum('total_price'),
+            num_of_bookings=Count('booking_id')
+        ).order_by('bucket')
+
+        # Revenue per service through the BookingService link
+        per_service = BookingService.objects.filter(booking__in=bookings).values(
+            'shop_service_id', 'shop_service__name'
+        ).annotate(
+            revenue=Sum('booking__total_price'),
+            num_of_bookings=Count('id')
+        ).order_by('-revenue', 'shop_service__name')
+
+        # Columnar arrays: index i of every list describes the same bucket / service
+        buckets = {'bucket': [], 'revenue': [], 'num_of_bookings': []}
+        for row in series:
+            buckets['bucket'].append(row['bucket'].isoformat())
+            buckets['revenue'].append(round(row['revenue'] or Decimal(0), 2))
+            buckets['num_of_bookings'].append(row['num_of_bookings'])
+
+        services = {'service_id': [], 'name': [], 'revenue': [], 'num_of_bookings': []}
+        for row in per_service:
+            services['service_id'].append(str(row['shop_service_id']))
+            services['name'].append(row['shop_service__name'])
+            services['revenue'].append(round(row['revenue'] or Decimal(0), 2))
+            services['num_of_bookings'].append(row['num_of_bookings'])
 
         return Response({
             'shop_id': shop_id,
             'start_date': start_date,
             'end_date': end_date,
-            'total_earnings': round(total_earnings, 2)
+            'granularity': granularity,
+            'series': buckets,
+            'services': services
         }, status=status.HTTP_200_OK)
 
     except ShopProfile.DoesNotExist:
         return Response({"error": "Shop not found."}, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-    
+
 @api_view(['POST'])
 def create_barber_details(request, shop_id):
     try:
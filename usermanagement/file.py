@@ -1,33 +1,16 @@
 # Python 3 program to calculate Distance Between Two Points on Earth
-from math import radians, cos, sin, asin, sqrt
+from common.geo import haversine_km
 
 
 def distance(lat1, lat2, lon1, lon2):
-
-    # The math module contains a function named
-    # radians which converts from degrees to radians.
-    lon1 = radians(lon1)
-    lon2 = radians(lon2)
-    lat1 = radians(lat1)
-    lat2 = radians(lat2)
-
-    # Haversine formula
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
-    a = sin(dlat / 2)**2 + cos(lat1) * cos(lat2) * sin(dlon / 2)**2
-
-    c = 2 * asin(sqrt(a))
-
-    # Radius of earth in kilometers. Use 3956 for miles
-    r = 6371
-
-    # calculate the result
-    return (c * r)
+    # Haversine formula, shared implementation lives in common.geo
+    return haversine_km(lat1, lon1, lat2, lon2)
 
 
 # driver code
-lat1 = 53.32055555555556
-lat2 = 53.31861111111111
-lon1 = -1.7297222222222221
-lon2 = -1.6997222222222223
-print(distance(lat1, lat2, lon1, lon2), "K.M")
+if __name__ == '__main__':
+    lat1 = 53.32055555555556
+    lat2 = 53.31861111111111
+    lon1 = -1.7297222222222221
+    lon2 = -1.6997222222222223
+    print(distance(lat1, lat2, lon1, lon2), "K.M")
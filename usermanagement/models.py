@@ -27,6 +27,8 @@ class UserProfile(models.Model):
     first_name = models.CharField(max_length=50, null=True, blank=True)
     last_name = models.CharField(max_length=50, null=True, blank=True)
     profile_picture = models.ImageField(upload_to='profile_pictures/', null=True, blank=True)
+    # Resized, EXIF-free copies keyed by size name, see common.images
+    profile_picture_derivatives = models.JSONField(default=dict, blank=True)
     
     def __str__(self):
         return f"{self.user.email}'s profile"
\ No newline at end of file
@@ -1,3 +1,36 @@
-from django.test import TestCase
+import io
+import tempfile
 
-# Create your tests here.
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+
+from jobManagement.models import Job
+from .models import User, UserProfile
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ProfilePictureDerivativeTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(email="user@example.com", mobile_number="1")
+
+    def png(self, color):
+        upload = io.BytesIO()
+        Image.new('RGB', (64, 64), color).save(upload, 'PNG')
+        return SimpleUploadedFile('me.png', upload.getvalue())
+
+    def test_new_picture_drops_old_derivatives_and_queues_a_job(self):
+        self.client.post(f'/user/{self.user.user_id}/profile/create/', {'profile_picture': self.png('red')},
+                         format='multipart')
+        # As if the first job had run
+        UserProfile.objects.update(profile_picture_derivatives={'thumb': {'name': 'profile_pictures/derivatives/old.webp'}})
+
+        response = self.client.put(f'/user/{self.user.user_id}/profile/update/', {'profile_picture': self.png('blue')},
+                                   format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['profile_picture_derivatives'], {})
+        self.assertEqual(UserProfile.objects.get().profile_picture_derivatives, {})
+        self.assertEqual(Job.objects.count(), 2)
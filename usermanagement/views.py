@@ -3,6 +3,8 @@ from rest_framework.response import Response
 from rest_framework import status
 from .models import User, UserProfile
 from django.db import IntegrityError
+from common.images import derivative_urls
+from jobManagement.tasks import enqueue_image_derivatives
 # import boto3
 # from botocore.exceptions import ClientError
 # import os
@@ -113,12 +115,15 @@ def create_user_profile(request, user_id):
         last_name=last_name,
         profile_picture=profile_picture
     )
+    if user_profile.profile_picture:
+        enqueue_image_derivatives(user_profile, 'profile_picture', 'profile_picture_derivatives')
 
     return Response({
         "message": "Profile created successfully",
         "first_name": user_profile.first_name,
         "last_name": user_profile.last_name,
-        "profile_picture": user_profile.profile_picture.url if user_profile.profile_picture else None
+        "profile_picture": user_profile.profile_picture.url if user_profile.profile_picture else None,
+        "profile_picture_derivatives": derivative_urls(user_profile.profile_picture_derivatives)
     }, status=status.HTTP_201_CREATED)
 
 @api_view(['PUT'])
@@ -142,13 +147,18 @@ def update_user_profile(request, user_id):
         user_profile.last_name = request.data.get('last_name')
     if 'profile_picture' in request.FILES:
         user_profile.profile_picture = request.FILES.get('profile_picture')
+        # The old picture's derivatives no longer apply; the queued job fills these in
+        user_profile.profile_picture_derivatives = {}
     
     # Save the updated profile
     user_profile.save()
+    if 'profile_picture' in request.FILES:
+        enqueue_image_derivatives(user_profile, 'profile_picture', 'profile_picture_derivatives')
     
     return Response({
         "message": "Profile updated successfully",
         "first_name": user_profile.first_name,
         "last_name": user_profile.last_name,
-        "profile_picture": user_profile.profile_picture.url if user_profile.profile_picture else None
+        "profile_picture": user_profile.profile_picture.url if user_profile.profile_picture else None,
+        "profile_picture_derivatives": derivative_urls(user_profile.profile_picture_derivatives)
     }, status=status.HTTP_200_OK)
\ No newline at end of file